@@ -0,0 +1,90 @@
+"""
+Regression benchmark for memory use of long running loops.
+
+Runs a while loop whose body declares variables (like the loops in
+tests/v1/final_test_v1.peep) in a separate interpreter process, samples its
+resident set size while it runs and fails if the RSS keeps growing with the
+iteration count. Needs /proc (Linux).
+
+usage: python benchmarks/loop_memory.py [iterations] [--interval SECONDS] [--max-growth MIB]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from os.path import abspath, dirname
+
+PROGRAM = """{
+    int i = 0;
+    int total = 0;
+    while (i < %d) {
+        bool b = i == 5;
+        int sq = i %% 10 * 2;
+        string s = "x";
+        if (b) { int inner = sq; total += inner; }
+        total += sq;
+        i += 1;
+    }
+    print(total);
+}"""
+
+def rss(pid):
+    """Current resident set size of a process in bytes"""
+    with open("/proc/{}/statm".format(pid)) as fh:
+        return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("iterations", type=int, nargs="?", default=10 ** 7)
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between RSS samples")
+    parser.add_argument("--max-growth", type=float, default=4.0, help="allowed RSS growth after the warm up in MiB")
+    args = parser.parse_args()
+    
+    root = dirname(dirname(abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    cmd = [sys.executable, "-m", "peep", "--no-cache", "-i", "-c", PROGRAM % args.iterations]
+    
+    start = time.time()
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE)
+    samples = []
+    
+    while proc.poll() is None:
+        try:
+            samples.append((time.time() - start, rss(proc.pid)))
+        except (OSError, IndexError): # process exited between poll() and the read
+            break
+        time.sleep(args.interval)
+    
+    out = proc.communicate()[0].decode().strip()
+    elapsed = time.time() - start
+    
+    for t, size in samples:
+        print("{:8.1f}s {:10.1f} MiB".format(t, size / 2 ** 20))
+    
+    print("{} iterations in {:.1f}s ({:.0f} iterations/s), program printed {}".format(args.iterations, elapsed, args.iterations / elapsed, out))
+    
+    if proc.returncode != 0:
+        print("FAIL: interpreter exited with {}".format(proc.returncode))
+        sys.exit(1)
+    
+    # ignore the first samples, they cover start up and parsing
+    steady = [size for _, size in samples[len(samples) // 4:]]
+    
+    if len(steady) < 2:
+        print("not enough samples to judge RSS growth, use more iterations or a shorter --interval")
+        return
+    
+    growth = (max(steady) - steady[0]) / 2 ** 20
+    print("RSS growth after warm up: {:.2f} MiB".format(growth))
+    
+    if growth > args.max_growth:
+        print("FAIL: memory grows with the iteration count")
+        sys.exit(1)
+    
+    print("OK")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Stress test for compiling and running programs concurrently in one process.
+
+Compiles and runs many generated programs on a thread pool. Every program
+has an error on a line of its own (an undeclared variable, a type error,
+a syntax or lex error or a division by zero at run time) and the test fails
+if a diagnostic reports another line or another program's name, ie.
+because state of one compilation leaked into another.
+
+usage: python benchmarks/parallel_compile.py [programs] [--threads N] [--lexer regex|classic] [--rounds N]
+"""
+
+import argparse
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from os.path import abspath, dirname
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from peep import Lexer, RegexLexer, Parser, Interpreter, Source, MemorySink, PeepError
+
+ERRORS = [
+    ("UndeclaredIdentError", "    print(missing);"),
+    ("TypeError", "    int bad = \"text\";"),
+    ("SyntaxError", "    total = ;"),
+    ("LexError", "    total = 1 $ 2;"),
+    ("DivisionByZeroError", "    print(total / (zero * 2));") # a variable divisor would report the line declaring it
+]
+
+def program(n):
+    """Returns the text of program n, the line of its error and the error's name"""
+    kind, line = ERRORS[n % len(ERRORS)]
+    lines = ["{", "    int total = 0;", "    int zero = 0;"]
+    lines += ["    total += {};".format(i) for i in range(n % 97)] # moves the error to another line
+    lines += [line, "    print(total);", "}"]
+    return "\n".join(lines), len(lines) - 2, kind
+
+def check(n, lexer):
+    """Compiles and runs program n, returns a description of what went wrong or None"""
+    text, lineno, kind = program(n)
+    name = "prog{}".format(n)
+    
+    try:
+        tree = Parser(lexer(Source.from_string(text, name))).parse()
+        Interpreter(tree, output=MemorySink()).interpret()
+    except PeepError as error:
+        if error.__class__.__name__ != kind or error.lineno != lineno:
+            return "{}: expected {} on line {}, got {}".format(name, kind, lineno, error)
+        if error.trace and error.trace[0][0] != name:
+            return "{}: runtime error reported in {}".format(name, error.trace[0][0])
+        return None
+    
+    return "{}: expected {} on line {}, ran without errors".format(name, kind, lineno)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("programs", type=int, nargs="?", default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--lexer", choices=["regex", "classic"], default="regex")
+    parser.add_argument("--rounds", type=int, default=3, help="times every program is compiled")
+    args = parser.parse_args()
+    
+    lexer = RegexLexer if args.lexer == "regex" else Lexer
+    sys.setswitchinterval(1e-6) # switch threads as often as possible so that compilations interleave
+    
+    start = time.time()
+    with ThreadPoolExecutor(args.threads) as pool:
+        failures = [f for f in pool.map(check, list(range(args.programs)) * args.rounds, [lexer] * args.programs * args.rounds) if f is not None]
+    elapsed = time.time() - start
+    
+    total = args.programs * args.rounds
+    print("{} compilations on {} threads in {:.1f}s ({:.0f} programs/s)".format(total, args.threads, elapsed, total / elapsed))
+    
+    for failure in failures[:10]:
+        print(failure)
+    
+    if failures:
+        print("FAIL: {} of {} diagnostics were wrong".format(len(failures), total))
+        sys.exit(1)
+    
+    print("OK")
+
+if __name__ == "__main__":
+    main()
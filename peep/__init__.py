@@ -10,7 +10,20 @@ from peep.treewalker import TreeWalker
 from peep.astprinter import ASTPrinter
 from peep.defaultvals import Default
 from peep.scope import Scope
+from peep.quicken import Quickener
+from peep.output import Output, StdoutSink, FileSink, MemorySink
+from peep.inputs import Input, StreamInput, FileInput, ListInput
 from peep.intrp import Interpreter
-from peep.token import TokenTag, Token
-from peep.lexer import Lexer
+from peep.compiler import Compiler, Code
+from peep.folding import fold
+from peep.optimize import Optimizer
+from peep.cse import CSE
+from peep.vectorize import Vectorizer
+from peep.vm import VM
+from peep.transpiler import Transpiler, PyEngine
+from peep.closures import ClosureCompiler, ClosureEngine
+from peep.token import TokenTag, Token, TokenBuffer
+from peep.source import Source
+from peep.lexer import Lexer, RegexLexer, ParallelLexer
 from peep.parse import Parser
+from peep.cache import ASTCache
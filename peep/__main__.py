@@ -2,30 +2,96 @@ import argparse
 import sys
 
 from peep import Lexer
+from peep import RegexLexer
+from peep import ParallelLexer
 from peep import Parser
 from peep import ASTPrinter
 from peep import Interpreter
+from peep.intrp import HOT_LOOP
+from peep import VM
+from peep import PyEngine
+from peep import ClosureEngine
+from peep import Source
+from peep import Optimizer
+from peep import CSE
+from peep.cse import count_nodes
+from peep import Vectorizer
+from peep import ASTCache
+from peep import PeepError, print_error
+from peep import StdoutSink, FileSink
+from peep import StreamInput, FileInput
+from peep.output import BUFFER_SIZE
 
 peep_ver = "1.1.2"
 
-def p_ast(lexer):
-    root = Parser(lexer).parse()
+LEXERS = {
+    "regex": RegexLexer,
+    "parallel": ParallelLexer,
+    "classic": Lexer
+}
+
+ENGINES = {
+    "tree": Interpreter,
+    "vm": VM,
+    "py": PyEngine,
+    "closure": ClosureEngine
+}
+
+def parse(source, lexer_cls, cache):
+    """Returns the checked tree for source, from the cache when it has an entry for it"""
+    if cache is not None:
+        root = cache.load(source)
+        
+        if root is not None:
+            root.filename = source.name # the same program may have been cached under another name
+            return root
+    
+    root = Parser(lexer_cls(source)).parse()
+    
+    if cache is not None:
+        cache.store(source, root)
+    
+    return root
+
+def p_ast(root):
     astprinter = ASTPrinter(root)
     astprinter.print_ast()
-    from peep.util import filename
-    assert filename is not None
-    astprinter.write(filename)
+    astprinter.write(root.filename)
 
-def i(lexer):
-    root = Parser(lexer).parse()
-    interpreter = Interpreter(root)
+def compile_code(root, engine, source, cache, optimized=False, cse=False):
+    """
+    Returns the compiled form of the program engine runs (None for engines
+    running the tree directly), from the cache when it has an entry for it
+    """
+    if not hasattr(engine, "compile") or root is None:
+        return None
+    
+    kind = engine.__name__ + ("-O" if optimized else "") + ("-cse" if cse else "")
+    code = cache.load(source, kind) if cache is not None else None
+    
+    if code is None:
+        code = engine.compile(root)
+        
+        if cache is not None:
+            cache.store(source, code, kind)
+    
+    return code
+
+def i(root, engine=Interpreter, code=None, **options):
+    interpreter = engine(root, **options) if code is None else engine(root, code, **options)
     interpreter.interpret()
+    return interpreter
 
 def version():
     print('v' + peep_ver)
 
 def main():
-    parser = argparse.ArgumentParser()
+    if sys.argv[1:2] == ["batch"]:
+        from peep import batch # peep.batch imports this module
+        batch.main(sys.argv[2:])
+        return
+    
+    parser = argparse.ArgumentParser(epilog="Use 'peep batch -h' to run many programs at once.")
     
     group = parser.add_mutually_exclusive_group(required=True)
     
@@ -33,23 +99,94 @@ def main():
     group.add_argument("-p", "--print_ast", help="Print AST (Abstract Syntax Tree) for the program in a seperate .xml file", action="store_true")
     group.add_argument("-i", help="Execute the program from the source file", action="store_true")
     
-    parser.add_argument("file", type=str, help="file with a .peep extension")
+    parser.add_argument("file", type=str, nargs="?", help="file with a .peep extension (may be compressed with gzip or xz), or - to read the program from stdin")
+    parser.add_argument("-c", "--code", type=str, help="Program passed in as a string (instead of a file)")
+    parser.add_argument("--mmap", help="Memory-map the source file instead of reading it (default for large files)", action="store_true", default=None)
     parser.add_argument("--version", help="Show current version of Peep", action="store_true")
+    parser.add_argument("--lexer", help="Lexer engine used to tokenize the program (default: regex)", choices=LEXERS.keys(), default="regex")
+    parser.add_argument("--engine", help="How the program is executed: tree walking interpreter, bytecode virtual machine, translated to Python or compiled to closures (default: tree)", choices=ENGINES.keys(), default="tree")
+    parser.add_argument("--hot-loop", type=int, help="Iterations after which the tree walking interpreter compiles a loop to Python, 0 never does (default: {})".format(HOT_LOOP), default=HOT_LOOP)
+    parser.add_argument("-O", "--optimize", help="Propagate constants, remove dead code and move loop-invariant expressions out of loops before running the program", action="store_true")
+    parser.add_argument("--cse", help="Share identical expressions and compute the ones repeated in straight-line code once", action="store_true")
+    parser.add_argument("--vectorize", help="Run for loops doing int and float arithmetic only with NumPy (tree and closure engines, needs numpy)", action="store_true")
+    parser.add_argument("--stats", help="Print the number of AST nodes before and after --cse and of loops the tree walking interpreter compiled to stderr", action="store_true")
+    parser.add_argument("--input", type=str, help="Read what scan() reads from this file instead of stdin")
+    parser.add_argument("--output", type=str, help="Write what the program prints to this file instead of stdout")
+    parser.add_argument("--buffer-size", type=int, help="Characters of output collected before they are written out (default: {})".format(BUFFER_SIZE), default=BUFFER_SIZE)
+    parser.add_argument("--unbuffered", help="Write every line as soon as it is printed (ie. for interactive use)", action="store_true")
+    parser.add_argument("--cache-dir", type=str, help="Directory of the .peepc cache of parsed programs (default: $PEEP_CACHE_DIR or ~/.cache/peep)")
+    parser.add_argument("--cache-size", type=int, help="Size limit of the .peepc cache in MiB (default: 64)", default=64)
+    parser.add_argument("--no-cache", help="Always lex and parse the program instead of using the .peepc cache", action="store_true")
     
     args = parser.parse_args()
     
     if args.version:
         version()
     
+    if (args.file is None) == (args.code is None):
+        parser.error("exactly one of file and --code is required")
+    
+    if args.code is not None:
+        source = Source.from_string(args.code)
+    elif args.file == "-":
+        source = Source.from_stdin()
+    else:
+        try:
+            source = Source.from_file(args.file, args.mmap)
+        except FileNotFoundError:
+            print("That file does not exist!")
+            sys.exit(1)
+    
+    cache = None
+    if not args.no_cache:
+        cache = ASTCache(args.cache_dir, args.cache_size * 1024 * 1024, peep_ver)
+    
     try:
-        lexer = Lexer(args.file)
-    except LexError as le:
-        return
+        run(args, source, cache)
+    except PeepError as error:
+        print_error(error) # errors in the program are reported on stdout, the exit code stays 0
+
+def run(args, source, cache):
+    """Parses, transforms and prints or runs the program, raises PeepError if it has errors"""
+    root = transform(parse(source, LEXERS[args.lexer], cache), args)
     
     if args.print_ast:
-        p_ast(lexer)
+        p_ast(root)
     elif args.i:
-        i(lexer)
+        engine = ENGINES[args.engine]
+        buffer_size = 0 if args.unbuffered else args.buffer_size
+        output = StdoutSink(buffer_size) if args.output is None else FileSink(args.output, buffer_size)
+        input = StreamInput() if args.input is None else FileInput(args.input)
+        options = {"output": output, "input": input}
+        if engine is Interpreter:
+            options["hot_loop"] = args.hot_loop or None
+        
+        try:
+            interpreter = i(root, engine, compile_code(root, engine, source, cache, args.optimize, args.cse), **options)
+        finally:
+            output.close()
+            input.close()
+        
+        if args.stats and engine is Interpreter:
+            print("loops compiled: {}".format(interpreter.promoted), file=sys.stderr)
+
+def transform(root, args):
+    """Applies the optimizations asked for in args to the tree of a program"""
+    if args.optimize:
+        root = Optimizer().optimize(root)
+    
+    if args.cse:
+        before = count_nodes(root)
+        cse = CSE()
+        root = cse.eliminate(root)
+        
+        if args.stats:
+            print("nodes: {} before, {} after, {} common subexpressions".format(before, count_nodes(root), cse.ntemps), file=sys.stderr)
+    
+    if args.vectorize:
+        root = Vectorizer().vectorize(root)
+    
+    return root
 
 if __name__ == '__main__':
     main()
@@ -1,13 +1,12 @@
 from abc import ABC, abstractmethod
 from peep import TypeError, raise_error
 from peep import Type
+from peep.context import current_lineno
 
 class ASTNode(ABC):
     def __init__(self, value):
         self.value = value
-        
-        from peep import lexer
-        self.lineno = lexer.lineno
+        self.lineno = current_lineno()
     
     @abstractmethod
     def accept(self, tree_walker):
@@ -17,14 +16,16 @@ class Identifier(ASTNode):
     def __init__(self, type, name):
         super().__init__(name)
         self.type = type
+        self.slot = None # index of the variable in the activation record, assigned by the parser
     
     def accept(self, tree_walker):
         return tree_walker.visit_ident(self)
 
 class Constant(ASTNode):
-    def __init__(self, type, value):
-        super().__init__(value)
+    def __init__(self, type, value, lexeme=None):
+        super().__init__(value) # decoded Python value (int, float, bool or str)
         self.type = type
+        self.lexeme = lexeme # how the literal is written in the source, None if it was folded
     
     def accept(self, tree_walker):
         return tree_walker.visit_const(self)
@@ -46,14 +47,43 @@ class BinaryOp(ASTNode):
     def accept(self, tree_walker):
         pass
 
-class OrOperator(BinaryOp):
+# abstract
+class ChainOp(ASTNode):
+    """
+    A chain of left-associative operators of the same precedence (ie. a + b - c)
+    stored as flat lists of operands and operators instead of a left-deep tree
+    """
+    
+    def __init__(self, left, right, op):
+        super().__init__(None)
+        self.operands = [left]
+        self.ops = []
+        self.type = left.type
+        self.extend(op, right)
+    
+    def extend(self, op, right):
+        """Appends "op right" to the chain, doing the same type checks as BinaryOp"""
+        self.lineno = current_lineno()
+        
+        if not Type.check_match(self.type, right.type):
+            raise_error(TypeError(self.lineno, "Types does not match! (left operand type:{}, right operand type:{})".format(self.type, right.type)))
+        if not Type.is_type_ok(self.type, op):
+            raise_error(TypeError(self.lineno, "Incompatible types for an operator (operand type:{}, operator:{})".format(self.type, op)))
+        self.type = Type.combine(self.type, op)
+        self.operands.append(right)
+        self.ops.append(op)
+    
+    def accept(self, tree_walker):
+        pass
+
+class OrOperator(ChainOp):
     def __init__(self, left, right):
         super().__init__(left, right, '||')
     
     def accept(self, tree_walker):
         return tree_walker.visit_orop(self)
 
-class AndOperator(BinaryOp):
+class AndOperator(ChainOp):
     def __init__(self, left, right):
         super().__init__(left, right, '&&')
     
@@ -74,14 +104,14 @@ class RelationalOp(BinaryOp):
     def accept(self, tree_walker):
         return tree_walker.visit_relop(self)
 
-class AddictiveOp(BinaryOp):
+class AddictiveOp(ChainOp):
     def __init__(self, left, right, op):
         super().__init__(left, right, op)
     
     def accept(self, tree_walker):
         return tree_walker.visit_addop(self)
 
-class MultiplicativeOp(BinaryOp):
+class MultiplicativeOp(ChainOp):
     def __init__(self, left, right, op):
         super().__init__(left, right, op)
     
@@ -95,7 +125,7 @@ class UnaryOp(ASTNode):
         self.operand = operand
         
         if not Type.is_type_ok(operand.type, op, is_unary=True):
-            raise_error(TypeError("Incompatible types for an operator! (operand type:{}, operator:{})".format(operand.type, op)))
+            raise_error(TypeError(self.lineno, "Incompatible types for an operator! (operand type:{}, operator:{})".format(operand.type, op)))
         self.type = Type.combine(operand.type, op)
     
     def accept(self, tree_walker):
@@ -272,18 +302,20 @@ class Scan(ASTNode):
         return tree_walker.visit_scan(self)
 
 class Block(ASTNode):
-    def __init__(self, prev_blk, stmt):
+    def __init__(self, stmts):
         super().__init__(None)
-        self.prev_blk = prev_blk
-        self.stmt = stmt
+        self.stmts = stmts
     
     def accept(self, tree_walker):
         return tree_walker.visit_blk(self)
 
 class Program(ASTNode):
-    def __init__(self, block):
+    def __init__(self, block, nslots=0, filename="string"):
         super().__init__(None)
         self.block = block
+        self.nslots = nslots # number of variable slots the main activation record needs
+        self.filename = filename # name runtime errors report the program under
+        self.quickened = False # set once Quickener has rewritten the tree
     
     def accept(self, tree_walker):
         return tree_walker.visit_prgm(self)
@@ -1,4 +1,5 @@
 from peep import TreeWalker
+from peep import Type
 
 
 class FileBuffer:
@@ -28,7 +29,12 @@ class ASTPrinter(TreeWalker):
         self._file_writeline('<Identifier type=\"{}\" name=\"{}\"></Identifier>'.format(ident.type, ident.value))
 
     def visit_const(self, const):
-        const_val = str(const.value)
+        const_val = const.lexeme
+        if const_val is None: # folded constant
+            if const.type == Type.BOOL:
+                const_val = "true" if const.value else "false"
+            else:
+                const_val = str(const.value)
         if "&" in const_val:
             possible_lone_amps = const_val.split("&")
             for index, sub_str in enumerate(possible_lone_amps):
@@ -54,16 +60,16 @@ class ASTPrinter(TreeWalker):
     def visit_orop(self, orop):
         self._file_writeline('<OrOperator>')
         self.indent += self.ind_inc
-        orop.left.accept(self)
-        orop.right.accept(self)
+        for operand in orop.operands:
+            operand.accept(self)
         self.indent -= self.ind_inc
         self._file_writeline('</OrOperator>')
 
     def visit_andop(self, andop):
         self._file_writeline('<AndOperator>')
         self.indent += self.ind_inc
-        andop.left.accept(self)
-        andop.right.accept(self)
+        for operand in andop.operands:
+            operand.accept(self)
         self.indent -= self.ind_inc
         self._file_writeline('</AndOperator>')
 
@@ -84,18 +90,18 @@ class ASTPrinter(TreeWalker):
         self._file_writeline('</RelationalOp>')
 
     def visit_addop(self, addop):
-        self._file_writeline('<AddictiveOp op=\"{}\">'.format(addop.op))
+        self._file_writeline('<AddictiveOp op=\"{}\">'.format(' '.join(addop.ops)))
         self.indent += self.ind_inc
-        addop.left.accept(self)
-        addop.right.accept(self)
+        for operand in addop.operands:
+            operand.accept(self)
         self.indent -= self.ind_inc
         self._file_writeline('</AddictiveOp>')
 
     def visit_mulop(self, mulop):
-        self._file_writeline('<MultiplicativeOp op=\"{}\">'.format(mulop.op))
+        self._file_writeline('<MultiplicativeOp op=\"{}\">'.format(' '.join(mulop.ops)))
         self.indent += self.ind_inc
-        mulop.left.accept(self)
-        mulop.right.accept(self)
+        for operand in mulop.operands:
+            operand.accept(self)
         self.indent -= self.ind_inc
         self._file_writeline('</MultiplicativeOp>')
 
@@ -242,16 +248,8 @@ class ASTPrinter(TreeWalker):
         self._file_writeline('<Block>')
         self.indent += self.ind_inc
 
-        if blk.prev_blk is None:
-            self._file_writeline('<Block>')
-            self._file_writeline('</Block>')
-        else:
-            blk.prev_blk.accept(self)
-        if blk.stmt is None:
-            self._file_writeline('<EmptyStatement>')
-            self._file_writeline('</EmptyStatement>')
-        else:
-            blk.stmt.accept(self)
+        for stmt in blk.stmts:
+            stmt.accept(self)
 
         self.indent -= self.ind_inc
         self._file_writeline('</Block>')
@@ -0,0 +1,260 @@
+import argparse
+import contextlib
+import glob
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+from collections import OrderedDict
+
+from peep import Source
+from peep import ASTCache
+from peep import MemorySink
+from peep import FileInput, ListInput
+from peep import PeepError, format_error
+from peep import Interpreter
+from peep import Quickener
+from peep.intrp import HOT_LOOP
+from peep.__main__ import LEXERS, ENGINES, peep_ver, parse, transform, compile_code, i
+
+PROGRAM_EXTS = (".peep", ".peep.gz", ".peep.xz", ".peep.lzma")
+INPUT_EXT = ".in" # prog.peep reads prog.in when there is one
+MEMO_SIZE = 32 # compiled programs a worker keeps around
+
+# what a job's exit_code is for each status
+EXIT_CODES = {
+    "ok": 0, # ran to the end
+    "error": 1, # the program has an error (compile or run time)
+    "failed": 2, # the job couldn't run, ie. a missing file or scan() reading past the end of the input
+    "timeout": 124 # like timeout(1)
+}
+
+class JobTimeout(BaseException):
+    # not an Exception, so nothing in an engine catching those swallows it
+    pass
+
+def find_jobs(paths, input_ext=INPUT_EXT):
+    """
+    Returns (program, input) pairs for paths, each a directory (its .peep
+    files), a glob, a single program or a manifest. The input of a program
+    found in a directory or by a glob is the file next to it with input_ext
+    instead of .peep, None when there isn't one.
+    """
+    jobs = []
+    
+    for path in paths:
+        if os.path.isdir(path):
+            programs = sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(PROGRAM_EXTS))
+        elif glob.has_magic(path):
+            programs = sorted(glob.glob(path, recursive=True))
+        elif path.endswith(PROGRAM_EXTS):
+            programs = [path]
+        else:
+            jobs += read_manifest(path)
+            continue
+        
+        jobs += [(program, _input_for(program, input_ext)) for program in programs]
+    
+    return jobs
+
+def read_manifest(path):
+    """
+    Every line of a manifest is a program and optionally the file its scan()
+    reads, separated by whitespace and relative to the manifest's directory.
+    Blank lines and lines starting with # are skipped. A program may be
+    listed any number of times with different inputs.
+    """
+    base = os.path.dirname(path)
+    jobs = []
+    
+    with open(path, encoding="utf-8") as fh:
+        for lineno, line in enumerate(fh, 1):
+            fields = line.split()
+            
+            if not fields or fields[0].startswith("#"):
+                continue
+            if len(fields) > 2:
+                raise ValueError("{}:{}: expected a program and an input file, got {}".format(path, lineno, line.strip()))
+            
+            jobs.append((os.path.join(base, fields[0]), os.path.join(base, fields[1]) if len(fields) == 2 else None))
+    
+    return jobs
+
+def _input_for(program, input_ext):
+    root, ext = os.path.splitext(program)
+    if ext in (".gz", ".xz", ".lzma"):
+        root = os.path.splitext(root)[0]
+    path = root + input_ext
+    return path if os.path.isfile(path) else None
+
+@contextlib.contextmanager
+def deadline(seconds):
+    """Raises JobTimeout in the block once it has run seconds (never when 0 or where there is no SIGALRM, ie. Windows)"""
+    if not seconds or not hasattr(signal, "setitimer"):
+        yield
+        return
+    
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+def _expire(signum, frame):
+    raise JobTimeout()
+
+class Worker:
+    """
+    Runs jobs in a process of the pool. A program is compiled once per
+    worker and its tree (and compiled code) reused for all of its inputs,
+    other workers load it from the .peepc cache instead of parsing it again.
+    """
+    
+    def __init__(self, args):
+        self.args = args
+        self.engine = ENGINES[args.engine]
+        self.cache = None if args.no_cache else ASTCache(args.cache_dir, args.cache_size * 1024 * 1024, peep_ver)
+        self.programs = OrderedDict() # path -> (root, code) or the PeepError compiling it raised, most recently used last
+    
+    def run(self, job):
+        """Runs job, an (index, program, input) triple, and returns its result"""
+        index, program, input = job
+        output = MemorySink()
+        stderr = ""
+        start = time.perf_counter()
+        
+        try:
+            with deadline(self.args.timeout):
+                root, code = self.compile(program)
+                options = {"output": output, "input": ListInput([]) if input is None else FileInput(input)}
+                if self.engine is Interpreter:
+                    options["hot_loop"] = self.args.hot_loop or None
+                
+                try:
+                    i(root, self.engine, code, **options)
+                finally:
+                    options["input"].close()
+            status = "ok"
+        except JobTimeout:
+            self.programs.pop(program, None) # the job may have stopped halfway through changing the tree
+            status, stderr = "timeout", "Timed out after {}s".format(self.args.timeout)
+        except PeepError as error:
+            status, stderr = "error", format_error(error)
+        except Exception as error:
+            status, stderr = "failed", "{}: {}".format(error.__class__.__name__, error)
+        
+        return {
+            "job": index,
+            "program": program,
+            "input": input,
+            "status": status,
+            "exit_code": EXIT_CODES[status],
+            "stdout": output.getvalue(),
+            "stderr": stderr,
+            "time": round(time.perf_counter() - start, 6)
+        }
+    
+    def compile(self, program):
+        entry = self.programs.get(program)
+        
+        if entry is None:
+            try:
+                source = Source.from_file(program)
+                root = transform(parse(source, LEXERS[self.args.lexer], self.cache), self.args)
+                if self.engine is Interpreter:
+                    root = Quickener().quicken(root) # once instead of in every job
+                entry = root, compile_code(root, self.engine, source, self.cache, self.args.optimize, self.args.cse)
+            except PeepError as error:
+                entry = error # every job of a program with errors reports them
+            
+            self.programs[program] = entry
+            if len(self.programs) > MEMO_SIZE:
+                self.programs.popitem(last=False)
+        else:
+            self.programs.move_to_end(program)
+        
+        if isinstance(entry, PeepError):
+            raise entry
+        
+        return entry
+
+_worker = None
+
+def _init(args):
+    global _worker
+    _worker = Worker(args)
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # ^C stops the parent, which terminates the pool
+    if hasattr(signal, "SIGALRM"):
+        signal.signal(signal.SIGALRM, _expire)
+
+def _run(job):
+    return _worker.run(job)
+
+def run_batch(jobs, results, args):
+    """
+    Runs jobs on a pool of args.workers processes and writes their results
+    to results, a line of JSON per job in the order they finish. Returns
+    the number of jobs ending with each status.
+    """
+    counts = dict.fromkeys(EXIT_CODES, 0)
+    
+    # jobs of the same program go to the pool together, so they mostly land on a worker which has compiled it
+    queue = sorted(((index, program, input) for index, (program, input) in enumerate(jobs)), key=lambda job: job[1])
+    chunksize = max(1, min(16, len(queue) // (args.workers * 4)))
+    
+    with multiprocessing.Pool(args.workers, _init, (args,)) as pool:
+        for result in pool.imap_unordered(_run, queue, chunksize):
+            results.write(json.dumps(result) + "\n")
+            results.flush()
+            counts[result["status"]] += 1
+    
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="peep batch", description="Run many programs, each with its own input, on a pool of processes")
+    parser.add_argument("paths", nargs="+", help="directories of .peep files (prog.peep reads prog.in when there is one), globs, programs or manifests with a program and optionally an input file per line")
+    parser.add_argument("-o", "--results", type=str, help="JSON Lines file the result of every job is written to, - for stdout (default: results.jsonl)", default="results.jsonl")
+    parser.add_argument("-j", "--workers", type=int, help="Number of worker processes (default: number of CPUs)", default=os.cpu_count() or 1)
+    parser.add_argument("--timeout", type=float, help="Seconds a job may run before it is stopped, 0 for no limit (default: 10)", default=10.0)
+    parser.add_argument("--input-ext", type=str, help="Extension of the input files next to programs (default: {})".format(INPUT_EXT), default=INPUT_EXT)
+    parser.add_argument("--lexer", help="Lexer engine used to tokenize the programs (default: regex)", choices=LEXERS.keys(), default="regex")
+    parser.add_argument("--engine", help="How the programs are executed (default: tree)", choices=ENGINES.keys(), default="tree")
+    parser.add_argument("--hot-loop", type=int, help="Iterations after which the tree walking interpreter compiles a loop to Python, 0 never does (default: {})".format(HOT_LOOP), default=HOT_LOOP)
+    parser.add_argument("-O", "--optimize", help="Optimize the programs before running them", action="store_true")
+    parser.add_argument("--cse", help="Share identical expressions and compute the ones repeated in straight-line code once", action="store_true")
+    parser.add_argument("--vectorize", help="Run for loops doing int and float arithmetic only with NumPy (tree and closure engines, needs numpy)", action="store_true")
+    parser.add_argument("--cache-dir", type=str, help="Directory of the .peepc cache of parsed programs (default: $PEEP_CACHE_DIR or ~/.cache/peep)")
+    parser.add_argument("--cache-size", type=int, help="Size limit of the .peepc cache in MiB (default: 64)", default=64)
+    parser.add_argument("--no-cache", help="Don't share parsed programs between workers and runs through the .peepc cache", action="store_true")
+    parser.set_defaults(stats=False)
+    
+    args = parser.parse_args(argv)
+    
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    
+    try:
+        jobs = find_jobs(args.paths, args.input_ext)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+    
+    if not jobs:
+        parser.error("no programs found")
+    
+    start = time.perf_counter()
+    
+    if args.results == "-":
+        counts = run_batch(jobs, sys.stdout, args)
+    else:
+        with open(args.results, "w", encoding="utf-8") as results:
+            counts = run_batch(jobs, results, args)
+    
+    elapsed = time.perf_counter() - start
+    
+    print("{} jobs ({} programs) in {:.2f}s on {} workers, {:.1f} jobs/s: {}".format(
+        len(jobs), len(set(program for program, _ in jobs)), elapsed, args.workers, len(jobs) / elapsed,
+        ", ".join("{} {}".format(n, status) for status, n in counts.items())), file=sys.stderr)
@@ -0,0 +1,152 @@
+import gc
+import hashlib
+import marshal
+import os
+import pickle
+import sys
+import tempfile
+
+# bump this whenever the layout of the AST classes (or of the compiled forms
+# of a program) changes so that entries written by an older interpreter are
+# never unpickled into the new classes
+AST_FORMAT = 6
+
+# compiled forms hold marshalled code objects, which only the Python that wrote them can load
+PYTHON = "{}\0{}".format(sys.implementation.cache_tag or sys.version, marshal.version)
+
+MAGIC = b"PEEPC"
+SUFFIX = ".peepc"
+DEFAULT_SIZE_LIMIT = 64 * 1024 * 1024
+
+def default_dir():
+    if "PEEP_CACHE_DIR" in os.environ:
+        return os.environ["PEEP_CACHE_DIR"]
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "peep")
+
+class ASTCache:
+    """
+    On-disk cache of checked Program trees (.peepc files) keyed by the hash
+    of the program text, the interpreter version and the Python running it
+    (every install shares the directory), so unchanged programs skip the
+    lexer and the parser entirely. Other forms of a program (like the code
+    generated by an engine) are stored under a different kind.
+    
+    An entry is MAGIC, the sha256 of the payload and the pickled tree.
+    Entries that fail to verify or unpickle are deleted and rebuilt. The
+    directory is kept under size_limit bytes by evicting the least recently
+    used entries (every hit refreshes the entry's mtime).
+    """
+    
+    def __init__(self, directory=None, size_limit=DEFAULT_SIZE_LIMIT, version=""):
+        self.directory = directory if directory is not None else default_dir()
+        self.size_limit = size_limit
+        self.version = version
+    
+    def path(self, source, kind="ast"):
+        h = hashlib.sha256("{}\0{}\0{}\0{}\0".format(self.version, AST_FORMAT, PYTHON, kind).encode())
+        h.update(source.text.encode("utf-8", "surrogatepass"))
+        return os.path.join(self.directory, h.hexdigest() + SUFFIX)
+    
+    def load(self, source, kind="ast"):
+        """Returns the cached tree for source or None if there isn't a usable one"""
+        path = self.path(source, kind)
+        
+        try:
+            with open(path, "rb") as fh:
+                data = fh.read()
+        except OSError:
+            return None
+        
+        header = len(MAGIC) + hashlib.sha256().digest_size
+        payload = data[header:]
+        
+        if data[:len(MAGIC)] != MAGIC or data[len(MAGIC):header] != hashlib.sha256(payload).digest():
+            self._discard(path)
+            return None
+        
+        try:
+            root = _without_gc(pickle.loads, payload)
+        except Exception: # truncated or written by incompatible classes
+            self._discard(path)
+            return None
+        
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        
+        return root
+    
+    def store(self, source, root, kind="ast"):
+        """Writes root to the cache; failures only mean the next run parses again"""
+        try:
+            payload = _without_gc(pickle.dumps, root, pickle.HIGHEST_PROTOCOL)
+        except (RecursionError, pickle.PicklingError): # extremely deep trees
+            return
+        
+        data = MAGIC + hashlib.sha256(payload).digest() + payload
+        
+        if len(data) > self.size_limit:
+            return
+        
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+            
+            try:
+                with os.fdopen(fd, "wb") as fh:
+                    fh.write(data)
+                os.replace(tmp, self.path(source, kind)) # readers never see a half written entry
+            except OSError:
+                self._discard(tmp)
+                return
+            
+            self.evict()
+        except OSError:
+            pass
+    
+    def evict(self):
+        """Deletes least recently used entries until the cache fits in size_limit"""
+        entries = []
+        
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(SUFFIX):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        
+        for _, size, path in entries:
+            if total <= self.size_limit:
+                break
+            self._discard(path)
+            total -= size
+    
+    def clear(self):
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(SUFFIX):
+                    self._discard(entry.path)
+    
+    def _discard(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def _without_gc(func, *args):
+    # (un)pickling a big tree allocates hundreds of thousands of nodes, none of
+    # them garbage, and the cyclic collector would otherwise keep rescanning them
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return func(*args)
+    finally:
+        if enabled:
+            gc.enable()
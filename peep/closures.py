@@ -0,0 +1,424 @@
+import math
+import operator
+import sys
+
+from peep import Constant, Declaration, DivisionByZeroError, Identifier, If
+from peep import Default
+from peep import StdoutSink, StreamInput
+from peep import TreeWalker
+from peep import Type
+from peep.compiler import ARITHMETIC, DIVISIONS, comparison, division, is_zero, reads
+from peep.intrp import CallStack, main_record, raise_at, scan_input
+from peep.quicken import BREAK, CONTINUE, signals
+
+class ClosureCompiler(TreeWalker):
+    """
+    Turns every node of a checked AST into a Python closure with its
+    operators, types, literals and variable slots resolved up front.
+    Expression closures return their value, statement closures return None
+    or BREAK/CONTINUE.
+    """
+    
+    def __init__(self, engine, slots):
+        self.engine = engine
+        self.slots = slots
+    
+    def _binary(self, func, left, right):
+        """Returns a closure computing func(left, right), specialized for variable and constant operands"""
+        slots = self.slots
+        
+        if isinstance(right, Constant):
+            k = right.value
+            if isinstance(left, Identifier):
+                s = left.slot
+                return lambda: func(slots[s], k)
+            left = left.accept(self)
+            return lambda: func(left(), k)
+        
+        if isinstance(right, Identifier):
+            r = right.slot
+            if isinstance(left, Identifier):
+                s = left.slot
+                return lambda: func(slots[s], slots[r])
+            left = left.accept(self)
+            return lambda: func(left(), slots[r])
+        
+        left = left.accept(self)
+        right = right.accept(self)
+        return lambda: func(left(), right())
+    
+    def visit_ident(self, ident):
+        slots = self.slots
+        s = ident.slot
+        return lambda: slots[s]
+    
+    def visit_const(self, const):
+        k = const.value
+        return lambda: k
+    
+    def visit_orop(self, orop):
+        operands = [operand.accept(self) for operand in orop.operands]
+        
+        if len(operands) == 2:
+            left, right = operands
+            return lambda: left() or right()
+        return lambda: any(operand() for operand in operands)
+    
+    def visit_andop(self, andop):
+        operands = [operand.accept(self) for operand in andop.operands]
+        
+        if len(operands) == 2:
+            left, right = operands
+            return lambda: left() and right()
+        return lambda: all(operand() for operand in operands)
+    
+    def visit_eqop(self, eqop):
+        return self._binary(comparison(eqop), eqop.left, eqop.right)
+    
+    def visit_relop(self, relop):
+        return self._binary(comparison(relop), relop.left, relop.right)
+    
+    def visit_addop(self, addop):
+        operands = addop.operands
+        
+        if len(operands) == 2:
+            return self._binary(ARITHMETIC[addop.ops[0]], operands[0], operands[1])
+        
+        first = operands[0].accept(self)
+        rest = [(ARITHMETIC[op], operand.accept(self)) for op, operand in zip(addop.ops, operands[1:])]
+        
+        def run():
+            val = first()
+            for func, operand in rest:
+                val = func(val, operand())
+            return val
+        
+        return run
+    
+    def _check(self, type, lineno):
+        """Returns a function raising the tree walker's DivisionByZeroError for a zero divisor"""
+        engine = self.engine
+        
+        if type == Type.INT:
+            def check(right):
+                if right == 0:
+                    engine._raise(DivisionByZeroError(lineno), lineno)
+        else:
+            epsilon = sys.float_info.epsilon
+            
+            def check(right):
+                if math.fabs(right - 0.0) < epsilon: # right == 0.0
+                    engine._raise(DivisionByZeroError(lineno), lineno)
+        
+        return check
+    
+    def visit_mulop(self, mulop):
+        operands = mulop.operands
+        ops = mulop.ops
+        div = division(mulop.type)
+        
+        if len(ops) == 1:
+            if ops[0] not in DIVISIONS:
+                return self._binary(ARITHMETIC[ops[0]], operands[0], operands[1])
+            
+            func = div if ops[0] == '/' else operator.mod
+            left = operands[0].accept(self)
+            right = operands[1].accept(self)
+            check = self._check(mulop.type, operands[1].lineno)
+            
+            def run():
+                divisor = right() # the divisor is evaluated and checked first
+                check(divisor)
+                return func(left(), divisor)
+            
+            return run
+        
+        first = operands[0].accept(self)
+        rest = [(div if op == '/' else ARITHMETIC[op], op in DIVISIONS, operand.accept(self)) for op, operand in zip(ops, operands[1:])]
+        # divisors are evaluated and checked right to left before the dividend
+        divisors = [(i, rest[i][2], self._check(mulop.type, operands[i + 1].lineno)) for i in range(len(ops) - 1, -1, -1) if ops[i] in DIVISIONS]
+        
+        def run():
+            values = [None] * len(rest)
+            for i, divisor, check in divisors:
+                values[i] = divisor()
+                check(values[i])
+            
+            val = first()
+            for i, (func, checked, operand) in enumerate(rest):
+                val = func(val, values[i] if checked else operand())
+            return val
+        
+        return run
+    
+    def visit_uop(self, uop):
+        operand = uop.operand.accept(self)
+        
+        if uop.op == "-":
+            return lambda: -operand()
+        elif uop.op == "!":
+            return lambda: not operand()
+        return operand
+    
+    def visit_decl(self, decl):
+        slots = self.slots
+        s = decl.ident.slot
+        value = Default.default_value(decl.ident.type)
+        
+        def run():
+            slots[s] = value
+        
+        return run
+    
+    def visit_assign(self, assign):
+        slots = self.slots
+        ident = assign.ident
+        expr = assign.expr.accept(self)
+        
+        if isinstance(ident, Declaration) and reads(assign.expr, ident.ident):
+            s = ident.ident.slot
+            value = ident.accept(self) # int x = x + 1; sees the default value
+            
+            def run():
+                value()
+                slots[s] = expr()
+            
+            return run
+        
+        if isinstance(ident, Declaration):
+            ident = ident.ident
+        s = ident.slot
+        
+        def run():
+            slots[s] = expr()
+        
+        return run
+    
+    def _update(self, node, func, divides=False):
+        slots = self.slots
+        s = node.ident.slot
+        
+        if isinstance(node.expr, Constant) and not (divides and is_zero(node.expr.value, node.expr.type)):
+            k = node.expr.value
+            
+            def run():
+                slots[s] = func(slots[s], k)
+        elif divides:
+            expr = node.expr.accept(self)
+            check = self._check(node.expr.type, node.expr.lineno)
+            
+            def run():
+                right = expr()
+                check(right)
+                slots[s] = func(slots[s], right)
+        else:
+            expr = node.expr.accept(self)
+            
+            def run():
+                slots[s] = func(slots[s], expr())
+        
+        return run
+    
+    def visit_inc(self, inc):
+        return self._update(inc, operator.add)
+    
+    def visit_dec(self, dec):
+        return self._update(dec, operator.sub)
+    
+    def visit_mul_assign(self, mul_assign):
+        return self._update(mul_assign, operator.mul)
+    
+    def visit_div_assign(self, div_assign):
+        return self._update(div_assign, division(div_assign.ident.type), True)
+    
+    def visit_mod_assign(self, mod_assign):
+        return self._update(mod_assign, operator.mod, True)
+    
+    def _stmt(self, stmt):
+        """Compiles a block of an if statement or a loop (None for an empty one)"""
+        return (lambda: None) if stmt is None else stmt.accept(self)
+    
+    def visit_if(self, if_):
+        branches = [(br.test.accept(self), self._stmt(br.block)) for br in [if_] + if_.brs if isinstance(br, If)]
+        orelse = if_.brs[-1] if if_.brs and not isinstance(if_.brs[-1], If) else None
+        orelse = self._stmt(orelse)
+        
+        if len(branches) == 1:
+            test, block = branches[0]
+            
+            def run():
+                if test():
+                    return block()
+                return orelse()
+            
+            return run
+        
+        def run():
+            for test, block in branches:
+                if test():
+                    return block()
+            return orelse()
+        
+        return run
+    
+    def visit_while(self, while_):
+        test = while_.test.accept(self)
+        block = self._stmt(while_.block)
+        
+        if not signals(while_.block):
+            def run():
+                while test():
+                    block()
+            
+            return run
+        
+        def run():
+            while test():
+                if block() is BREAK:
+                    break
+        
+        return run
+    
+    def visit_for(self, for_):
+        init = for_.init.accept(self)
+        test = for_.test.accept(self)
+        step = for_.stmt.accept(self)
+        block = self._stmt(for_.block)
+        
+        if not signals(for_.block):
+            def run():
+                init()
+                while test():
+                    block()
+                    step()
+            
+            return run
+        
+        def run():
+            init()
+            while test():
+                if block() is BREAK:
+                    break
+                step()
+        
+        return run
+    
+    def visit_vector_for(self, for_):
+        slots = self.slots
+        s = for_.counter.slot
+        init = for_.init.accept(self)
+        bound = for_.bound.accept(self)
+        block = self._stmt(for_.block) # straight-line, it never breaks or continues
+        kernel = for_.kernel
+        step = for_.step
+        stop = for_.stop
+        
+        def run():
+            init()
+            start = slots[s]
+            values = range(start, stop(start, bound()), step)
+            
+            for value in values[kernel.run(slots, values):]: # the iterations the kernel couldn't do
+                slots[s] = value
+                block()
+            
+            slots[s] = values[-1] + step if values else start
+        
+        return run
+    
+    def visit_break(self, break_):
+        return lambda: BREAK
+    
+    def visit_cont(self, cont):
+        return lambda: CONTINUE
+    
+    def visit_expr(self, expr):
+        value = expr.expr.accept(self)
+        
+        def run():
+            value() # the value is discarded, it must not look like BREAK or CONTINUE
+        
+        return run
+    
+    def visit_print(self, print_):
+        arg = print_.arg.accept(self)
+        write = self.engine.output.write
+        
+        if print_.arg.type == Type.BOOL:
+            def run():
+                write("true" if arg() else "false")
+        else:
+            def run():
+                write(str(arg()))
+        
+        return run
+    
+    def visit_scan(self, scan):
+        engine = self.engine
+        slots = self.slots
+        ident = scan.ident
+        
+        def run():
+            slots[ident.slot] = engine._scan(ident)
+        
+        return run
+    
+    def visit_blk(self, blk):
+        stmts = [stmt.accept(self) for stmt in blk.stmts]
+        
+        if len(stmts) == 1:
+            return stmts[0]
+        
+        if not signals(blk):
+            def run():
+                for stmt in stmts:
+                    stmt()
+            
+            return run
+        
+        def run():
+            for stmt in stmts:
+                signal = stmt()
+                if signal is not None:
+                    return signal
+        
+        return run
+    
+    def visit_prgm(self, prgm):
+        return self._stmt(prgm.block)
+
+class ClosureEngine:
+    """
+    Runs a program compiled into closures by ClosureCompiler, printing the
+    same output and runtime errors as Interpreter.
+    """
+    
+    def __init__(self, tree, output=None, input=None):
+        self.stk = CallStack()
+        self.tree = tree
+        self.output = StdoutSink() if output is None else output
+        self.input = StreamInput() if input is None else input
+    
+    def interpret(self):
+        if self.tree is None:
+            return
+        
+        ar = main_record(self.tree, self.tree.nslots)
+        self.stk.push(ar)
+        
+        run = self.tree.accept(ClosureCompiler(self, ar.slots))
+        
+        try:
+            run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.output.flush()
+        
+        self.stk.pop()
+    
+    def _raise(self, error, lineno):
+        raise_at(error, lineno, self.stk, self.output)
+    
+    def _scan(self, ident):
+        return scan_input(ident.type, ident.lineno, self.stk, self.output, self.input)
@@ -0,0 +1,398 @@
+import math
+import operator
+import sys
+
+from peep import Constant, Declaration, EqualityOp, Identifier, If, MultiplicativeOp, RelationalOp
+from peep import Default
+from peep import TreeWalker
+from peep import Type
+
+# opcodes, every instruction is an (opcode, argument) pair. Binary operations
+# carry the Python function implementing them for the operand type, resolved
+# at compile time, and take their right operand from the stack, from the
+# argument (_CONST) or from a slot (_LOAD)
+CONST = 0                 # push k
+LOAD = 1                  # push slots[s]
+STORE = 2                 # slots[s] = pop()
+POP = 3
+BINARY = 4                # f: right = pop(), top = f(top, right)
+BINARY_CONST = 5          # (f, k): top = f(top, k)
+BINARY_LOAD = 6           # (f, s): top = f(top, slots[s])
+UNARY = 7                 # f: top = f(top)
+UPDATE = 8                # (f, s): slots[s] = f(slots[s], pop())
+UPDATE_CONST = 9          # (f, s, k): slots[s] = f(slots[s], k)
+CHECK_INT = 10            # lineno: raises DivisionByZeroError if top is 0
+CHECK_FLOAT = 11          # lineno: raises DivisionByZeroError if top is within epsilon of 0.0
+PRINT = 12
+PRINT_BOOL = 13
+SCAN_INT = 14             # (s, lineno reported if the input can't be cast)
+SCAN_FLOAT = 15
+SCAN_BOOL = 16
+SCAN_STRING = 17
+JUMP = 18                 # target
+JUMP_IF_FALSE = 19        # target, pops the condition
+JUMP_IF_TRUE_OR_POP = 20  # target, short circuits of || and &&
+JUMP_IF_FALSE_OR_POP = 21
+COMPARE_JUMP = 22         # (f, target): right = pop(), jumps unless f(pop(), right)
+COMPARE_CONST_JUMP = 23   # (f, k, target)
+COMPARE_LOAD_JUMP = 24    # (f, s, target)
+
+OPNAMES = {value: name for name, value in globals().items() if name.isupper() and isinstance(value, int)}
+
+def feq(left, right):
+    return math.fabs(left - right) < sys.float_info.epsilon # check left and right are equal
+
+def fne(left, right):
+    return math.fabs(left - right) > sys.float_info.epsilon
+
+ARITHMETIC = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '%': operator.mod
+}
+
+COMPARISONS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '>': operator.gt,
+    '<=': operator.le,
+    '>=': operator.ge
+}
+
+DIVISIONS = ['/', '%'] # operators whose right operand is checked for zero, like the tree walker does
+
+SCANS = {
+    Type.INT: SCAN_INT,
+    Type.FLOAT: SCAN_FLOAT,
+    Type.BOOL: SCAN_BOOL,
+    Type.STRING: SCAN_STRING
+}
+
+def division(type):
+    return operator.floordiv if type == Type.INT else operator.truediv
+
+def is_zero(value, type):
+    """Tells whether dividing by value raises a DivisionByZeroError"""
+    if type == Type.INT:
+        return value == 0
+    return math.fabs(value - 0.0) < sys.float_info.epsilon # value == 0.0
+
+def comparison(node):
+    """Returns the function an EqualityOp or RelationalOp compares its operands with"""
+    if node.left.type == Type.FLOAT and node.op in ['==', '!=']: # built-in float comparison
+        return feq if node.op == '==' else fne
+    return COMPARISONS[node.op]
+
+def reads(node, ident):
+    """Tells whether an expression reads the variable ident"""
+    if node is ident:
+        return True
+    if hasattr(node, 'operands'):
+        return any(reads(operand, ident) for operand in node.operands)
+    if hasattr(node, 'left'):
+        return reads(node.left, ident) or reads(node.right, ident)
+    if hasattr(node, 'operand'):
+        return reads(node.operand, ident)
+    return False
+
+class Code:
+    """Bytecode of a program and the number of slots (variables and temporaries) it needs"""
+    
+    def __init__(self, instrs, nslots):
+        self.instrs = instrs
+        self.nslots = nslots
+    
+    def dis(self):
+        """Returns a human readable listing of the instructions"""
+        lines = []
+        
+        for pc, (op, arg) in enumerate(self.instrs):
+            args = arg if isinstance(arg, tuple) else (arg,)
+            args = [getattr(a, '__name__', repr(a)) if callable(a) else repr(a) for a in args if a is not None]
+            lines.append("{:>5} {:<22} {}".format(pc, OPNAMES[op], ", ".join(args)))
+        
+        return "\n".join(lines)
+
+class Compiler(TreeWalker):
+    """
+    Lowers a checked AST into bytecode for the VM. Expressions leave their
+    value on the stack, statements leave the stack as they found it.
+    """
+    
+    def __init__(self):
+        self.instrs = []
+        self.loops = [] # (jumps to the end of the loop, jumps to its next iteration) of the loops being compiled
+        self.ntemps = 0 # slots in use for temporaries above the program's variables
+        self.nslots = 0
+        self.base = 0
+        self.raises = {} # cache for _may_raise
+    
+    def compile(self, tree):
+        self.base = self.nslots = tree.nslots
+        tree.accept(self)
+        return Code(self.instrs, self.nslots)
+    
+    def _emit(self, op, arg=None):
+        self.instrs.append((op, arg))
+        return len(self.instrs) - 1
+    
+    def _patch(self, at, target=None):
+        """Points the jump at instruction at to target (default: the next instruction emitted)"""
+        if target is None:
+            target = len(self.instrs)
+        op, arg = self.instrs[at]
+        self.instrs[at] = (op, arg[:-1] + (target,) if isinstance(arg, tuple) else target)
+    
+    def _alloc_temp(self):
+        slot = self.base + self.ntemps
+        self.ntemps += 1
+        self.nslots = max(self.nslots, self.base + self.ntemps)
+        return slot
+    
+    def _binary(self, func, right):
+        """Applies func to the value on top of the stack and right"""
+        if isinstance(right, Constant):
+            self._emit(BINARY_CONST, (func, right.value))
+        elif isinstance(right, Identifier):
+            self._emit(BINARY_LOAD, (func, right.slot))
+        else:
+            right.accept(self)
+            self._emit(BINARY, func)
+    
+    def _jump_unless(self, test):
+        """Emits a jump taken when test is false, returns it to be patched"""
+        if isinstance(test, (EqualityOp, RelationalOp)):
+            func = comparison(test)
+            test.left.accept(self)
+            
+            if isinstance(test.right, Constant):
+                return self._emit(COMPARE_CONST_JUMP, (func, test.right.value, None))
+            elif isinstance(test.right, Identifier):
+                return self._emit(COMPARE_LOAD_JUMP, (func, test.right.slot, None))
+            
+            test.right.accept(self)
+            return self._emit(COMPARE_JUMP, (func, None))
+        
+        test.accept(self)
+        return self._emit(JUMP_IF_FALSE)
+    
+    def _may_raise(self, node):
+        """Tells whether evaluating an expression can fail (only / and % can)"""
+        key = id(node)
+        
+        if key not in self.raises:
+            if isinstance(node, MultiplicativeOp) and ('/' in node.ops or '%' in node.ops):
+                result = True
+            elif hasattr(node, 'operands'):
+                result = any(self._may_raise(operand) for operand in node.operands)
+            elif hasattr(node, 'left'):
+                result = self._may_raise(node.left) or self._may_raise(node.right)
+            elif hasattr(node, 'operand'):
+                result = self._may_raise(node.operand)
+            else:
+                result = False
+            self.raises[key] = result
+        
+        return self.raises[key]
+    
+    def visit_ident(self, ident):
+        self._emit(LOAD, ident.slot)
+    
+    def visit_const(self, const):
+        self._emit(CONST, const.value)
+    
+    def _short_circuit(self, chain, jump):
+        jumps = []
+        
+        for operand in chain.operands[:-1]:
+            operand.accept(self)
+            jumps.append(self._emit(jump))
+        
+        chain.operands[-1].accept(self)
+        
+        for at in jumps:
+            self._patch(at)
+    
+    def visit_orop(self, orop):
+        self._short_circuit(orop, JUMP_IF_TRUE_OR_POP)
+    
+    def visit_andop(self, andop):
+        self._short_circuit(andop, JUMP_IF_FALSE_OR_POP)
+    
+    def visit_eqop(self, eqop):
+        eqop.left.accept(self)
+        self._binary(comparison(eqop), eqop.right)
+    
+    def visit_relop(self, relop):
+        relop.left.accept(self)
+        self._binary(comparison(relop), relop.right)
+    
+    def visit_addop(self, addop):
+        addop.operands[0].accept(self)
+        
+        for op, operand in zip(addop.ops, addop.operands[1:]):
+            self._binary(ARITHMETIC[op], operand)
+    
+    def visit_mulop(self, mulop):
+        operands = mulop.operands
+        ops = mulop.ops
+        check = CHECK_INT if mulop.type == Type.INT else CHECK_FLOAT
+        div = division(mulop.type)
+        
+        if ops.count('/') + ops.count('%') <= 1 and not any(self._may_raise(operand) for operand in operands):
+            # nothing but the one division can fail, so evaluating left to right is
+            # indistinguishable from checking the divisor first
+            operands[0].accept(self)
+            
+            for op, operand in zip(ops, operands[1:]):
+                if op in DIVISIONS:
+                    operand.accept(self)
+                    self._emit(check, operand.lineno)
+                    self._emit(BINARY, div if op == '/' else operator.mod)
+                else:
+                    self._binary(ARITHMETIC[op], operand)
+            return
+        
+        # like the tree walker, evaluate and check the divisors from right to left
+        # before the dividend, keeping them in temporary slots until they're used
+        temps = {}
+        
+        for i in range(len(ops) - 1, -1, -1):
+            if ops[i] in DIVISIONS:
+                operands[i + 1].accept(self)
+                self._emit(check, operands[i + 1].lineno)
+                temps[i] = self._alloc_temp()
+                self._emit(STORE, temps[i])
+        
+        operands[0].accept(self)
+        
+        for i in range(len(ops)):
+            if ops[i] in DIVISIONS:
+                self._emit(BINARY_LOAD, (div if ops[i] == '/' else operator.mod, temps[i]))
+            else:
+                self._binary(ARITHMETIC[ops[i]], operands[i + 1])
+        
+        self.ntemps -= len(temps)
+    
+    def visit_uop(self, uop):
+        uop.operand.accept(self)
+        
+        if uop.op == "-":
+            self._emit(UNARY, operator.neg)
+        elif uop.op == "!":
+            self._emit(UNARY, operator.not_)
+        # unary + is a no-op
+    
+    def visit_decl(self, decl):
+        self._emit(CONST, Default.default_value(decl.ident.type))
+        self._emit(STORE, decl.ident.slot)
+        return decl.ident
+    
+    def visit_assign(self, assign):
+        ident = assign.ident
+        if isinstance(ident, Declaration):
+            if reads(assign.expr, ident.ident):
+                ident = ident.accept(self) # int x = x + 1; sees the default value
+            else:
+                ident = ident.ident
+        assign.expr.accept(self)
+        self._emit(STORE, ident.slot)
+    
+    def _update(self, node, func, divides=False):
+        # the variable is read before the expression is evaluated but nothing
+        # in an expression can change it, so the order makes no difference
+        expr = node.expr
+        
+        if isinstance(expr, Constant) and not (divides and is_zero(expr.value, expr.type)):
+            self._emit(UPDATE_CONST, (func, node.ident.slot, expr.value))
+        else:
+            expr.accept(self)
+            if divides:
+                self._emit(CHECK_INT if expr.type == Type.INT else CHECK_FLOAT, expr.lineno)
+            self._emit(UPDATE, (func, node.ident.slot))
+    
+    def visit_inc(self, inc):
+        self._update(inc, operator.add)
+    
+    def visit_dec(self, dec):
+        self._update(dec, operator.sub)
+    
+    def visit_mul_assign(self, mul_assign):
+        self._update(mul_assign, operator.mul)
+    
+    def visit_div_assign(self, div_assign):
+        self._update(div_assign, division(div_assign.ident.type), True)
+    
+    def visit_mod_assign(self, mod_assign):
+        self._update(mod_assign, operator.mod, True)
+    
+    def visit_if(self, if_):
+        ends = []
+        branches = [if_] + if_.brs
+        
+        for i, br in enumerate(branches):
+            if isinstance(br, If):
+                skip = self._jump_unless(br.test)
+                if br.block is not None:
+                    br.block.accept(self)
+                if i < len(branches) - 1:
+                    ends.append(self._emit(JUMP))
+                self._patch(skip)
+            elif br is not None: # else branch
+                br.accept(self)
+        
+        for at in ends:
+            self._patch(at)
+    
+    def _loop(self, test, block, stmt):
+        top = len(self.instrs)
+        exit = self._jump_unless(test)
+        
+        self.loops.append(([exit], []))
+        if block is not None:
+            block.accept(self)
+        breaks, continues = self.loops.pop()
+        
+        for at in continues:
+            self._patch(at)
+        if stmt is not None:
+            stmt.accept(self)
+        self._emit(JUMP, top)
+        
+        for at in breaks:
+            self._patch(at)
+    
+    def visit_while(self, while_):
+        self._loop(while_.test, while_.block, None)
+    
+    def visit_for(self, for_):
+        for_.init.accept(self)
+        self._loop(for_.test, for_.block, for_.stmt)
+    
+    def visit_break(self, break_):
+        self.loops[-1][0].append(self._emit(JUMP))
+    
+    def visit_cont(self, cont):
+        self.loops[-1][1].append(self._emit(JUMP))
+    
+    def visit_expr(self, expr):
+        expr.expr.accept(self)
+        self._emit(POP)
+    
+    def visit_print(self, print_):
+        print_.arg.accept(self)
+        self._emit(PRINT_BOOL if print_.arg.type == Type.BOOL else PRINT)
+    
+    def visit_scan(self, scan):
+        ident = scan.ident
+        self._emit(SCANS[ident.type], (ident.slot, ident.lineno))
+    
+    def visit_blk(self, blk):
+        for stmt in blk.stmts:
+            stmt.accept(self)
+    
+    def visit_prgm(self, prgm):
+        if prgm.block is not None:
+            prgm.block.accept(self)
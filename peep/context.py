@@ -0,0 +1,48 @@
+import threading
+
+try:
+    from contextvars import ContextVar
+except ImportError: # Python 3.6
+    ContextVar = None
+
+class Context:
+    """
+    State of one compilation: the name its program is reported under and
+    the parser whose lookahead token gives the position of new AST nodes.
+    Every Lexer has its own, so programs can be compiled concurrently (ie.
+    on several threads) without mixing up their line numbers.
+    """
+    
+    def __init__(self, filename="string"):
+        self.filename = filename
+        self.cursor = None
+    
+    def lineno(self):
+        return 0 if self.cursor is None else self.cursor.lineno()
+
+class ThreadVar:
+    """The part of ContextVar used here, with a value per thread, for Pythons without contextvars"""
+    
+    def __init__(self, name, default=None):
+        self.name = name
+        self.default = default
+        self.local = threading.local()
+    
+    def get(self):
+        return getattr(self.local, "value", self.default)
+    
+    def set(self, value):
+        token = self.get() # the value reset() restores
+        self.local.value = value
+        return token
+    
+    def reset(self, token):
+        self.local.value = token
+
+# compilation whose parser is building nodes in the current thread (or task)
+current = ContextVar("current", default=None) if ContextVar is not None else ThreadVar("current")
+
+def current_lineno():
+    """Line of the node being built, 0 for nodes built outside of a parser"""
+    context = current.get()
+    return 0 if context is None else context.lineno()
@@ -0,0 +1,209 @@
+import copy
+
+from peep import *
+from peep.compiler import DIVISIONS
+from peep.optimize import STORES, pure, read, target, temporary, walk
+
+# statements that always run after the one before them, an If ends a basic
+# block but its test still belongs to it
+SIMPLE = STORES + (Print, Expression)
+
+def count_nodes(tree):
+    """Number of distinct node objects in tree"""
+    return 0 if tree is None else len({id(node) for node in walk(tree)})
+
+def expressions(stmt):
+    """Names of the attributes of stmt holding an expression"""
+    if isinstance(stmt, (If, While, For)):
+        return ["test"]
+    elif isinstance(stmt, Print):
+        return ["arg"]
+    elif isinstance(stmt, (Assign, Expression, Increment, Decrement, MultiplicativeAssign, DivisionAssign, ModulusAssign)):
+        return ["expr"]
+    return []
+
+def children(node):
+    if isinstance(node, ChainOp):
+        return node.operands
+    elif isinstance(node, BinaryOp):
+        return [node.left, node.right]
+    elif isinstance(node, UnaryOp):
+        return [node.operand]
+    return []
+
+def rebuild(node, kids):
+    """Returns a copy of the operator node with kids as its operands"""
+    node = copy.copy(node)
+    if isinstance(node, ChainOp):
+        node.operands = kids
+    elif isinstance(node, BinaryOp):
+        node.left, node.right = kids
+    else: # UnaryOp
+        node.operand, = kids
+    return node
+
+class CSE:
+    """
+    Optional common subexpression elimination pass (--cse) over a checked AST:
+    
+    - hash-consing: structurally identical expression subtrees are replaced
+      by one shared node, so large programs keep fewer nodes in memory.
+      Divisors are only shared on the same line, runtime errors report it.
+    - within a basic block (statements running one after the other, up to a
+      loop, a block or the test of an if), a pure expression computed again
+      before any variable it reads is written is computed once into a
+      temporary in front of its first use.
+    
+    It runs after Optimizer, which rewrites nodes in place and would change
+    every place a shared node appears in.
+    """
+    
+    def __init__(self):
+        self.table = {} # structural key -> shared node
+        self.reads = {} # id of a shared node -> variables it reads
+        self.nslots = 0
+        self.ntemps = 0
+    
+    def eliminate(self, tree):
+        if tree is None or tree.block is None:
+            return tree
+        
+        self.nslots = tree.nslots
+        
+        for node in walk(tree):
+            for attr in expressions(node):
+                setattr(node, attr, self._intern(getattr(node, attr)))
+        
+        for blk in [node for node in walk(tree) if isinstance(node, Block)]:
+            self._block(blk)
+        
+        tree.nslots = self.nslots
+        return tree
+    
+    # hash-consing
+    
+    def _intern(self, node, divisor=False):
+        """Returns the shared node for the expression node"""
+        if isinstance(node, Identifier):
+            return node # uses of a variable share its declaration's node already
+        
+        if isinstance(node, Constant):
+            key = (Constant, node.type, repr(node.value), node.lexeme) # repr tells 0.0 and -0.0 apart
+        elif isinstance(node, ChainOp):
+            divisors = [False] + [op in DIVISIONS and isinstance(node, MultiplicativeOp) for op in node.ops]
+            node.operands = [self._intern(operand, d) for operand, d in zip(node.operands, divisors)]
+            key = (node.__class__, tuple(node.ops), node.type) + tuple(id(operand) for operand in node.operands)
+        elif isinstance(node, BinaryOp):
+            node.left = self._intern(node.left)
+            node.right = self._intern(node.right)
+            key = (node.__class__, node.op, node.type, id(node.left), id(node.right))
+        else: # UnaryOp
+            node.operand = self._intern(node.operand)
+            key = (node.__class__, node.op, node.type, id(node.operand))
+        
+        if divisor:
+            key += (node.lineno,)
+        return self.table.setdefault(key, node)
+    
+    def _reads(self, node):
+        if id(node) not in self.reads:
+            self.reads[id(node)] = sorted(read(node), key=id)
+        return self.reads[id(node)]
+    
+    # common subexpressions of basic blocks
+    
+    def _block(self, blk):
+        stmts = []
+        run = []
+        
+        for stmt in blk.stmts:
+            if isinstance(stmt, SIMPLE + (If,)):
+                run.append(stmt)
+            if not isinstance(stmt, SIMPLE):
+                stmts.extend(self._basic_block(run))
+                run = []
+                if not isinstance(stmt, If):
+                    stmts.append(stmt)
+        
+        blk.stmts = stmts + self._basic_block(run)
+    
+    def _keys(self, stmts):
+        """
+        Returns per statement the key of each expression it can share, its
+        node and the versions of the variables it reads, and how many times
+        each key is evaluated
+        """
+        versions = {} # Identifier -> number of writes so far
+        keys = []
+        counts = {}
+        
+        for stmt in stmts:
+            # int x = x + 1; reads the default value of x, not the one before it
+            declared = target(stmt) if isinstance(stmt, Assign) and isinstance(stmt.ident, Declaration) else None
+            found = {}
+            
+            for attr in expressions(stmt):
+                for node in walk(getattr(stmt, attr)):
+                    if isinstance(node, (Identifier, Constant)) or not pure(node) or declared in self._reads(node):
+                        continue
+                    if id(node) not in found:
+                        found[id(node)] = (id(node),) + tuple(versions.get(ident, 0) for ident in self._reads(node))
+                    counts[found[id(node)]] = counts.get(found[id(node)], 0) + 1
+            
+            keys.append(found)
+            if isinstance(stmt, STORES):
+                versions[target(stmt)] = versions.get(target(stmt), 0) + 1
+        
+        return keys, counts
+    
+    def _basic_block(self, stmts):
+        """Returns the statements of a basic block computing its common subexpressions once"""
+        keys, counts = self._keys(stmts)
+        uses = {} # key -> indexes of the statements using it
+        nodes = {}
+        
+        # the outermost repeated expressions are shared, the ones inside them come with them
+        def outermost(node, found, i):
+            k = found.get(id(node))
+            if k is not None and counts[k] > 1:
+                uses.setdefault(k, []).append(i)
+                nodes[k] = node
+                return
+            for kid in children(node):
+                outermost(kid, found, i)
+        
+        for i, stmt in enumerate(stmts):
+            for attr in expressions(stmt):
+                outermost(getattr(stmt, attr), keys[i], i)
+        
+        temps = {} # key -> temporary holding its value
+        before = {} # statement index -> assignments of the temporaries it uses first
+        
+        for k, indexes in uses.items():
+            if len(indexes) > 1:
+                ident, assign = temporary(nodes[k], "$c{}".format(self.ntemps), self.nslots)
+                self.ntemps += 1
+                self.nslots += 1
+                temps[k] = ident
+                before.setdefault(indexes[0], []).append(assign)
+        
+        if not temps:
+            return stmts
+        
+        def substitute(node, found):
+            k = found.get(id(node))
+            if k is not None and counts[k] > 1:
+                return temps.get(k, node)
+            kids = children(node)
+            new = [substitute(kid, found) for kid in kids]
+            if any(a is not b for a, b in zip(new, kids)):
+                return rebuild(node, new)
+            return node
+        
+        result = []
+        for i, stmt in enumerate(stmts):
+            result.extend(before.get(i, []))
+            for attr in expressions(stmt):
+                setattr(stmt, attr, substitute(getattr(stmt, attr), keys[i]))
+            result.append(stmt)
+        return result
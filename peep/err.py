@@ -1,11 +1,38 @@
-from sys import exit
-
-class PeepError:
+class PeepError(Exception):
+    """
+    An error in a Peep program. Runtime errors also carry the call stack
+    they happened in, as (filename, function, lineno) from the innermost
+    record out.
+    """
+    
     def __init__(self, base_error_name, lineno, message):
         self.message = base_error_name + " @line {}".format(lineno) + ": " + message
+        self.lineno = lineno
+        self.trace = []
+        super().__init__(self.message)
     
     def __str__(self):
         return self.message
+    
+    def __reduce__(self):
+        # subclasses take other arguments than the message Exception would pickle them with
+        return _restore, (self.__class__, self.__dict__)
+
+def _restore(cls, state):
+    error = cls.__new__(cls)
+    error.__dict__.update(state)
+    Exception.__init__(error, error.message)
+    return error
+
+class ErrorList(PeepError):
+    """Every error found in a program which had more than one, in the order they were found"""
+    
+    def __init__(self, errors):
+        self.errors = errors
+        self.message = "\n".join(str(error) for error in errors)
+        self.lineno = errors[0].lineno
+        self.trace = []
+        Exception.__init__(self, self.message)
 
 class LexError(PeepError):
     def __init__(self, message, lineno):
@@ -44,14 +71,26 @@ class InputCastingError(RuntimeError):
         super().__init__(msg, lineno, self.__class__.__name__)
 
 def raise_error(error):
-    print(error)
-    exit(0)
+    raise error
 
-def raise_runtime_error(error, call_stk):
-    print(error)
+def raise_runtime_error(error, call_stk, output=None):
+    if output is not None:
+        output.flush() # what the program printed comes before the error
     
     for i in range(len(call_stk.records) - 1, -1, -1):
         ar = call_stk.records[i]
-        print('\tat ' + ar.filename + '.' + ar.current_function + '.' + str(ar.last_lineno))
+        error.trace.append((ar.filename, ar.current_function, ar.last_lineno))
+    
+    raise error
+
+def format_error(error):
+    """Text of error the way the peep command reports it, without a newline at the end"""
+    lines = [str(error)]
     
-    exit(0)
+    for filename, function, lineno in error.trace:
+        lines.append('\tat ' + filename + '.' + function + '.' + str(lineno))
+    
+    return "\n".join(lines)
+
+def print_error(error):
+    print(format_error(error))
@@ -0,0 +1,61 @@
+from peep import AndOperator, ChainOp, Constant, DivisionByZeroError, EqualityOp, OrOperator, RelationalOp, UnaryOp, raise_error
+from peep.compiler import ARITHMETIC, DIVISIONS, comparison, division, is_zero
+
+def constant(node, value):
+    """Returns a Constant of node's type and line holding value"""
+    const = Constant(node.type, value)
+    const.lineno = node.lineno # runtime errors about the folded expression keep its line
+    return const
+
+def fold(node, report=True):
+    """
+    Returns the Constant an operator node the parser just built evaluates to
+    when its operands are constants, or node itself. A constant division by
+    zero is reported right away, or left for the run time unless report.
+    """
+    if isinstance(node, UnaryOp):
+        operand = node.operand
+        
+        if not isinstance(operand, Constant):
+            return node
+        elif node.op == "-":
+            return constant(node, -operand.value)
+        elif node.op == "!":
+            return constant(node, not operand.value)
+        return operand # unary + does nothing
+    
+    if isinstance(node, (EqualityOp, RelationalOp)):
+        if isinstance(node.left, Constant) and isinstance(node.right, Constant):
+            return constant(node, comparison(node)(node.left.value, node.right.value))
+        return node
+    
+    if not isinstance(node, ChainOp):
+        return node
+    
+    operands = node.operands
+    
+    if isinstance(node, (OrOperator, AndOperator)):
+        # a constant first operand decides the result or drops out of the chain
+        if len(operands) != 2 or not isinstance(operands[0], Constant):
+            return node
+        if operands[0].value == isinstance(node, OrOperator): # true || x, false && x
+            return constant(node, operands[0].value)
+        return operands[1]
+    
+    if not all(isinstance(operand, Constant) for operand in operands):
+        return node
+    
+    # divisors are checked right to left before anything else like at run time
+    for i in range(len(node.ops) - 1, -1, -1):
+        if node.ops[i] in DIVISIONS and is_zero(operands[i + 1].value, node.type):
+            if not report:
+                return node
+            raise_error(DivisionByZeroError(operands[i + 1].lineno))
+    
+    value = operands[0].value
+    
+    for op, operand in zip(node.ops, operands[1:]):
+        func = division(node.type) if op == '/' else ARITHMETIC[op]
+        value = func(value, operand.value)
+    
+    return constant(node, value)
@@ -0,0 +1,157 @@
+import codecs
+import io
+import sys
+
+from abc import ABC, abstractmethod
+
+from peep import Type
+
+CHUNK_SIZE = 64 * 1024 # bytes read from a stream at once
+
+# what "Cannot cast input to ..." errors call each type
+TYPE_NAMES = {
+    Type.INT: "int",
+    Type.FLOAT: "float",
+    Type.BOOL: "bool",
+    Type.STRING: "string"
+}
+
+def cast(text, type):
+    """Converts a line of input to type like scan() does, raises ValueError if it can't"""
+    if type == Type.INT:
+        return int(text)
+    elif type == Type.FLOAT:
+        return float(text)
+    elif type == Type.BOOL:
+        if text not in ['true', 'false']:
+            raise ValueError(text)
+        return text == "true"
+    return text # Type.STRING
+
+class Input(ABC):
+    """
+    Where the scan() statements of a program read from. read(type) returns
+    the next value cast to type, raising ValueError if it can't be (engines
+    report an InputCastingError) and EOFError at the end of the input.
+    """
+    
+    interactive = False # engines flush the output before each scan() only when this is true
+    
+    def read(self, type):
+        return cast(self.readline(), type)
+    
+    @abstractmethod
+    def readline(self):
+        """The next line of input without its newline, raises EOFError at the end"""
+        pass
+    
+    def close(self):
+        pass
+
+class StreamInput(Input):
+    """
+    Reads lines from a stream (sys.stdin when it's None) chunk_size bytes at
+    a time instead of once per scan(). A read returns what the stream has
+    available, so pipes and terminals don't wait for a whole chunk.
+    """
+    
+    def __init__(self, stream=None, chunk_size=CHUNK_SIZE, encoding=None):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.encoding = encoding
+        self.decoder = None
+        self.lines = [] # complete lines read ahead
+        self.next = 0 # index of the line the next scan() gets
+        self.rest = "" # start of a line whose end hasn't been read yet
+        self.interactive = _isatty(sys.stdin if stream is None else stream) # someone may be waiting at a prompt
+    
+    def readline(self):
+        if self.next == len(self.lines):
+            self._fill()
+        
+        line = self.lines[self.next]
+        self.next += 1
+        return line
+    
+    def _fill(self):
+        while True:
+            text = self._chunk()
+            
+            if not text:
+                if not self.rest:
+                    raise EOFError("EOF when reading a line") # what input() raises
+                self.lines, self.next, self.rest = [self.rest], 0, "" # the last line has no newline
+                return
+            
+            lines = (self.rest + text).split("\n")
+            self.rest = lines.pop()
+            
+            if lines:
+                self.lines, self.next = lines, 0
+                return
+    
+    def _chunk(self):
+        stream = sys.stdin if self.stream is None else self.stream
+        
+        if isinstance(stream, io.TextIOBase) and not hasattr(stream, "buffer"): # ie. io.StringIO
+            return stream.read(self.chunk_size)
+        
+        if self.decoder is None:
+            encoding = self.encoding or getattr(stream, "encoding", None) or "utf-8"
+            self.decoder = codecs.getincrementaldecoder(encoding)(getattr(stream, "errors", None) or "strict")
+        
+        raw = getattr(stream, "buffer", stream)
+        data = raw.read1(self.chunk_size) if hasattr(raw, "read1") else raw.read(self.chunk_size)
+        return self.decoder.decode(data, final=not data)
+
+def _isatty(stream):
+    try:
+        return stream.isatty()
+    except (AttributeError, ValueError): # no isatty() or a closed stream
+        return False
+
+class FileInput(StreamInput):
+    def __init__(self, path, chunk_size=CHUNK_SIZE, encoding="utf-8"):
+        super().__init__(open(path, "rb"), chunk_size, encoding)
+    
+    def close(self):
+        self.stream.close()
+
+class ListInput(Input):
+    """
+    Serves values from a list. Strings are cast like lines of input, other
+    values are pre-typed and used as they are when they have the type
+    scan() asks for (an int is also a float).
+    """
+    
+    def __init__(self, values):
+        self.values = values
+        self.next = 0
+    
+    def readline(self):
+        value = self._next()
+        if isinstance(value, bool):
+            return "true" if value else "false"
+        return str(value)
+    
+    def read(self, type):
+        value = self._next()
+        
+        if isinstance(value, str):
+            return cast(value, type)
+        elif isinstance(value, bool): # bool is an int subclass
+            if type == Type.BOOL:
+                return value
+        elif type == Type.INT and isinstance(value, int):
+            return value
+        elif type == Type.FLOAT and isinstance(value, (int, float)):
+            return float(value)
+        raise ValueError(value)
+    
+    def _next(self):
+        if self.next == len(self.values):
+            raise EOFError("EOF when reading a line")
+        
+        value = self.values[self.next]
+        self.next += 1
+        return value
@@ -1,47 +1,24 @@
-from peep import Block, Declaration
+import math
+import sys
+
+from peep import Declaration, Default, If
+from peep import StdoutSink, StreamInput
 from peep import DivisionByZeroError, InputCastingError, raise_runtime_error
-from peep import Scope
 from peep import TreeWalker
 from peep import Type
+from peep.compiler import DIVISIONS
+from peep.inputs import TYPE_NAMES
+from peep.quicken import BREAK, CONTINUE, Quickener
 
-class ChainedList:
-    def __init__(self, prev):
-        self.prev = prev
-        self.data = []
-    
-    def append(self, elm):
-        self.data.append(elm)
-    
-    def elm_exists(self, elm):
-        return elm in self.data
+EPSILON = sys.float_info.epsilon
+HOT_LOOP = 1000 # iterations after which the tree walker compiles a loop
 
 class ActivationRecord:
-    def __init__(self, filename, current_function, last_lineno):
+    def __init__(self, filename, current_function, last_lineno, nslots=0):
         self.filename = filename
         self.current_function = current_function
         self.last_lineno = last_lineno
-        self.mmap = None # memory map
-        self.cl = None
-    
-    def new_scope(self):
-        self.mmap = Scope(self.mmap)
-        self.cl = ChainedList(self.cl)
-    
-    def old_scope(self):
-        for key in self.mmap.dct.keys():
-            if not self.cl.elm_exists(key):
-                self.mmap.parent[key] = self.mmap[key]
-        
-        self.mmap = self.mmap.parent
-        self.cl = self.cl.prev
-    
-    def __getitem__(self, key):
-        return self.mmap[key]
-    
-    def put(self, key, value, new=False):
-        if new:
-            self.cl.append(key)
-        self.mmap[key] = value
+        self.slots = [None] * nslots # variables, indexed by Identifier.slot
 
 class CallStack:
     def __init__(self):
@@ -56,47 +33,75 @@ class CallStack:
     def top(self):
         return self.records[-1]
 
+def main_record(tree, nslots=0):
+    """The topmost activation record of a program, named after its file without the directory"""
+    filename = tree.filename
+    if filename.find('/') != -1:
+        filename = filename[filename.rfind('/') + 1:] # remove directory prefix
+    return ActivationRecord(filename, "__MAIN", 0, nslots)
+
+def raise_at(error, lineno, stk, output):
+    """Reports a runtime error raised on line lineno of the function on top of stk"""
+    stk.top().last_lineno = lineno
+    raise_runtime_error(error, stk, output)
+
+def scan_input(type, lineno, stk, output, input):
+    """The next value of input for a scan() into a variable of type on line lineno"""
+    if input.interactive:
+        output.flush() # prompts are shown before waiting for input at a terminal
+    
+    try:
+        return input.read(type)
+    except ValueError:
+        raise_at(InputCastingError("Cannot cast input to " + TYPE_NAMES[type], lineno), lineno, stk, output)
+
 class Interpreter(TreeWalker):
-    def __init__(self, tree):
+    """
+    Walks the tree to run a program. Loops are tiered: once a loop node has
+    run hot_loop iterations in total, it is translated to Python (see
+    Transpiler.transpile_loop) and the rest of it, and every later run of
+    it, is executed compiled. promoted counts the loops that were.
+    """
+    
+    def __init__(self, tree, hot_loop=HOT_LOOP, output=None, input=None):
         self.stk = CallStack()
         self.tree = tree
-        self.encountered_break = False
-        self.encountered_cont = False
+        self.output = StdoutSink() if output is None else output
+        self.input = StreamInput() if input is None else input
+        self.hot_loop = hot_loop # None never compiles loops
+        self.iterations = {} # loop node -> iterations walked so far
+        self.compiled = {} # loop node -> function running it from its test on, None if it can't be compiled
+        self.promoted = 0
     
     def interpret(self):
         if self.tree is not None:
+            if not self.tree.quickened: # ie. a tree run again for another input
+                self.tree = Quickener().quicken(self.tree)
+            
             try:
                 self.tree.accept(self)
             except KeyboardInterrupt:
                 pass
+            finally:
+                self.output.flush()
     
     def visit_ident(self, ident):
-        ar = self.stk.top()
-        return ar[ident.value]
+        return self.stk.top().slots[ident.slot]
     
     def visit_const(self, const):
-        type = const.type
-        
-        if type == Type.INT:
-            return int(const.value)
-        elif type == Type.FLOAT:
-            return float(const.value)
-        elif type == Type.BOOL:
-            return const.value == "true"
-        else: # type == Type.STRING
-            return const.value
+        return const.value
     
     def visit_orop(self, orop):
-        left = orop.left.accept(self)
-        if left:
-            return True
-        return orop.right.accept(self)
+        for operand in orop.operands:
+            if operand.accept(self):
+                return True
+        return False
     
     def visit_andop(self, andop):
-        left = andop.left.accept(self)
-        if not left:
-            return False
-        return andop.right.accept(self)
+        for operand in andop.operands:
+            if not operand.accept(self):
+                return False
+        return True
     
     def visit_eqop(self, eqop):
         op = eqop.op
@@ -106,10 +111,9 @@ class Interpreter(TreeWalker):
             left = eqop.left.accept(self)
             right = eqop.right.accept(self)
             
-            import math, sys
             if op == "==":
-                return math.fabs(left - right) < sys.float_info.epsilon # check left and right are equal
-            return math.fabs(left - right) > sys.float_info.epsilon
+                return math.fabs(left - right) < EPSILON # check left and right are equal
+            return math.fabs(left - right) > EPSILON
         
         if op == "==":
             return eqop.left.accept(self) == eqop.right.accept(self)
@@ -129,36 +133,157 @@ class Interpreter(TreeWalker):
             return relop.left.accept(self) >= relop.right.accept(self)
     
     def visit_addop(self, addop):
-        op = addop.op
+        operands = addop.operands
+        val = operands[0].accept(self)
         
-        if op == "+":
-            return addop.left.accept(self) + addop.right.accept(self)
-        else: # op == "-"
-            return addop.left.accept(self) - addop.right.accept(self)
+        for i in range(len(addop.ops)):
+            if addop.ops[i] == "+":
+                val += operands[i + 1].accept(self)
+            else: # op == "-"
+                val -= operands[i + 1].accept(self)
+        
+        return val
     
     def visit_mulop(self, mulop):
-        op = mulop.op
+        operands = mulop.operands
+        ops = mulop.ops
+        divisors = {}
         
-        if op == "*":
-            return mulop.left.accept(self) * mulop.right.accept(self)
-        elif op == "/":
-            type = mulop.left.type
-            
-            if type == Type.INT:
-                right = mulop.right.accept(self)
-                if right == 0:
-                    self.stk.top().last_lineno = mulop.right.lineno
-                    raise_runtime_error(DivisionByZeroError(mulop.right.lineno), self.stk)
-                return mulop.left.accept(self) // right
+        if "/" in ops or "%" in ops:
+            # a division evaluated its divisor (and checked it for zero) before the
+            # dividend, ie. the divisors of a / b % c are checked in the order c, b
+            for i in range(len(ops) - 1, -1, -1):
+                if ops[i] in DIVISIONS:
+                    right = operands[i + 1].accept(self)
+                    self._check_divisor(right, mulop.type, operands[i + 1].lineno)
+                    divisors[i] = right
+        
+        val = operands[0].accept(self)
+        
+        for i in range(len(ops)):
+            op = ops[i]
             
-            right = mulop.right.accept(self)
-            import math, sys
-            if math.fabs(right - 0.0) < sys.float_info.epsilon: # right == 0.0
-                self.stk.top().last_lineno = mulop.right.lineno
-                raise_runtime_error(DivisionByZeroError(mulop.right.lineno), self.stk)
-            return mulop.left.accept(self) / right
-        else: # op == "%"
-            return mulop.left.accept(self) % mulop.right.accept(self)
+            if op == "*":
+                val *= operands[i + 1].accept(self)
+            elif op == "/":
+                if mulop.type == Type.INT:
+                    val //= divisors[i]
+                else:
+                    val /= divisors[i]
+            else: # op == "%"
+                val %= divisors[i]
+        
+        return val
+    
+    def _check_divisor(self, right, type, lineno):
+        if type == Type.INT:
+            if right == 0:
+                self.stk.top().last_lineno = lineno
+                raise_runtime_error(DivisionByZeroError(lineno), self.stk, self.output)
+            return
+        
+        if math.fabs(right - 0.0) < EPSILON: # right == 0.0
+            self.stk.top().last_lineno = lineno
+            raise_runtime_error(DivisionByZeroError(lineno), self.stk, self.output)
+    
+    # quickened nodes, the type and operator are known from the node's class
+    
+    def visit_int_add(self, addop):
+        return addop.left.accept(self) + addop.right.accept(self)
+    
+    def visit_float_add(self, addop):
+        return addop.left.accept(self) + addop.right.accept(self)
+    
+    def visit_string_concat(self, addop):
+        return addop.left.accept(self) + addop.right.accept(self)
+    
+    def visit_int_sub(self, addop):
+        return addop.left.accept(self) - addop.right.accept(self)
+    
+    def visit_float_sub(self, addop):
+        return addop.left.accept(self) - addop.right.accept(self)
+    
+    def visit_int_mul(self, mulop):
+        return mulop.left.accept(self) * mulop.right.accept(self)
+    
+    def visit_float_mul(self, mulop):
+        return mulop.left.accept(self) * mulop.right.accept(self)
+    
+    def visit_int_floor_div(self, mulop):
+        right = mulop.right.accept(self) # the divisor is evaluated and checked first
+        if right == 0:
+            self.stk.top().last_lineno = mulop.right.lineno
+            raise_runtime_error(DivisionByZeroError(mulop.right.lineno), self.stk, self.output)
+        return mulop.left.accept(self) // right
+    
+    def visit_float_div(self, mulop):
+        right = mulop.right.accept(self)
+        if math.fabs(right - 0.0) < EPSILON: # right == 0.0
+            self.stk.top().last_lineno = mulop.right.lineno
+            raise_runtime_error(DivisionByZeroError(mulop.right.lineno), self.stk, self.output)
+        return mulop.left.accept(self) / right
+    
+    def visit_int_mod(self, mulop):
+        right = mulop.right.accept(self)
+        if right == 0:
+            self.stk.top().last_lineno = mulop.right.lineno
+            raise_runtime_error(DivisionByZeroError(mulop.right.lineno), self.stk, self.output)
+        return mulop.left.accept(self) % right
+    
+    def visit_float_mod(self, mulop):
+        right = mulop.right.accept(self)
+        if math.fabs(right - 0.0) < EPSILON: # right == 0.0
+            self.stk.top().last_lineno = mulop.right.lineno
+            raise_runtime_error(DivisionByZeroError(mulop.right.lineno), self.stk, self.output)
+        return mulop.left.accept(self) % right
+    
+    def visit_equal(self, eqop):
+        return eqop.left.accept(self) == eqop.right.accept(self)
+    
+    def visit_not_equal(self, eqop):
+        return eqop.left.accept(self) != eqop.right.accept(self)
+    
+    def visit_float_eq(self, eqop):
+        return math.fabs(eqop.left.accept(self) - eqop.right.accept(self)) < EPSILON
+    
+    def visit_float_ne(self, eqop):
+        return math.fabs(eqop.left.accept(self) - eqop.right.accept(self)) > EPSILON
+    
+    def visit_less(self, relop):
+        return relop.left.accept(self) < relop.right.accept(self)
+    
+    def visit_greater(self, relop):
+        return relop.left.accept(self) > relop.right.accept(self)
+    
+    def visit_less_equal(self, relop):
+        return relop.left.accept(self) <= relop.right.accept(self)
+    
+    def visit_greater_equal(self, relop):
+        return relop.left.accept(self) >= relop.right.accept(self)
+    
+    def visit_negate(self, uop):
+        return -uop.operand.accept(self)
+    
+    def visit_not(self, uop):
+        return not uop.operand.accept(self)
+    
+    def visit_int_div_assign(self, div_assign):
+        slots = self.stk.top().slots
+        slot = div_assign.ident.slot
+        right = div_assign.expr.accept(self)
+        if right == 0:
+            self.stk.top().last_lineno = div_assign.expr.lineno
+            raise_runtime_error(DivisionByZeroError(div_assign.expr.lineno), self.stk, self.output)
+        slots[slot] = slots[slot] // right
+    
+    def visit_float_div_assign(self, div_assign):
+        slots = self.stk.top().slots
+        slot = div_assign.ident.slot
+        right = div_assign.expr.accept(self)
+        if math.fabs(right - 0.0) < EPSILON: # right == 0.0
+            self.stk.top().last_lineno = div_assign.expr.lineno
+            raise_runtime_error(DivisionByZeroError(div_assign.expr.lineno), self.stk, self.output)
+        slots[slot] = slots[slot] / right
     
     def visit_uop(self, uop):
         op = uop.op
@@ -171,118 +296,187 @@ class Interpreter(TreeWalker):
             return not uop.operand.accept(self)
     
     def visit_decl(self, decl):
-        ar = self.stk.top()
-        from peep import Default
-        ar.put(decl.ident.value, Default.default_value(decl.ident.type), True)
+        self.stk.top().slots[decl.ident.slot] = Default.default_value(decl.ident.type)
         return decl.ident
     
     def visit_assign(self, assign):
         ident = assign.ident
         if isinstance(ident, Declaration):
             ident = ident.accept(self)
-        ar = self.stk.top()
-        ar.put(ident.value, assign.expr.accept(self))
+        self.stk.top().slots[ident.slot] = assign.expr.accept(self)
     
     def visit_inc(self, inc):
-        ident = inc.ident
-        ar = self.stk.top()
-        val = ar[ident.value]
-        ar.put(ident.value, val + inc.expr.accept(self))
+        slots = self.stk.top().slots
+        slot = inc.ident.slot
+        slots[slot] = slots[slot] + inc.expr.accept(self)
     
     def visit_dec(self, dec):
-        ident = dec.ident
-        ar = self.stk.top()
-        val = ar[ident.value]
-        ar.put(ident.value, val - dec.expr.accept(self))
+        slots = self.stk.top().slots
+        slot = dec.ident.slot
+        slots[slot] = slots[slot] - dec.expr.accept(self)
     
     def visit_mul_assign(self, mul_assign):
-        ident = mul_assign.ident
-        ar = self.stk.top()
-        val = ar[ident.value]
-        ar.put(ident.value, val * mul_assign.expr.accept(self))
+        slots = self.stk.top().slots
+        slot = mul_assign.ident.slot
+        slots[slot] = slots[slot] * mul_assign.expr.accept(self)
     
     def visit_div_assign(self, div_assign):
         ident = div_assign.ident
-        ar = self.stk.top()
-        val = ar[ident.value]
+        slots = self.stk.top().slots
+        right = div_assign.expr.accept(self)
+        self._check_divisor(right, ident.type, div_assign.expr.lineno)
         
         if ident.type == Type.INT:
-            ar.put(ident.value, val // div_assign.expr.accept(self))
+            slots[ident.slot] = slots[ident.slot] // right
         else: # Type.FLOAT
-            ar.put(ident.value, val / div_assign.expr.accept(self))
+            slots[ident.slot] = slots[ident.slot] / right
     
     def visit_mod_assign(self, mod_assign):
-        ident = mod_assign.ident
-        ar = self.stk.top()
-        val = ar[ident.value]
-        ar.put(ident.value, val % mod_assign.expr.accept(self))
+        slots = self.stk.top().slots
+        slot = mod_assign.ident.slot
+        right = mod_assign.expr.accept(self)
+        self._check_divisor(right, mod_assign.ident.type, mod_assign.expr.lineno)
+        slots[slot] = slots[slot] % right
     
     def visit_if(self, if_):
         if if_.test.accept(self):
-            self.stk.top().new_scope()
-            if if_.block is not None:
-                if_.block.accept(self)
-            self.stk.top().old_scope()
-        elif len(if_.brs) > 0:
-            if len(if_.brs) == 1:
-                self.stk.top().new_scope()
-                if if_.brs[-1] is not None:
-                    if_.brs[-1].accept(self)
-                self.stk.top().old_scope()
-            else:
-                for i in range(0, len(if_.brs) - 1):
-                    if if_.brs[i].test.accept(self):
-                        self.stk.top().new_scope()
-                        if if_.brs[i].block is not None:
-                            if_.brs[i].block.accept(self)
-                        self.stk.top().old_scope()
-                        break
-                else:
-                    self.stk.top().new_scope()
-                    if if_.brs[-1] is not None:
-                        if_.brs[-1].accept(self)
-                    self.stk.top().old_scope()
+            return if_.block.accept(self)
+        
+        for br in if_.brs:
+            if not isinstance(br, If): # else branch
+                return br.accept(self)
+            if br.test.accept(self):
+                return br.block.accept(self)
+    
+    def visit_if_chain(self, if_):
+        if if_.test.accept(self):
+            return if_.block.accept(self)
+        
+        for test, block in if_.elifs:
+            if test.accept(self):
+                return block.accept(self) # BREAK or CONTINUE of an ExitBlock goes up to the loop
+        
+        if if_.orelse is not None:
+            return if_.orelse.accept(self)
+    
+    def _budget(self, loop):
+        """Iterations of loop left to walk before compiling it (negative if it never is)"""
+        if self.hot_loop is None or loop in self.compiled:
+            return -1
+        return self.hot_loop - self.iterations.get(loop, 0)
+    
+    def _walked(self, loop, budget):
+        if budget > 0:
+            self.iterations[loop] = self.hot_loop - budget
+    
+    def _promote(self, loop):
+        """Returns the compiled function running loop, None if it can't be compiled"""
+        from peep.transpiler import Transpiler, runtime # peep.transpiler imports this module
+        
+        try:
+            namespace = runtime(self.stk, self.output, self.input)
+            exec(compile(Transpiler().transpile_loop(loop), "<peep>", "exec"), namespace)
+            run = namespace["__peep_loop"]
+            self.promoted += 1
+        except (RecursionError, SyntaxError, MemoryError):
+            run = None
+        
+        self.compiled[loop] = run
+        return run
     
     def visit_while(self, while_):
-        self.stk.top().new_scope()
+        slots = self.stk.top().slots
+        run = self.compiled.get(while_)
+        
+        if run is not None:
+            run(slots)
+            return
+        
+        budget = self._budget(while_)
+        
+        block = while_.block
         
         while while_.test.accept(self):
-            if while_.block is not None:
-                while_.block.accept(self)
-            
-            if self.encountered_break:
+            if block.accept(self) is BREAK: # only an ExitBlock returns anything
                 break
             
-            if self.encountered_cont:
-                self.encountered_cont = False
+            budget -= 1
+            if budget == 0 and self._promote(while_) is not None:
+                self.compiled[while_](slots) # goes on from the next test with the values the walk left
+                break
         
-        self.encountered_break = False
-        self.stk.top().old_scope()
+        self._walked(while_, budget)
     
     def visit_for(self, for_):
-        self.stk.top().new_scope()
         for_.init.accept(self)
         
+        slots = self.stk.top().slots
+        run = self.compiled.get(for_)
+        
+        if run is not None:
+            run(slots)
+            return
+        
+        budget = self._budget(for_)
+        
+        block = for_.block
+        
         while for_.test.accept(self):
-            if for_.block is not None:
-                for_.block.accept(self)
+            if block.accept(self) is BREAK:
+                break
             
-            if self.encountered_break:
+            for_.stmt.accept(self)
+            
+            budget -= 1
+            if budget == 0 and self._promote(for_) is not None:
+                self.compiled[for_](slots)
                 break
+        
+        self._walked(for_, budget)
+    
+    def visit_counted_for(self, for_, kernel=None):
+        for_.init.accept(self)
+        
+        slots = self.stk.top().slots
+        run = self.compiled.get(for_)
+        
+        if run is not None and kernel is None:
+            run(slots)
+            return
+        
+        slot = for_.counter.slot
+        start = slots[slot]
+        block = for_.block
+        values = range(start, for_.stop(start, for_.bound.accept(self)), for_.step)
+        
+        done = 0 if kernel is None else kernel.run(slots, values) # iterations done at once, the rest run one by one
+        budget = self._budget(for_)
+        
+        # the block doesn't write the counter, it's set for each iteration only
+        for value in values[done:]:
+            slots[slot] = value
             
-            if self.encountered_cont:
-                self.encountered_cont = False
+            if block.accept(self) is BREAK:
+                self._walked(for_, budget)
+                return # the counter keeps the value it broke out at
             
-            for_.stmt.accept(self)
+            budget -= 1
+            if budget == 0 and self._promote(for_) is not None:
+                slots[slot] = value + for_.step
+                self.compiled[for_](slots)
+                return
         
-        self.encountered_break = False
-        self.stk.top().old_scope()
+        self._walked(for_, budget)
+        slots[slot] = values[-1] + for_.step if values else start # the first value the test rejected
+    
+    def visit_vector_for(self, for_):
+        self.visit_counted_for(for_, for_.kernel)
     
     def visit_break(self, break_):
-        self.encountered_break = True
+        return BREAK
     
     def visit_cont(self, cont):
-        self.encountered_cont = True
+        return CONTINUE
     
     def visit_expr(self, expr):
         expr.expr.accept(self)
@@ -293,57 +487,27 @@ class Interpreter(TreeWalker):
         # we don't want to exploit Python's built-in print
         # function too much so a little modification is made
         if isinstance(out, bool):
-            print("true" if out else "false")
+            self.output.write("true" if out else "false")
         else:
-            print(out)
+            self.output.write(str(out))
     
     def visit_scan(self, scan):
         ident = scan.ident
-        inp = input()
-        ar = self.stk.top()
-        
-        if ident.type == Type.INT:
-            try:
-                ar.put(ident.value, int(inp))
-            except ValueError:
-                self.stk.top().last_lineno = ident.lineno
-                raise_runtime_error(InputCastingError("Cannot cast input to int", ident.lineno), self.stk)
-        elif ident.type == Type.FLOAT:
-            try:
-                ar.put(ident.value, float(inp))
-            except ValueError:
-                self.stk.top().last_lineno = ident.lineno
-                raise_runtime_error(InputCastingError("Cannot cast input to float", ident.lineno), self.stk)
-        elif ident.type == Type.BOOL:
-            if inp not in ['true', 'false']:
-                self.stk.top().last_lineno = ident.lineno
-                raise_runtime_error(InputCastingError("Cannot cast input to bool", ident.lineno), self.stk)
-            ar.put(ident.value, inp == "true")
-        else: # ident.type == Type.STRING
-            ar.put(ident.value, inp)
+        self.stk.top().slots[ident.slot] = scan_input(ident.type, ident.lineno, self.stk, self.output, self.input)
     
     def visit_blk(self, blk):
-        if blk.prev_blk is not None:
-            blk.prev_blk.accept(self)
-        if self.encountered_break or self.encountered_cont:
-            return
-        if blk.stmt is None:
-            return
-        if isinstance(blk.stmt, Block):
-            self.stk.top().new_scope()
-            blk.stmt.accept(self)
-            self.stk.top().old_scope()
-        else:
-            blk.stmt.accept(self)
+        for stmt in blk.stmts:
+            stmt.accept(self)
+    
+    def visit_exit_blk(self, blk):
+        for stmt in blk.stmts:
+            signal = stmt.accept(self)
+            
+            if signal is BREAK or signal is CONTINUE: # visit_decl returns an Identifier
+                return signal
     
     def visit_prgm(self, prgm):
-        from peep import util
-        filename = util.filename
-        if filename.find('/') != -1:
-            filename = filename[filename.rfind('/') + 1:] # remove directory prefix
-        self.stk.push(ActivationRecord(filename, "__MAIN", 0)) # push the topmost activation record
+        self.stk.push(main_record(prgm, prgm.nslots))
         if prgm.block is not None:
-            self.stk.top().new_scope()
             prgm.block.accept(self)
-            self.stk.top().old_scope()
         self.stk.pop()
@@ -1,18 +1,36 @@
+import multiprocessing
+import os
+import re
+
+from concurrent.futures import ProcessPoolExecutor
+from sys import intern
+
 from peep import LexError, raise_error
-from peep import TokenTag, Token
-from peep.util import get_file
+from peep import TokenTag, Token, TokenBuffer
+from peep.context import Context
+from peep.source import load
 
-# global variable
-lineno = 1
 
+class _LexStop(Exception):
+    """Unwinds out of Lexer._next_token with the error which stopped the lexer"""
 
-class Lexer:
-    def __init__(self, filename):
-        fh = get_file(filename)
-        if fh is None:
-            raise LexError("fh is None")
+    def __init__(self, error):
+        super().__init__()
+        self.error = error
 
-        self.prgm = fh.read()
+
+class Lexer:
+    def __init__(self, source, context=None):
+        """
+        source can be a Source, a path to a .peep file or a bytes-like buffer,
+        context the Context of the compilation (a new one by default)
+        """
+        source = load(source)
+        self.context = Context() if context is None else context
+        self.context.filename = source.name
+        self.lineno = 1
+
+        self.prgm = source.text
         self.prgm_len = len(self.prgm)
 
         if self.prgm_len == 0:
@@ -25,22 +43,49 @@ class Lexer:
         self._init_dict()
 
     def next_token(self):
+        try:
+            return self._next_token()
+        except _LexStop as stop:
+            raise_error(stop.error)
+
+    def tokenize(self):
+        """Lexes the rest of the program into a TokenBuffer"""
+        buf = TokenBuffer(self.prgm)
+
+        while True:
+            try:
+                tok = self._next_token()
+            except _LexStop as stop:
+                buf.error = stop.error
+                break
+
+            buf.append(tok.tag, tok.lexeme if tok.lexeme is None else intern(tok.lexeme), self.start, self.idx)
+
+            if tok.tag is TokenTag.EOF:
+                break
+
+        return buf
+
+    def _next_token(self):
         if self.current is None:
-            return Token(TokenTag.EOF, None, lineno)
+            self.start = self.idx
+            return Token(TokenTag.EOF, None, self.lineno)
 
         if self.current.isspace():
             self._eat_whitespace()
-            return self.next_token()
+            return self._next_token()
+
+        self.start = self.idx
 
         if self.current == '/':
             peek = self._peek()
 
             if peek == '/':
                 self._eat_comment()
-                return self.next_token()
+                return self._next_token()
             elif peek == '*':
                 self._eat_multiline_comment()
-                return self.next_token()
+                return self._next_token()
 
         if self.current.isdigit():
             return self._make_num_tok()
@@ -70,7 +115,7 @@ class Lexer:
                 return self._make_token(TokenTag.EQ_OP, '==')
 
             self.prev_tag = TokenTag.ASSIGN
-            return Token(TokenTag.ASSIGN, '=', lineno)
+            return Token(TokenTag.ASSIGN, '=', self.lineno)
 
         if self.current in ('+', '-', '*', '/', '%'):
             op = self.current
@@ -104,7 +149,7 @@ class Lexer:
                 return self._make_token(TokenTag.EQ_OP, '!=')
 
             self.prev_tag = TokenTag.UNARY_OP
-            return Token(TokenTag.UNARY_OP, '!', lineno)
+            return Token(TokenTag.UNARY_OP, '!', self.lineno)
 
         if self.current == '&':
             peek = self._peek()
@@ -127,7 +172,7 @@ class Lexer:
                 return self._make_token(TokenTag.REL_OP, '<=')
 
             self.prev_tag = TokenTag.REL_OP
-            return Token(TokenTag.REL_OP, '<', lineno)
+            return Token(TokenTag.REL_OP, '<', self.lineno)
 
         if self.current == '>':
             self._next_ch()
@@ -136,7 +181,7 @@ class Lexer:
                 return self._make_token(TokenTag.REL_OP, '>=')
 
             self.prev_tag = TokenTag.REL_OP
-            return Token(TokenTag.REL_OP, '>', lineno)
+            return Token(TokenTag.REL_OP, '>', self.lineno)
 
         if self.current == '"':
             escape_characters = {'n': '\n', 't': '\t', 'v': '\v', 'b': '\b', 'f': '\f', 'a': '\a', 'r': '\r', '\\': '\\',
@@ -163,14 +208,14 @@ class Lexer:
 
             return self._make_token(TokenTag.STR_LITERAL, string_literal)
 
-        raise_error(LexError("Unknown token {}".format(self.current), lineno))
+        raise _LexStop(LexError("Unknown token {}".format(self.current), self.lineno))
 
     def _make_token(self, tag, lexeme, skip_twice=False):
         self._next_ch()
         if skip_twice:
             self._next_ch()
         self.prev_tag = tag
-        return Token(tag, lexeme, lineno)
+        return Token(tag, lexeme, self.lineno)
 
     def _make_word_tok(self):
         word = ""
@@ -183,10 +228,10 @@ class Lexer:
 
         if tag is not None:
             self.prev_tag = tag
-            return Token(tag, word, lineno)
+            return Token(tag, word, self.lineno)
 
         self.prev_tag = TokenTag.IDENT
-        return Token(TokenTag.IDENT, word, lineno)
+        return Token(TokenTag.IDENT, word, self.lineno)
 
     def _make_num_tok(self):
         num = ""
@@ -204,10 +249,10 @@ class Lexer:
                 self._next_ch()
 
             self.prev_tag = TokenTag.RL_CONST
-            return Token(TokenTag.RL_CONST, num, lineno)
+            return Token(TokenTag.RL_CONST, num, self.lineno)
 
         self.prev_tag = TokenTag.INT_CONST
-        return Token(TokenTag.INT_CONST, num, lineno)
+        return Token(TokenTag.INT_CONST, num, self.lineno)
 
     def _eat_multiline_comment(self):
         # consume "/*"
@@ -219,7 +264,7 @@ class Lexer:
                 self._next_ch()
 
             if self.current is None:
-                raise_error(LexError("A multi-line comment doesn't end with '*/'!", lineno))
+                raise _LexStop(LexError("A multi-line comment doesn't end with '*/'!", self.lineno))
             elif self._peek() == '/':
                 # consume closing "*/"
                 self._next_ch()
@@ -249,8 +294,7 @@ class Lexer:
 
     def _next_ch(self):
         if self.current == '\n':
-            global lineno
-            lineno += 1
+            self.lineno += 1
         self.idx += 1
         self.current = None if self.idx >= self.prgm_len else self.prgm[self.idx]
 
@@ -271,3 +315,260 @@ class Lexer:
             'true': TokenTag.TRUE,
             'false': TokenTag.FALSE,
         })
+
+
+# one alternative per token class, each preceded by the run of whitespace before
+# it; comments are matched as whole spans so the scanner never has to look at
+# the program one character at a time
+_TOKEN_RE = re.compile(r"""\s*(?:
+    (?P<word>[^\W\d_][^\W_]*)
+  | (?P<comment>//[^\n]*\n?|/\*.*?\*/)
+  | (?P<op>==|!=|<=|>=|&&|\|\||[-+*%]=?|/(?![/*])=?|[(){};=!<>])
+  | (?P<num>\d+(?P<frac>\.\d*)?)
+  | (?P<str>"(?P<body>(?:[^"\\]|\\.)*)"?)
+  | (?P<unclosed>/\*)
+  | (?P<end>\Z)
+  | (?P<unknown>.)
+)""", re.VERBOSE | re.DOTALL)
+
+_ESCAPE_RE = re.compile(r"\\(.)", re.DOTALL)
+
+_ESCAPE_CHARACTERS = {'n': '\n', 't': '\t', 'v': '\v', 'b': '\b', 'f': '\f', 'a': '\a', 'r': '\r', '\\': '\\',
+                      '"': '\"', '\'': '\''}
+
+_OPERATORS = {
+    '(': TokenTag.LPAREN,
+    ')': TokenTag.RPAREN,
+    '{': TokenTag.LBRACK,
+    '}': TokenTag.RBRACK,
+    ';': TokenTag.SEMICOLON,
+    '=': TokenTag.ASSIGN,
+    '||': TokenTag.OR,
+    '&&': TokenTag.AND,
+    '==': TokenTag.EQ_OP,
+    '!=': TokenTag.EQ_OP,
+    '<': TokenTag.REL_OP,
+    '>': TokenTag.REL_OP,
+    '<=': TokenTag.REL_OP,
+    '>=': TokenTag.REL_OP,
+    '+': TokenTag.ADD_OP,
+    '-': TokenTag.ADD_OP,
+    '*': TokenTag.MUL_OP,
+    '/': TokenTag.MUL_OP,
+    '%': TokenTag.MUL_OP,
+    '!': TokenTag.UNARY_OP,
+    '+=': TokenTag.PLUS_EQ,
+    '-=': TokenTag.MINUS_EQ,
+    '*=': TokenTag.MUL_EQ,
+    '/=': TokenTag.DIV_EQ,
+    '%=': TokenTag.MOD_EQ,
+}
+
+# a '+' or '-' directly followed by an operand is unary when it comes after one of these
+_UNARY_CONTEXT = (None, TokenTag.ASSIGN, TokenTag.LPAREN, TokenTag.REL_OP, TokenTag.ADD_OP, TokenTag.MUL_OP)
+
+
+def _unescape(match):
+    ch = match.group(1)
+    return _ESCAPE_CHARACTERS.get(ch, '\\' + ch)
+
+
+class RegexLexer(Lexer):
+    """
+    Drop-in replacement for Lexer which matches whole tokens (and whole runs of
+    whitespace and comments) with one compiled master pattern instead of
+    walking the program one character at a time.
+
+    It produces the same token stream and the same error messages as Lexer.
+    """
+
+    def __init__(self, source, context=None):
+        super().__init__(source, context)
+        self._tokens = None
+
+    def next_token(self):
+        if self._tokens is None:
+            self._tokens = self._stream()
+        return next(self._tokens)
+
+    def _stream(self):
+        buf = self.tokenize()
+
+        for i in range(len(buf)):
+            yield buf.token(i)
+
+        if buf.error is not None:
+            raise_error(buf.error)
+
+        while True:
+            yield buf.token(len(buf) - 1)
+
+    def tokenize(self):
+        buf = TokenBuffer(self.prgm)
+        error = _scan(self.prgm, buf, self.dct, self.prev_tag)
+
+        if error is not None:
+            message, offset = error
+            buf.error = LexError(message, buf.lineno_at(offset))
+            return buf
+
+        buf.append(TokenTag.EOF, None, self.prgm_len, self.prgm_len)
+        return buf
+
+
+def _scan(text, buf, keywords, prev_tag):
+    """
+    Appends the tokens of text to buf. Returns a (message, offset) pair
+    describing the lex error that stopped the scan, or None.
+    """
+    append_tag = buf.tags.append
+    append_lexeme = buf.lexemes.append
+    append_start = buf.starts.append
+    append_end = buf.ends.append
+    operators = _OPERATORS
+
+    for m in _TOKEN_RE.finditer(text):
+        kind = m.lastgroup
+        pos = m.end()
+
+        if kind == 'word':
+            lexeme = intern(m.group(kind))
+            tag = keywords.get(lexeme, TokenTag.IDENT)
+        elif kind == 'op':
+            lexeme = intern(m.group(kind))
+            tag = operators[lexeme]
+
+            if lexeme == '+' or lexeme == '-':
+                peek = text[pos:pos + 1]
+
+                if (peek == '(' or peek.isalnum()) and prev_tag in _UNARY_CONTEXT:
+                    tag = TokenTag.UNARY_OP
+        elif kind == 'comment':
+            continue
+        elif kind == 'num':
+            lexeme = intern(m.group(kind))
+            tag = TokenTag.INT_CONST if m.group('frac') is None else TokenTag.RL_CONST
+        elif kind == 'str':
+            lexeme = m.group('body')
+
+            if '\\' in lexeme:
+                lexeme = _ESCAPE_RE.sub(_unescape, lexeme)
+
+            lexeme = intern(lexeme)
+            tag = TokenTag.STR_LITERAL
+        elif kind == 'end':
+            break
+        elif kind == 'unclosed':
+            return "A multi-line comment doesn't end with '*/'!", len(text)
+        else: # kind == 'unknown'
+            start = m.start(kind)
+            return "Unknown token {}".format(text[start]), start
+
+        append_tag(tag)
+        append_lexeme(lexeme)
+        append_start(m.start(kind))
+        append_end(pos)
+        prev_tag = tag
+
+    return None
+
+
+# sources shorter than this are not worth shipping to worker processes
+PARALLEL_THRESHOLD = 1024 * 1024
+
+# everything a newline can hide in without ending a token: comments and string literals
+_PROTECTED_RE = re.compile(r'//[^\n]*|/\*.*?(?:\*/|\Z)|"(?:[^"\\]|\\.)*"?', re.DOTALL)
+
+_TAGS = list(TokenTag)
+
+
+def _split(text, parts):
+    """
+    Returns the offsets text is cut at to get (at most) the given number of
+    chunks. Every cut is made right after a newline which is not inside a
+    comment or a string literal, so no token spans two chunks.
+    """
+    size = len(text) // parts
+    protected = _PROTECTED_RE.finditer(text)
+    span = next(protected, None)
+    bounds = [0]
+
+    for k in range(1, parts):
+        nl = text.find('\n', max(k * size, bounds[-1]))
+
+        while nl != -1:
+            while span is not None and span.end() <= nl:
+                span = next(protected, None)
+
+            if span is None or nl < span.start():
+                break
+
+            nl = text.find('\n', span.end())
+
+        if nl == -1:
+            break
+
+        bounds.append(nl + 1)
+
+    bounds.append(len(text))
+    return bounds
+
+
+def _lex_chunk(chunk, keywords):
+    # runs in a worker process; tags travel back as their values
+    buf = TokenBuffer(chunk)
+    error = _scan(chunk, buf, keywords, None)
+    return bytes(tag.value for tag in buf.tags), buf.lexemes, buf.starts, buf.ends, error
+
+
+class ParallelLexer(RegexLexer):
+    """
+    RegexLexer which lexes big programs in chunks on a pool of worker
+    processes and stitches the results back into one TokenBuffer. Programs
+    below the threshold are lexed in-process.
+    """
+
+    def __init__(self, source, workers=None, threshold=PARALLEL_THRESHOLD, context=None):
+        super().__init__(source, context)
+        self.workers = workers or os.cpu_count() or 1
+        self.threshold = threshold
+
+    def tokenize(self):
+        text = self.prgm
+
+        # daemonic processes, like the workers of peep batch, can't start a pool of their own
+        if self.prgm_len < self.threshold or self.workers < 2 or multiprocessing.current_process().daemon:
+            return super().tokenize()
+
+        bounds = _split(text, self.workers)
+        chunks = [text[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
+
+        with ProcessPoolExecutor(max_workers=len(chunks)) as pool:
+            results = list(pool.map(_lex_chunk, chunks, [self.dct] * len(chunks)))
+
+        buf = TokenBuffer(text)
+        prev_tag = self.prev_tag
+
+        for base, (tags, lexemes, starts, ends, error) in zip(bounds, results):
+            first = len(buf.tags)
+            buf.tags.extend([_TAGS[value] for value in tags])
+            buf.lexemes.extend(map(intern, lexemes))
+            buf.starts.extend([start + base for start in starts])
+            buf.ends.extend([end + base for end in ends])
+
+            # the chunk was lexed as if it started the program, so a leading +/- may
+            # have been taken for a unary operator when the token before it says otherwise
+            if (first < len(buf.tags) and buf.tags[first] is TokenTag.UNARY_OP and buf.lexemes[first] != '!' and
+                    prev_tag not in _UNARY_CONTEXT):
+                buf.tags[first] = TokenTag.ADD_OP
+
+            if error is not None:
+                message, offset = error
+                buf.error = LexError(message, buf.lineno_at(base + offset))
+                return buf
+
+            if len(buf.tags) > 0:
+                prev_tag = buf.tags[-1]
+
+        buf.append(TokenTag.EOF, None, self.prgm_len, self.prgm_len)
+        return buf
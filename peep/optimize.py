@@ -0,0 +1,429 @@
+import copy
+import operator
+
+from peep import *
+from peep import Default
+from peep import TreeWalker
+from peep.compiler import DIVISIONS, division, is_zero
+from peep.folding import constant, fold
+
+# statements writing the variable in their ident attribute
+STORES = (Declaration, Assign, Increment, Decrement, MultiplicativeAssign, DivisionAssign, ModulusAssign, Scan)
+UPDATES = (Increment, Decrement, MultiplicativeAssign, DivisionAssign, ModulusAssign)
+
+def subnodes(node):
+    """Returns the nodes directly below node, leaving out the variable a statement writes"""
+    if isinstance(node, ChainOp):
+        return node.operands
+    elif isinstance(node, BinaryOp):
+        return [node.left, node.right]
+    elif isinstance(node, UnaryOp):
+        return [node.operand]
+    elif isinstance(node, (Assign,) + UPDATES) or isinstance(node, Expression):
+        return [node.expr]
+    elif isinstance(node, Print):
+        return [node.arg]
+    elif isinstance(node, If):
+        return [node.test, node.block] + node.brs
+    elif isinstance(node, While):
+        return [node.test, node.block]
+    elif isinstance(node, For):
+        return [node.init, node.test, node.stmt, node.block]
+    elif isinstance(node, Block):
+        return node.stmts
+    elif isinstance(node, Program):
+        return [node.block]
+    return []
+
+def walk(node):
+    """Yields node and every node below it"""
+    stack = [node]
+    
+    while stack:
+        node = stack.pop()
+        if node is not None:
+            yield node
+            stack.extend(subnodes(node))
+
+def target(stmt):
+    """The variable a STORES statement writes"""
+    ident = stmt.ident
+    return ident.ident if isinstance(ident, Declaration) else ident
+
+def written(node):
+    """Variables written anywhere inside node"""
+    return {target(n) for n in walk(node) if isinstance(n, STORES)}
+
+def read(node):
+    """Variables read anywhere inside node"""
+    return {n for n in walk(node) if isinstance(n, Identifier)}
+
+def pure(expr):
+    """Tells whether evaluating expr can't fail, ie. it divides by nonzero constants only"""
+    for node in walk(expr):
+        if isinstance(node, MultiplicativeOp):
+            for op, operand in zip(node.ops, node.operands[1:]):
+                if op in DIVISIONS and (not isinstance(operand, Constant) or is_zero(operand.value, node.type)):
+                    return False
+    return True
+
+def temporary(expr, name, slot):
+    """Returns a new variable called name in slot and the statement storing expr in it"""
+    ident = Identifier(expr.type, name)
+    ident.slot = slot
+    assign = Assign(Declaration(ident), expr)
+    ident.lineno = assign.lineno = assign.ident.lineno = expr.lineno
+    return ident, assign
+
+def merge(envs):
+    """Keeps the constants all envs agree on"""
+    first = envs[0]
+    # repr tells 0.0 and -0.0 apart, they print differently
+    return {ident: value for ident, value in first.items() if all(ident in env and repr(env[ident]) == repr(value) for env in envs[1:])}
+
+class Optimizer(TreeWalker):
+    """
+    Optional optimization pass (-O) over a checked AST, run before executing it:
+    
+    - constant propagation: variables holding a known constant where they
+      are read are replaced by it and the expressions refolded. Loops forget
+      the variables they write, scan() makes its variable unknown.
+    - dead code: branches and loops with constant conditions, expression
+      statements without effects, statements after break and continue, and
+      stores to variables never read are removed.
+    - loop-invariant code motion: pure expressions in a loop which read no
+      variable the loop writes are computed once into a temporary before it.
+    
+    Only expressions which can't fail are moved or removed, so prints, scans
+    and runtime errors happen in the same order as in the original program.
+    """
+    
+    def __init__(self):
+        self.env = {} # Identifier -> value it is known to hold
+        self.nslots = 0
+        self.ntemps = 0
+    
+    def optimize(self, tree):
+        if tree is None or tree.block is None:
+            return tree
+        
+        self.nslots = tree.nslots
+        tree.accept(self)
+        self._hoist(tree.block)
+        self._remove_dead_stores(tree)
+        tree.nslots = self.nslots
+        
+        return tree
+    
+    # constant propagation and dead branches
+    
+    def visit_ident(self, ident):
+        if ident in self.env:
+            return constant(ident, self.env[ident]) # keeps the variable's line for runtime errors
+        return ident
+    
+    def visit_const(self, const):
+        return const
+    
+    def _logic(self, chain):
+        """Drops the constants of a || or && chain that can't change its result"""
+        decisive = isinstance(chain, OrOperator) # true decides a || chain, false a && chain
+        operands = []
+        
+        for operand in chain.operands:
+            operand = operand.accept(self)
+            
+            if isinstance(operand, Constant):
+                if operand.value != decisive:
+                    continue
+                if all(pure(o) for o in operands):
+                    return constant(chain, decisive)
+                operands.append(operand) # the operands before it still run
+                break
+            operands.append(operand)
+        
+        if not operands:
+            return constant(chain, not decisive)
+        if len(operands) == 1:
+            return operands[0]
+        
+        chain.operands = operands
+        chain.ops = chain.ops[:len(operands) - 1]
+        return chain
+    
+    def visit_orop(self, orop):
+        return self._logic(orop)
+    
+    def visit_andop(self, andop):
+        return self._logic(andop)
+    
+    def _binary(self, binop):
+        binop.left = binop.left.accept(self)
+        binop.right = binop.right.accept(self)
+        return fold(binop, report=False)
+    
+    def visit_eqop(self, eqop):
+        return self._binary(eqop)
+    
+    def visit_relop(self, relop):
+        return self._binary(relop)
+    
+    def _chain(self, chain):
+        chain.operands = [operand.accept(self) for operand in chain.operands]
+        return fold(chain, report=False) # a division by zero is left to fail at run time
+    
+    def visit_addop(self, addop):
+        return self._chain(addop)
+    
+    def visit_mulop(self, mulop):
+        return self._chain(mulop)
+    
+    def visit_uop(self, uop):
+        uop.operand = uop.operand.accept(self)
+        return fold(uop, report=False)
+    
+    def visit_decl(self, decl):
+        self.env[decl.ident] = Default.default_value(decl.ident.type)
+        return decl
+    
+    def visit_assign(self, assign):
+        if isinstance(assign.ident, Declaration):
+            assign.ident.accept(self) # int x = x + 1; reads the default value
+        assign.expr = assign.expr.accept(self)
+        ident = target(assign)
+        
+        if isinstance(assign.expr, Constant):
+            self.env[ident] = assign.expr.value
+        else:
+            self.env.pop(ident, None)
+        
+        return assign
+    
+    def _update(self, node, func, divides=False):
+        node.expr = node.expr.accept(self)
+        ident = node.ident
+        
+        # "/=" and "%=" by zero fail at run time
+        if ident in self.env and isinstance(node.expr, Constant) and not (divides and is_zero(node.expr.value, node.expr.type)):
+            self.env[ident] = func(self.env[ident], node.expr.value)
+            return node
+        
+        self.env.pop(ident, None)
+        return node
+    
+    def visit_inc(self, inc):
+        return self._update(inc, operator.add)
+    
+    def visit_dec(self, dec):
+        return self._update(dec, operator.sub)
+    
+    def visit_mul_assign(self, mul_assign):
+        return self._update(mul_assign, operator.mul)
+    
+    def visit_div_assign(self, div_assign):
+        return self._update(div_assign, division(div_assign.ident.type), True)
+    
+    def visit_mod_assign(self, mod_assign):
+        return self._update(mod_assign, operator.mod, True)
+    
+    def visit_if(self, if_):
+        branches = [br for br in [if_] + if_.brs if isinstance(br, If)]
+        orelse = if_.brs[-1] if if_.brs and not isinstance(if_.brs[-1], If) else None
+        before = self.env
+        kept = []
+        envs = []
+        
+        for br in branches:
+            self.env = before
+            br.test = br.test.accept(self)
+            
+            if isinstance(br.test, Constant):
+                if not br.test.value:
+                    continue # never taken
+                orelse = br.block # always taken, the branches after it never are
+                break
+            
+            self.env = dict(before)
+            br.block = br.block.accept(self)
+            envs.append(self.env)
+            kept.append(br)
+        
+        self.env = dict(before)
+        if orelse is not None:
+            orelse = orelse.accept(self)
+        envs.append(self.env)
+        self.env = merge(envs)
+        
+        if not kept:
+            return orelse
+        if all(not br.block.stmts and pure(br.test) for br in kept) and (orelse is None or not orelse.stmts):
+            return None
+        
+        first = kept[0]
+        first.brs = kept[1:] + ([orelse] if orelse is not None else [])
+        for br in kept[1:]:
+            br.brs = []
+        return first
+    
+    def _enters(self, test):
+        """Tells whether a loop with test may run at all, judging by the values known before it"""
+        memo = {id(ident): ident for ident in read(test)} # copy the expression, not the variables
+        test = copy.deepcopy(test, memo).accept(self)
+        return not isinstance(test, Constant) or test.value
+    
+    def _forget(self, idents):
+        for ident in idents:
+            self.env.pop(ident, None)
+    
+    def visit_while(self, while_):
+        if not self._enters(while_.test):
+            return None
+        
+        self._forget(written(while_.block)) # whatever the loop writes isn't known in it or after it
+        while_.test = while_.test.accept(self)
+        after = dict(self.env)
+        while_.block = while_.block.accept(self)
+        self.env = after
+        return while_
+    
+    def visit_for(self, for_):
+        for_.init = for_.init.accept(self)
+        
+        if not self._enters(for_.test):
+            return for_.init # only the initialization runs
+        
+        self._forget(written(for_.block) | written(for_.stmt))
+        for_.test = for_.test.accept(self)
+        
+        after = dict(self.env)
+        for_.block = for_.block.accept(self)
+        for_.stmt = for_.stmt.accept(self)
+        self.env = after
+        return for_
+    
+    def visit_break(self, break_):
+        return break_
+    
+    def visit_cont(self, cont):
+        return cont
+    
+    def visit_expr(self, expr):
+        expr.expr = expr.expr.accept(self)
+        return None if pure(expr.expr) else expr
+    
+    def visit_print(self, print_):
+        print_.arg = print_.arg.accept(self)
+        return print_
+    
+    def visit_scan(self, scan):
+        self.env.pop(scan.ident, None) # the input isn't known
+        return scan
+    
+    def visit_blk(self, blk):
+        stmts = []
+        
+        for stmt in blk.stmts:
+            stmt = stmt.accept(self)
+            
+            if isinstance(stmt, Block):
+                # every variable has its own slot, so a nested block's statements
+                # can run in the enclosing one
+                stmts.extend(stmt.stmts)
+            elif stmt is not None:
+                stmts.append(stmt)
+            
+            if stmts and isinstance(stmts[-1], (Break, Continue)):
+                break # the rest of the block is unreachable
+        
+        blk.stmts = stmts
+        return blk
+    
+    def visit_prgm(self, prgm):
+        prgm.block = prgm.block.accept(self)
+        return prgm
+    
+    # loop-invariant code motion
+    
+    def _hoist(self, blk):
+        """Moves the invariant expressions of the loops in blk in front of them"""
+        stmts = []
+        
+        for stmt in blk.stmts:
+            if isinstance(stmt, If):
+                for br in [stmt] + stmt.brs:
+                    self._hoist(br.block if isinstance(br, If) else br)
+            elif isinstance(stmt, Block):
+                self._hoist(stmt)
+            elif isinstance(stmt, (While, For)):
+                self._hoist(stmt.block) # inner loops first, their temporaries may move further out
+                stmts.extend(self._hoist_loop(stmt))
+            stmts.append(stmt)
+        
+        blk.stmts = stmts
+    
+    def _hoist_loop(self, loop):
+        """Returns the assignments of the temporaries replacing invariant expressions of loop"""
+        variant = written(loop)
+        assigns = []
+        
+        def rewrite(expr):
+            if isinstance(expr, (Identifier, Constant)):
+                return expr
+            
+            if pure(expr) and not read(expr) & variant:
+                ident, assign = temporary(expr, "$t{}".format(self.ntemps), self.nslots)
+                self.ntemps += 1
+                self.nslots += 1
+                assigns.append(assign)
+                return ident
+            
+            if isinstance(expr, ChainOp):
+                expr.operands = [rewrite(operand) for operand in expr.operands]
+            elif isinstance(expr, BinaryOp):
+                expr.left = rewrite(expr.left)
+                expr.right = rewrite(expr.right)
+            elif isinstance(expr, UnaryOp):
+                expr.operand = rewrite(expr.operand)
+            return expr
+        
+        for node in walk(loop):
+            if isinstance(loop, For) and node is loop.init:
+                continue # runs once anyway
+            if isinstance(node, (While, For, If)):
+                node.test = rewrite(node.test)
+            elif isinstance(node, (Assign, Expression) + UPDATES):
+                node.expr = rewrite(node.expr)
+            elif isinstance(node, Print):
+                node.arg = rewrite(node.arg)
+        
+        return assigns
+    
+    # dead stores
+    
+    def _remove_dead_stores(self, tree):
+        # removing a store can leave the variables its expression read unread too
+        while True:
+            reads = read(tree)
+            # an update which stays also reads its variable, so the stores before it must stay too
+            live = reads | {target(n) for n in walk(tree) if isinstance(n, UPDATES) and not self._dead(n, reads)}
+            removed = False
+            
+            for blk in [n for n in walk(tree) if isinstance(n, Block)]:
+                stmts = [stmt for stmt in blk.stmts if not self._dead(stmt, live)]
+                removed = removed or len(stmts) != len(blk.stmts)
+                blk.stmts = stmts
+            
+            if not removed:
+                return
+    
+    def _dead(self, stmt, live):
+        """Tells whether stmt can be removed when only the live variables are read"""
+        if isinstance(stmt, Block):
+            return not stmt.stmts
+        if not isinstance(stmt, STORES) or isinstance(stmt, Scan) or target(stmt) in live:
+            return False
+        if isinstance(stmt, Declaration):
+            return True
+        if isinstance(stmt, (DivisionAssign, ModulusAssign)): # fail on a zero divisor
+            return isinstance(stmt.expr, Constant) and not is_zero(stmt.expr.value, stmt.expr.type) and pure(stmt.expr)
+        return pure(stmt.expr)
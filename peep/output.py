@@ -0,0 +1,87 @@
+import sys
+
+from abc import ABC, abstractmethod
+
+BUFFER_SIZE = 64 * 1024 # characters printed before a buffered sink writes them out
+
+class Output(ABC):
+    """
+    Where the print statements of a program go. Engines pass write() each
+    printed line without its newline, and flush() the sink before reporting
+    a runtime error, before reading input from a terminal and when the
+    program ends.
+    """
+    
+    @abstractmethod
+    def write(self, line):
+        pass
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        self.flush()
+
+class BufferedOutput(Output):
+    """Collects lines until buffer_size characters are waiting, then writes them out at once"""
+    
+    def __init__(self, buffer_size=BUFFER_SIZE):
+        self.buffer_size = buffer_size # 0 writes every line as soon as it is printed
+        self.lines = []
+        self.size = 0
+    
+    def write(self, line):
+        self.lines.append(line)
+        self.size += len(line) + 1
+        
+        if self.size >= self.buffer_size:
+            self.flush()
+    
+    def flush(self):
+        if self.lines:
+            lines = self.lines
+            self.lines = []
+            self.size = 0
+            self._emit("\n".join(lines) + "\n")
+    
+    @abstractmethod
+    def _emit(self, text):
+        pass
+
+class StdoutSink(BufferedOutput):
+    """Writes to sys.stdout (looked up on every write, so redirecting it works)"""
+    
+    def _emit(self, text):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+class FileSink(BufferedOutput):
+    def __init__(self, path, buffer_size=BUFFER_SIZE, encoding="utf-8"):
+        super().__init__(buffer_size)
+        self.file = open(path, "w", encoding=encoding)
+    
+    def _emit(self, text):
+        self.file.write(text)
+        self.file.flush()
+    
+    def close(self):
+        self.flush()
+        self.file.close()
+
+class MemorySink(Output):
+    """Collects the printed lines in a list, or writes them to a text stream such as io.StringIO"""
+    
+    def __init__(self, target=None):
+        self.target = [] if target is None else target
+    
+    def write(self, line):
+        if isinstance(self.target, list):
+            self.target.append(line)
+        else:
+            self.target.write(line + "\n")
+    
+    def getvalue(self):
+        """Everything printed so far, one line per print"""
+        if isinstance(self.target, list):
+            return "".join(line + "\n" for line in self.target)
+        return self.target.getvalue()
@@ -1,42 +1,151 @@
 from peep import *
-from peep import DuplicateIdentError, UndeclaredIdentError, SyntaxError, raise_error
+from peep import DuplicateIdentError, ErrorList, LexError, PeepError, UndeclaredIdentError, SyntaxError, TypeError, raise_error
 from peep import Scope
 from peep import TokenTag as Tag
 from peep import Type
+from peep.context import current
+
+# binding power of the binary operators
+PRECEDENCE = {
+    Tag.OR: 1,
+    Tag.AND: 2,
+    Tag.EQ_OP: 3,
+    Tag.REL_OP: 4,
+    Tag.ADD_OP: 5,
+    Tag.MUL_OP: 6
+}
+
+# operators whose chains are kept flat in a single node
+CHAINS = {
+    Tag.OR: OrOperator,
+    Tag.AND: AndOperator,
+    Tag.ADD_OP: AddictiveOp,
+    Tag.MUL_OP: MultiplicativeOp
+}
+
+class _Stop(Exception):
+    """Raised once the rest of the program can't be parsed (ie. after a lex error)"""
 
 class Parser(object):
     def __init__(self, lexer):
         self.lexer = lexer
+        self.context = lexer.context
+        self.toks = lexer.tokenize()
+        self.tags = self.toks.tags
+        self.lexemes = self.toks.lexemes
+        # index of the token the lexer failed to produce (if any)
+        self.stop = len(self.tags) if self.toks.error is not None else -1
+        self.pos = -1
         self.symtab = None
-        self.look = None
+        self.next_slot = 0 # slot of the next declared variable (slots are reused once a scope is closed)
+        self.nslots = 0
         self.in_loop = False
+        self.errors = [] # errors found so far, parsing goes on after most of them
         self._move()
     
     def parse(self):
         """
-        Returns a root of AST
+        Returns a root of AST. A statement with an error is skipped and
+        parsing goes on with the next one, so that every error of the
+        program is found; the error (an ErrorList if there are several) is
+        raised at the end.
         
         <program> ::= <block>
         """
-        node = Program(self._block())
-        self._match(Tag.EOF)
+        self.context.cursor = self
+        token = current.set(self.context)
+        
+        try:
+            block = self._block()
+            node = Program(block, self.nslots, self.context.filename)
+            self._match(Tag.EOF)
+        except _Stop:
+            pass
+        except PeepError as error: # outside of any statement (ie. a missing brace)
+            self.errors.append(error)
+        finally:
+            current.reset(token)
+            self.context.cursor = None
+        
+        if len(self.errors) == 1:
+            raise self.errors[0]
+        elif self.errors:
+            raise ErrorList(self.errors)
+        
         return node
     
+    def lineno(self):
+        """Returns the line number of the lookahead token"""
+        return self.toks.lineno(self.pos)
+    
     def _block(self):
         """<block> ::= "{" { <statement> } "}"""
-        node = None
+        self._enter_scope()
+        self._match(Tag.LBRACK)
+        node = Block(self._statements())
+        self._match(Tag.RBRACK)
+        self._leave_scope()
         
+        return node
+    
+    def _enter_scope(self):
         self.symtab = Scope(self.symtab)
-        self._match(Tag.LBRACK)
+    
+    def _leave_scope(self):
+        # variables of a closed scope are never referenced again so their slots can be reused
+        self.next_slot -= len(self.symtab.dct)
+        self.symtab = self.symtab.parent
+    
+    def _statements(self):
+        """Parses statements up to the closing "}" of the current block"""
+        stmts = []
         
-        while self.look.tag is not Tag.RBRACK:
-            prev_blk = node
-            node = Block(prev_blk, self._statement())
+        while self.tags[self.pos] is not Tag.RBRACK:
+            state = self.symtab, self.next_slot, self.in_loop
+            
+            try:
+                stmt = self._statement()
+            except LexError as error:
+                self.errors.append(error)
+                raise _Stop() # there are no tokens after it
+            except PeepError as error:
+                self.errors.append(error)
+                self.symtab, self.next_slot, self.in_loop = state # scopes the statement opened are left
+                self._skip()
+                continue
+            
+            if stmt is not None: # skip empty statements
+                stmts.append(stmt)
         
-        self._match(Tag.RBRACK)
-        self.symtab = self.symtab.parent
+        return stmts
+    
+    def _skip(self):
+        """
+        Skips the rest of a statement with an error: up to the end of the
+        next ";" or block at its level, or up to the "}" closing the block
+        it's in
+        """
+        depth = 0
         
-        return node
+        try:
+            while self.tags[self.pos] is not Tag.EOF:
+                tag = self.tags[self.pos]
+                
+                if tag is Tag.RBRACK:
+                    if depth == 0:
+                        return
+                    depth -= 1
+                elif tag is Tag.LBRACK:
+                    depth += 1
+                
+                self._move()
+                
+                if depth == 0 and (tag is Tag.SEMICOLON or tag is Tag.RBRACK and self.tags[self.pos] is not Tag.ELSE):
+                    return
+        except LexError as error:
+            self.errors.append(error)
+        
+        raise _Stop() # the end of the program (or of its tokens) was reached
     
     def _statement(self):
         """
@@ -61,28 +170,28 @@ class Parser(object):
         """
         node = None
         
-        if self.look.tag is Tag.IF:
+        if self.tags[self.pos] is Tag.IF:
             self._match(Tag.IF)
-            node = If(self._paren_expr(), self._block(), [])
+            node = If(self._test(), self._block(), [])
             
-            while self.look.tag is Tag.ELSE:
+            while self.tags[self.pos] is Tag.ELSE:
                 self._match(Tag.ELSE)
                 
-                if self.look.tag is Tag.IF:
+                if self.tags[self.pos] is Tag.IF:
                     self._match(Tag.IF)
-                    node.brs.append(If(self._paren_expr(), self._block(), [])) # consume else-if branch
-                else: # self.look.tag is Tag.LBRACK
+                    node.brs.append(If(self._test(), self._block(), [])) # consume else-if branch
+                else: # self.tags[self.pos] is Tag.LBRACK
                     node.brs.append(self._block()) # consume else branch
                     break
-        elif self.look.tag is Tag.WHILE:
+        elif self.tags[self.pos] is Tag.WHILE:
             self._match(Tag.WHILE)
             self.in_loop = True
-            node = While(self._paren_expr(), self._block())
+            node = While(self._test(), self._block())
             self.in_loop = False
-        elif self.look.tag is Tag.FOR:
+        elif self.tags[self.pos] is Tag.FOR:
             # we're doing this early because we want the initialization statement to
             # be inside a for-loop scope not the scope outside the loop
-            self.symtab = Scope(self.symtab)
+            self._enter_scope()
             
             init = None
             test = None
@@ -98,81 +207,76 @@ class Parser(object):
             
             ident = self._check_ident()
             
-            if self.look.tag is Tag.ASSIGN:
+            if self.tags[self.pos] is Tag.ASSIGN:
                 stmt = self._assign(ident)
-            elif self.look.tag is Tag.PLUS_EQ:
+            elif self.tags[self.pos] is Tag.PLUS_EQ:
                 stmt = self._inc(ident)
-            elif self.look.tag is Tag.MINUS_EQ:
+            elif self.tags[self.pos] is Tag.MINUS_EQ:
                 stmt = self._dec(ident)
-            elif self.look.tag is Tag.MUL_EQ:
+            elif self.tags[self.pos] is Tag.MUL_EQ:
                 stmt = self._mul_eq(ident)
-            elif self.look.tag is Tag.DIV_EQ:
+            elif self.tags[self.pos] is Tag.DIV_EQ:
                 stmt = self._div_eq(ident)
-            elif self.look.tag is Tag.MOD_EQ:
+            elif self.tags[self.pos] is Tag.MOD_EQ:
                 stmt = self._mod_eq(ident)
             else:
-                raise_error(SyntaxError("Expected '=', '+=', '-=', '*=', '/=', '%=' but got {} instead!".format(self.look.tag), self.look.lineno))
+                raise_error(SyntaxError("Expected '=', '+=', '-=', '*=', '/=', '%=' but got {} instead!".format(self.tags[self.pos]), self.lineno()))
             
             self._match(Tag.RPAREN)
+            self._check_test(test)
             self.in_loop = True
             self._match(Tag.LBRACK)
-            
-            block_node = None
-            
-            while self.look.tag is not Tag.RBRACK:
-                prev_blk = block_node
-                block_node = Block(prev_blk, self._statement())
-            
+            block_node = Block(self._statements())
             self._match(Tag.RBRACK)
             node = For(init, test, stmt, block_node)
             self.in_loop = False
-            self.symtab = self.symtab.parent
-        elif self.look.tag is Tag.BREAK:
+            self._leave_scope()
+        elif self.tags[self.pos] is Tag.BREAK:
             if not self.in_loop:
-                raise_error(SyntaxError("break is used outside of a loop!", self.look.lineno))
+                raise_error(SyntaxError("break is used outside of a loop!", self.lineno()))
             self._match(Tag.BREAK)
             node = Break()
             self._match(Tag.SEMICOLON)
-        elif self.look.tag is Tag.CONTINUE:
+        elif self.tags[self.pos] is Tag.CONTINUE:
             if not self.in_loop:
-                raise_error(SyntaxError("continue is used outside of a loop!", self.look.lineno))
+                raise_error(SyntaxError("continue is used outside of a loop!", self.lineno()))
             self._match(Tag.CONTINUE)
             node = Continue()
             self._match(Tag.SEMICOLON)
-        elif self.look.tag is Tag.LBRACK:
+        elif self.tags[self.pos] is Tag.LBRACK:
             node = self._block()
-        elif self.look.tag in [Tag.INT, Tag.FLOAT, Tag.BOOL, Tag.STRING]:
+        elif self.tags[self.pos] in [Tag.INT, Tag.FLOAT, Tag.BOOL, Tag.STRING]:
             node = self._declaration(False)
-        elif self.look.tag is Tag.IDENT:
+        elif self.tags[self.pos] is Tag.IDENT:
             ident = self._check_ident()
             
-            if self.look.tag is Tag.ASSIGN:
+            if self.tags[self.pos] is Tag.ASSIGN:
                 node = self._assign(ident)
-            elif self.look.tag is Tag.PLUS_EQ:
+            elif self.tags[self.pos] is Tag.PLUS_EQ:
                 node = self._inc(ident)
-            elif self.look.tag is Tag.MINUS_EQ:
+            elif self.tags[self.pos] is Tag.MINUS_EQ:
                 node = self._dec(ident)
-            elif self.look.tag is Tag.MUL_EQ:
+            elif self.tags[self.pos] is Tag.MUL_EQ:
                 node = self._mul_eq(ident)
-            elif self.look.tag is Tag.DIV_EQ:
+            elif self.tags[self.pos] is Tag.DIV_EQ:
                 node = self._div_eq(ident)
-            elif self.look.tag is Tag.MOD_EQ:
+            elif self.tags[self.pos] is Tag.MOD_EQ:
                 node = self._mod_eq(ident)
             else:
-                raise_error(SyntaxError("Expected '=', '+=', '-=', '*=', '/=', '%=' but got {} instead!".format(self.look.tag), self.look.lineno))
+                raise_error(SyntaxError("Expected '=', '+=', '-=', '*=', '/=', '%=' but got {} instead!".format(self.tags[self.pos]), self.lineno()))
             
             self._match(Tag.SEMICOLON)
-        elif self.look.tag is Tag.PRINT:
+        elif self.tags[self.pos] is Tag.PRINT:
             self._match(Tag.PRINT)
             node = Print(self._paren_expr())
             self._match(Tag.SEMICOLON)
-        elif self.look.tag is Tag.SCAN:
+        elif self.tags[self.pos] is Tag.SCAN:
             self._match(Tag.SCAN)
             self._match(Tag.LPAREN)
             node = Scan(self._check_ident())
             self._match(Tag.RPAREN)
             self._match(Tag.SEMICOLON)
-        elif self.look.tag is Tag.SEMICOLON: # empty statement
+        elif self.tags[self.pos] is Tag.SEMICOLON: # empty statement
             self._match(Tag.SEMICOLON)
         else: # expression
             node = Expression(self._expr())
@@ -192,29 +296,33 @@ class Parser(object):
         """
         type = None
         
-        if self.look.tag is Tag.INT:
+        if self.tags[self.pos] is Tag.INT:
             type = Type.INT
             self._match(Tag.INT)
-        elif self.look.tag is Tag.FLOAT:
+        elif self.tags[self.pos] is Tag.FLOAT:
             type = Type.FLOAT
             self._match(Tag.FLOAT)
-        elif self.look.tag is Tag.BOOL:
+        elif self.tags[self.pos] is Tag.BOOL:
             type = Type.BOOL
             self._match(Tag.BOOL)
         else:
             type = Type.STRING
             self._match(Tag.STRING)
         
-        ident = Identifier(type, self.look.lexeme)
+        ident = Identifier(type, self.lexemes[self.pos])
         
         # the new identifier must not exist in local scope
-        if self.symtab.lookup_local(self.look.lexeme) is not None:
-            raise_error(DuplicateIdentError(self.look.lexeme, self.look.lineno))
-        self.symtab[self.look.lexeme] = ident
+        if self.symtab.lookup_local(self.lexemes[self.pos]) is not None:
+            raise_error(DuplicateIdentError(self.lexemes[self.pos], self.lineno()))
+        self.symtab[self.lexemes[self.pos]] = ident
+        
+        ident.slot = self.next_slot
+        self.next_slot += 1
+        self.nslots = max(self.nslots, self.next_slot)
         
         self._match(Tag.IDENT)
         
-        if not force_assign and self.look.tag is Tag.SEMICOLON:
+        if not force_assign and self.tags[self.pos] is Tag.SEMICOLON:
             self._match(Tag.SEMICOLON)
             return Declaration(ident)
         else:
@@ -248,6 +356,17 @@ class Parser(object):
         self._match(Tag.MOD_EQ)
         return ModulusAssign(ident, self._expr())
     
+    def _test(self):
+        """The condition of an if or a while, a <paren_expression>"""
+        test = self._paren_expr()
+        self._check_test(test)
+        return test
+    
+    def _check_test(self, test):
+        # before the block is parsed, a statement with an error is skipped from where it was raised
+        if not Type.is_bool(test.type):
+            raise_error(TypeError(self.lineno(), "Expression inside (...) must return bool! (It returns {} instead)".format(test.type)))
+    
     def _paren_expr(self):
         """<paren_expression> ::= "(" <expression> ")"""
         node = None
@@ -259,68 +378,91 @@ class Parser(object):
         return node
     
     def _expr(self):
-        """<expression> ::= <or_operand> [ "||" <or_operand> ]"""
-        expr = self._or_operand()
-        
-        while self.look.tag is Tag.OR:
-            self._match(Tag.OR)
-            expr = OrOperator(expr, self._or_operand())
-        
-        return expr
-    
-    def _or_operand(self):
-        """<or_operand> ::= <and_operand> [ "&&" <and_operand> ]"""
-        or_operand = self._and_operand()
-        
-        while self.look.tag is Tag.AND:
-            self._match(Tag.AND)
-            or_operand = AndOperator(or_operand, self._and_operand())
-        
-        return or_operand
-    
-    def _and_operand(self):
-        """<and_operand> ::= <equality_operand> [ <equality_op> <equality_operand> ]"""
-        and_operand = self._eq_operand()
-        
-        while self.look.tag is Tag.EQ_OP:
-            op = self.look.lexeme
-            self._match(Tag.EQ_OP)
-            and_operand = EqualityOp(and_operand, self._eq_operand(), op)
-        
-        return and_operand
-    
-    def _eq_operand(self):
-        """<equality_operand> ::= <simple_expression> [ <relational_op> <simple_expression> ]"""
-        eq_operand = self._simple_expr()
+        """
+        <expression> ::= <or_operand> [ "||" <or_operand> ]
+        <or_operand> ::= <and_operand> [ "&&" <and_operand> ]
+        <and_operand> ::= <equality_operand> [ <equality_op> <equality_operand> ]
+        <equality_operand> ::= <simple_expression> [ <relational_op> <simple_expression> ]
+        <simple_expression> ::= <term> [ <addictive_op> <term> ]
+        <term> ::= <factor> [ <multiplicative_op> <factor> ]
         
-        while self.look.tag is Tag.REL_OP:
-            op = self.look.lexeme
-            self._match(Tag.REL_OP)
-            eq_operand = RelationalOp(eq_operand, self._simple_expr(), op)
+        Rather than recursing through one function per precedence level (and
+        through all of them again for every pair of parentheses), expressions
+        are parsed with explicit operand and operator stacks.
+        """
+        operands = []
+        operators = [] # binary operators as (precedence, tag, op), "(" and unary operators as (None, tag, op)
+        parens = 0
         
-        return eq_operand
-    
-    def _simple_expr(self):
-        """<simple_expression> ::= <term> [ <addictive_op> <term> ]"""
-        simpl_expr = self._term()
+        while True:
+            while self.tags[self.pos] is Tag.UNARY_OP or self.tags[self.pos] is Tag.LPAREN:
+                tag = self.tags[self.pos]
+                operators.append((None, tag, self.lexemes[self.pos]))
+                self._match(tag)
+                
+                if tag is Tag.LPAREN:
+                    parens += 1
+            
+            operands.append(self._factor())
+            
+            while True:
+                # unary operators apply to the operand that was just completed
+                while operators and operators[-1][1] is Tag.UNARY_OP:
+                    operands.append(fold(UnaryOp(operators.pop()[2], operands.pop())))
+                
+                if parens == 0 or self.tags[self.pos] is not Tag.RPAREN:
+                    break
+                
+                while operators[-1][1] is not Tag.LPAREN:
+                    self._reduce(operands, operators.pop())
+                
+                operators.pop()
+                self._match(Tag.RPAREN)
+                parens -= 1
+            
+            tag = self.tags[self.pos]
+            prec = PRECEDENCE.get(tag)
+            
+            if prec is None:
+                break
+            
+            while operators and operators[-1][0] is not None and operators[-1][0] >= prec:
+                self._reduce(operands, operators.pop())
+            
+            operators.append((prec, tag, self.lexemes[self.pos]))
+            self._match(tag)
         
-        while self.look.tag is Tag.ADD_OP:
-            op = self.look.lexeme
-            self._match(Tag.ADD_OP)
-            simpl_expr = AddictiveOp(simpl_expr, self._term(), op)
+        while operators:
+            entry = operators.pop()
+            
+            if entry[1] is Tag.LPAREN:
+                self._match(Tag.RPAREN) # raises, the parenthesis was never closed
+            
+            self._reduce(operands, entry)
         
-        return simpl_expr
+        return operands.pop()
     
-    def _term(self):
-        """<term> ::= <factor> [ <multiplicative_op> <factor> ]"""
-        term = self._factor()
+    def _reduce(self, operands, entry):
+        """Replaces the top two operands with the binary operator applied to them"""
+        tag, op = entry[1], entry[2]
+        right = operands.pop()
+        left = operands.pop()
         
-        while self.look.tag is Tag.MUL_OP:
-            op = self.look.lexeme
-            self._match(Tag.MUL_OP)
-            term = MultiplicativeOp(term, self._factor(), op)
+        if tag is Tag.EQ_OP:
+            node = EqualityOp(left, right, op)
+        elif tag is Tag.REL_OP:
+            node = RelationalOp(left, right, op)
+        elif left.__class__ is CHAINS[tag]: # (a + b) + c is the same chain as a + b + c
+            left.extend(op, right)
+            node = left
+        elif tag is Tag.OR:
+            node = OrOperator(left, right)
+        elif tag is Tag.AND:
+            node = AndOperator(left, right)
+        else:
+            node = CHAINS[tag](left, right, op)
         
-        return term
+        operands.append(fold(node))
     
     def _factor(self):
         """
@@ -330,50 +472,48 @@ class Parser(object):
                      [ <unary_op> ] <paren_expression> |
                      [ <unary_op> ] <identifier> |
                      <string_literal>
+        
+        Unary operators and parenthesized expressions are handled by _expr.
         """
-        if self.look.tag is Tag.INT_CONST:
-            node = Constant(Type.INT, self.look.lexeme)
+        if self.tags[self.pos] is Tag.INT_CONST:
+            node = Constant(Type.INT, int(self.lexemes[self.pos]), self.lexemes[self.pos])
             self._match(Tag.INT_CONST)
             return node
-        elif self.look.tag is Tag.RL_CONST:
-            node = Constant(Type.FLOAT, self.look.lexeme)
+        elif self.tags[self.pos] is Tag.RL_CONST:
+            node = Constant(Type.FLOAT, float(self.lexemes[self.pos]), self.lexemes[self.pos])
             self._match(Tag.RL_CONST)
             return node
-        elif self.look.tag in [Tag.TRUE, Tag.FALSE]:
-            node = Constant(Type.BOOL, self.look.lexeme)
-            self._match(self.look.tag)
+        elif self.tags[self.pos] in [Tag.TRUE, Tag.FALSE]:
+            node = Constant(Type.BOOL, self.lexemes[self.pos] == "true", self.lexemes[self.pos])
+            self._match(self.tags[self.pos])
             return node
-        elif self.look.tag is Tag.LPAREN:
-            return self._paren_expr()
-        elif self.look.tag is Tag.IDENT:
+        elif self.tags[self.pos] is Tag.IDENT:
             ident = self._check_ident()
             return ident
-        elif self.look.tag is Tag.UNARY_OP:
-            op = self.look.lexeme
-            self._match(Tag.UNARY_OP)
-            return UnaryOp(op, self._factor())
-        elif self.look.tag is Tag.STR_LITERAL:
-            node = Constant(Type.STRING, self.look.lexeme)
+        elif self.tags[self.pos] is Tag.STR_LITERAL:
+            node = Constant(Type.STRING, self.lexemes[self.pos], self.lexemes[self.pos])
             self._match(Tag.STR_LITERAL)
             return node
         else:
-            raise_error(SyntaxError("Unexpected token in expression! ({})".format(self.look.tag), self.look.lineno))
+            raise_error(SyntaxError("Unexpected token in expression! ({})".format(self.tags[self.pos]), self.lineno()))
     
     def _check_ident(self):
-        symb = self.look.lexeme
+        symb = self.lexemes[self.pos]
         
         self._match(Tag.IDENT)
         ident = self.symtab[symb]
         
         if ident is None:
-            raise_error(UndeclaredIdentError(symb, self.look.lineno))
+            raise_error(UndeclaredIdentError(symb, self.lineno()))
         
         return ident
     
     def _match(self, tag):
-        if self.look.tag is not tag:
-            raise_error(SyntaxError("Expected {} but got {}!".format(tag, self.look.tag), self.look.lineno))
+        if self.tags[self.pos] is not tag:
+            raise_error(SyntaxError("Expected {} but got {}!".format(tag, self.tags[self.pos]), self.lineno()))
         self._move()
     
     def _move(self):
-        self.look = self.lexer.next_token()
+        self.pos += 1
+        if self.pos == self.stop:
+            raise_error(self.toks.error)
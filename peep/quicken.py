@@ -0,0 +1,381 @@
+from peep import AddictiveOp, Assign, Block, Break, Constant, Continue, Declaration, Decrement, DivisionAssign, EqualityOp, For, If, Increment, MultiplicativeOp, RelationalOp, UnaryOp
+from peep import TreeWalker
+from peep import Type
+from peep.optimize import read, written
+
+# what a statement returns to stop the enclosing loop's current iteration
+BREAK = 1
+CONTINUE = 2
+
+# longest +, -, *, / and % chain turned into nested binary nodes, longer ones
+# stay generic so evaluating them doesn't recurse once per operand
+MAX_CHAIN = 4
+
+class IntAdd(AddictiveOp):
+    def accept(self, tree_walker):
+        return tree_walker.visit_int_add(self)
+
+class FloatAdd(AddictiveOp):
+    def accept(self, tree_walker):
+        return tree_walker.visit_float_add(self)
+
+class StringConcat(AddictiveOp):
+    def accept(self, tree_walker):
+        return tree_walker.visit_string_concat(self)
+
+class IntSub(AddictiveOp):
+    def accept(self, tree_walker):
+        return tree_walker.visit_int_sub(self)
+
+class FloatSub(AddictiveOp):
+    def accept(self, tree_walker):
+        return tree_walker.visit_float_sub(self)
+
+class IntMul(MultiplicativeOp):
+    def accept(self, tree_walker):
+        return tree_walker.visit_int_mul(self)
+
+class FloatMul(MultiplicativeOp):
+    def accept(self, tree_walker):
+        return tree_walker.visit_float_mul(self)
+
+class IntFloorDiv(MultiplicativeOp):
+    def accept(self, tree_walker):
+        return tree_walker.visit_int_floor_div(self)
+
+class FloatDiv(MultiplicativeOp):
+    def accept(self, tree_walker):
+        return tree_walker.visit_float_div(self)
+
+class IntMod(MultiplicativeOp):
+    def accept(self, tree_walker):
+        return tree_walker.visit_int_mod(self)
+
+class FloatMod(MultiplicativeOp):
+    def accept(self, tree_walker):
+        return tree_walker.visit_float_mod(self)
+
+class Equal(EqualityOp):
+    """== of ints, bools or strings"""
+    
+    def accept(self, tree_walker):
+        return tree_walker.visit_equal(self)
+
+class NotEqual(EqualityOp):
+    def accept(self, tree_walker):
+        return tree_walker.visit_not_equal(self)
+
+class FloatEq(EqualityOp):
+    def accept(self, tree_walker):
+        return tree_walker.visit_float_eq(self)
+
+class FloatNe(EqualityOp):
+    def accept(self, tree_walker):
+        return tree_walker.visit_float_ne(self)
+
+class Less(RelationalOp):
+    def accept(self, tree_walker):
+        return tree_walker.visit_less(self)
+
+class Greater(RelationalOp):
+    def accept(self, tree_walker):
+        return tree_walker.visit_greater(self)
+
+class LessEqual(RelationalOp):
+    def accept(self, tree_walker):
+        return tree_walker.visit_less_equal(self)
+
+class GreaterEqual(RelationalOp):
+    def accept(self, tree_walker):
+        return tree_walker.visit_greater_equal(self)
+
+class Negate(UnaryOp):
+    def accept(self, tree_walker):
+        return tree_walker.visit_negate(self)
+
+class Not(UnaryOp):
+    def accept(self, tree_walker):
+        return tree_walker.visit_not(self)
+
+class IntDivAssign(DivisionAssign):
+    def accept(self, tree_walker):
+        return tree_walker.visit_int_div_assign(self)
+
+class FloatDivAssign(DivisionAssign):
+    def accept(self, tree_walker):
+        return tree_walker.visit_float_div_assign(self)
+
+class ExitBlock(Block):
+    """A block that can break out of or continue the loop around it"""
+    
+    def accept(self, tree_walker):
+        return tree_walker.visit_exit_blk(self)
+
+class IfChain(If):
+    """
+    An if statement with its else if branches flattened into elifs, a list
+    of (test, block), and its else block (or None) in orelse
+    """
+    
+    def accept(self, tree_walker):
+        return tree_walker.visit_if_chain(self)
+
+class CountedFor(For):
+    """
+    for (int i = start; i < bound; i += step) with an int i the block never
+    writes and a bound it doesn't change, run over a range of values. counter
+    is i, bound the right operand of the test and stop(start, bound) the end
+    of the range.
+    """
+    
+    def accept(self, tree_walker):
+        return tree_walker.visit_counted_for(self)
+
+# (operator, operand type) -> quickened node class
+QUICK = {
+    ('+', Type.INT): IntAdd,
+    ('+', Type.FLOAT): FloatAdd,
+    ('+', Type.STRING): StringConcat,
+    ('-', Type.INT): IntSub,
+    ('-', Type.FLOAT): FloatSub,
+    ('*', Type.INT): IntMul,
+    ('*', Type.FLOAT): FloatMul,
+    ('/', Type.INT): IntFloorDiv,
+    ('/', Type.FLOAT): FloatDiv,
+    ('%', Type.INT): IntMod,
+    ('%', Type.FLOAT): FloatMod,
+    ('==', Type.FLOAT): FloatEq,
+    ('!=', Type.FLOAT): FloatNe,
+    ('<', Type.INT): Less,
+    ('<', Type.FLOAT): Less,
+    ('<', Type.STRING): Less,
+    ('>', Type.INT): Greater,
+    ('>', Type.FLOAT): Greater,
+    ('>', Type.STRING): Greater,
+    ('<=', Type.INT): LessEqual,
+    ('<=', Type.FLOAT): LessEqual,
+    ('<=', Type.STRING): LessEqual,
+    ('>=', Type.INT): GreaterEqual,
+    ('>=', Type.FLOAT): GreaterEqual,
+    ('>=', Type.STRING): GreaterEqual
+}
+
+for exact in (Type.INT, Type.BOOL, Type.STRING):
+    QUICK[('==', exact)] = Equal
+    QUICK[('!=', exact)] = NotEqual
+
+# test operator -> (sign of the step, end of the range of the values the test accepts)
+COUNTED = {
+    '<': (1, lambda start, bound: bound),
+    '<=': (1, lambda start, bound: bound + 1),
+    '>': (-1, lambda start, bound: bound),
+    '>=': (-1, lambda start, bound: bound - 1)
+}
+
+def signals(stmt):
+    """Tells whether stmt can break out of or continue the loop around it"""
+    if isinstance(stmt, (Break, Continue)):
+        return True
+    if isinstance(stmt, Block):
+        return any(signals(s) for s in stmt.stmts)
+    if isinstance(stmt, If):
+        return signals(stmt.block) or any(signals(br) for br in stmt.brs if br is not None)
+    return False # loops handle their own break and continue
+
+def counted(for_):
+    """Returns the fields of the CountedFor running for_, or None if it doesn't count"""
+    init, test, stmt = for_.init, for_.test, for_.stmt
+    
+    if not isinstance(init, Assign) or not isinstance(test, RelationalOp) or not isinstance(stmt, (Increment, Decrement)):
+        return None
+    
+    counter = init.ident.ident if isinstance(init.ident, Declaration) else init.ident
+    if counter.type != Type.INT or test.left is not counter or stmt.ident is not counter or not isinstance(stmt.expr, Constant):
+        return None
+    
+    step = stmt.expr.value if isinstance(stmt, Increment) else -stmt.expr.value
+    sign, stop = COUNTED[test.op]
+    if step * sign <= 0:
+        return None # counts away from the bound or not at all
+    
+    body = written(for_.block)
+    if counter in body or read(test.right) & (body | {counter}):
+        return None
+    
+    return dict(counter=counter, bound=test.right, step=step, stop=stop)
+
+def specialize(cls, node, **fields):
+    """Returns a cls node with the attributes of node, replaced by fields"""
+    quick = cls.__new__(cls) # skips the type checks (and the lineno lookup) of the constructors
+    quick.__dict__.update(node.__dict__)
+    quick.__dict__.update(fields)
+    return quick
+
+class Quickener(TreeWalker):
+    """
+    Rewrites a checked AST in place, replacing generic operator nodes with
+    nodes specialized for their operator and operand type (ie. an int a + b
+    becomes IntAdd), so the interpreter doesn't branch on either at run time,
+    and counting for loops with CountedFor. Blocks which can break or
+    continue a loop become ExitBlock, so the others run without checking.
+    Quickened nodes are subclasses of the nodes they replace, tree walkers
+    without a visitor for them fall back to the generic one.
+    Nodes shared by several parents (see CSE) are quickened once and stay shared.
+    """
+    
+    def __init__(self):
+        self.quick = {} # id of an expression -> (expression, its quickened node)
+    
+    def quicken(self, tree):
+        if tree is not None:
+            tree.accept(self)
+            tree.quickened = True
+        return tree
+    
+    def _stmt(self, stmt):
+        return None if stmt is None else stmt.accept(self)
+    
+    def _expr(self, expr):
+        if id(expr) not in self.quick:
+            self.quick[id(expr)] = (expr, expr.accept(self)) # keeps expr alive so its id isn't reused
+        return self.quick[id(expr)][1]
+    
+    def visit_ident(self, ident):
+        return ident
+    
+    def visit_const(self, const):
+        return const
+    
+    def visit_orop(self, orop):
+        orop.operands = list(map(self._expr, orop.operands))
+        return orop
+    
+    def visit_andop(self, andop):
+        andop.operands = list(map(self._expr, andop.operands))
+        return andop
+    
+    def _binary(self, binop):
+        left = self._expr(binop.left)
+        right = self._expr(binop.right)
+        return specialize(QUICK[(binop.op, left.type)], binop, left=left, right=right)
+    
+    def visit_eqop(self, eqop):
+        return self._binary(eqop)
+    
+    def visit_relop(self, relop):
+        return self._binary(relop)
+    
+    def _chain(self, chain):
+        operands = list(map(self._expr, chain.operands)) # no comprehension frame per level of nesting
+        
+        if len(operands) > MAX_CHAIN:
+            chain.operands = operands
+            return chain
+        
+        # a / b * c becomes (a / b) * c, evaluating divisors before dividends in
+        # the nested nodes gives the chain's divisors first order
+        node = operands[0]
+        for op, operand in zip(chain.ops, operands[1:]):
+            node = specialize(QUICK[(op, chain.type)], chain, left=node, right=operand, operands=[node, operand], ops=[op])
+        return node
+    
+    def visit_addop(self, addop):
+        return self._chain(addop)
+    
+    def visit_mulop(self, mulop):
+        return self._chain(mulop)
+    
+    def visit_uop(self, uop):
+        operand = self._expr(uop.operand)
+        
+        if uop.op == "-":
+            return specialize(Negate, uop, operand=operand)
+        elif uop.op == "!":
+            return specialize(Not, uop, operand=operand)
+        return operand # unary + does nothing
+    
+    def visit_decl(self, decl):
+        return decl
+    
+    def visit_assign(self, assign):
+        assign.expr = self._expr(assign.expr)
+        return assign
+    
+    def _update(self, node):
+        node.expr = self._expr(node.expr)
+        return node
+    
+    def visit_inc(self, inc):
+        return self._update(inc)
+    
+    def visit_dec(self, dec):
+        return self._update(dec)
+    
+    def visit_mul_assign(self, mul_assign):
+        return self._update(mul_assign)
+    
+    def visit_div_assign(self, div_assign):
+        cls = IntDivAssign if div_assign.ident.type == Type.INT else FloatDivAssign
+        return specialize(cls, div_assign, expr=self._expr(div_assign.expr))
+    
+    def visit_mod_assign(self, mod_assign):
+        return self._update(mod_assign)
+    
+    def visit_if(self, if_):
+        if_.test = self._expr(if_.test)
+        if_.block = self._stmt(if_.block)
+        if_.brs = [self._stmt(br) for br in if_.brs]
+        
+        elifs = [(br.test, br.block) for br in if_.brs if isinstance(br, If)]
+        orelse = if_.brs[-1] if if_.brs and not isinstance(if_.brs[-1], If) else None
+        return specialize(IfChain, if_, elifs=elifs, orelse=orelse)
+    
+    def visit_while(self, while_):
+        while_.test = self._expr(while_.test)
+        while_.block = self._stmt(while_.block)
+        return while_
+    
+    def _loop(self, for_):
+        for_.init = for_.init.accept(self)
+        for_.test = self._expr(for_.test)
+        for_.stmt = for_.stmt.accept(self)
+        for_.block = self._stmt(for_.block)
+        return for_
+    
+    def visit_for(self, for_):
+        fields = counted(for_)
+        for_ = self._loop(for_)
+        
+        if fields is not None:
+            fields["bound"] = self._expr(fields["bound"])
+            return specialize(CountedFor, for_, **fields)
+        return for_
+    
+    def visit_vector_for(self, for_):
+        for_.bound = self._expr(for_.bound)
+        return self._loop(for_)
+    
+    def visit_break(self, break_):
+        return break_
+    
+    def visit_cont(self, cont):
+        return cont
+    
+    def visit_expr(self, expr):
+        expr.expr = self._expr(expr.expr)
+        return expr
+    
+    def visit_print(self, print_):
+        print_.arg = self._expr(print_.arg)
+        return print_
+    
+    def visit_scan(self, scan):
+        return scan
+    
+    def visit_blk(self, blk):
+        blk.stmts = [stmt.accept(self) for stmt in blk.stmts]
+        return specialize(ExitBlock, blk) if signals(blk) else blk
+    
+    def visit_prgm(self, prgm):
+        prgm.block = self._stmt(prgm.block)
+        return prgm
@@ -0,0 +1,84 @@
+import gzip
+import lzma
+import mmap
+import os
+import sys
+
+# files at least this big are memory-mapped instead of read into a buffer first
+MMAP_THRESHOLD = 4 * 1024 * 1024
+
+DECOMPRESSORS = {
+    ".gz": gzip.open,
+    ".xz": lzma.open,
+    ".lzma": lzma.open
+}
+
+class Source:
+    """
+    Text of a Peep program together with the name it is reported under (the
+    file name without its .peep extension for programs loaded from disk).
+    """
+    
+    def __init__(self, text, name):
+        self.text = text
+        self.name = name
+    
+    @staticmethod
+    def from_string(text, name="string"):
+        return Source(text, name)
+    
+    @staticmethod
+    def from_bytes(data, name="bytes", encoding="utf-8"):
+        # str() decodes straight out of any buffer (bytes, bytearray, memoryview, mmap)
+        return Source(str(data, encoding), name)
+    
+    @staticmethod
+    def from_stdin(name="stdin", encoding="utf-8"):
+        return Source.from_bytes(sys.stdin.buffer.read(), name, encoding)
+    
+    @staticmethod
+    def from_file(path, use_mmap=None, encoding="utf-8"):
+        """
+        Loads a program from disk. Files ending with .gz, .xz or .lzma are
+        decompressed on the fly. Uncompressed files are memory-mapped when
+        use_mmap is true, or when it's None and the file is large.
+        """
+        root, ext = os.path.splitext(path)
+        decompress = DECOMPRESSORS.get(ext)
+        
+        if decompress is not None:
+            with decompress(path, "rb") as fh:
+                return Source.from_bytes(fh.read(), _strip_ext(root), encoding)
+        
+        name = _strip_ext(path)
+        
+        if use_mmap is None:
+            use_mmap = os.path.getsize(path) >= MMAP_THRESHOLD
+        
+        if not use_mmap:
+            with open(path, encoding=encoding) as fh:
+                return Source(fh.read(), name)
+        
+        with open(path, "rb") as fh:
+            if os.fstat(fh.fileno()).st_size == 0: # empty files cannot be mapped
+                return Source("", name)
+            
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return Source.from_bytes(mm, name, encoding)
+
+def _strip_ext(path):
+    root, ext = os.path.splitext(path)
+    return root if ext == ".peep" else path
+
+def load(src):
+    """
+    Turns whatever Lexer was given (a Source, a path or a bytes-like buffer)
+    into a Source, raises FileNotFoundError for a path that doesn't exist
+    """
+    if isinstance(src, Source):
+        return src
+    
+    if isinstance(src, (bytes, bytearray, memoryview, mmap.mmap)):
+        return Source.from_bytes(src)
+    
+    return Source.from_file(src)
@@ -1,4 +1,8 @@
 import enum
+import re
+
+from array import array
+from bisect import bisect_left
 
 class TokenTag(enum.Enum):
     # Builtin types
@@ -57,3 +61,45 @@ class Token:
     
     def __str__(self):
         return "Token(tag={}, lexeme=\"{}\", lineno={})".format(self.tag, self.lexeme, self.lineno)
+
+class TokenBuffer:
+    """
+    A pre-lexed token stream. Instead of one Token object per token, the tags,
+    start/end offsets and (interned) lexemes are kept in parallel arrays that
+    are indexed by token number. Line numbers are not tracked while lexing,
+    they are looked up on demand in an index of newline offsets.
+    """
+    
+    def __init__(self, text):
+        self.text = text
+        self.tags = []
+        self.lexemes = []
+        self.starts = array('l')
+        self.ends = array('l')
+        self.error = None # error which stopped the lexer right after the last token
+        self.newlines = None
+    
+    def append(self, tag, lexeme, start, end):
+        self.tags.append(tag)
+        self.lexemes.append(lexeme)
+        self.starts.append(start)
+        self.ends.append(end)
+    
+    def __len__(self):
+        return len(self.tags)
+    
+    def __iter__(self):
+        for i in range(len(self.tags)):
+            yield self.token(i)
+    
+    def token(self, i):
+        return Token(self.tags[i], self.lexemes[i], self.lineno(i))
+    
+    def lineno(self, i):
+        """Line of the end of the i-th token"""
+        return self.lineno_at(self.ends[i])
+    
+    def lineno_at(self, offset):
+        if self.newlines is None:
+            self.newlines = array('l', (m.start() for m in re.finditer('\n', self.text)))
+        return bisect_left(self.newlines, offset) + 1
@@ -0,0 +1,380 @@
+import marshal
+import math
+import sys
+
+from peep import Constant, Declaration, DivisionByZeroError, For, If
+from peep import Default
+from peep import StdoutSink, StreamInput
+from peep import TreeWalker
+from peep import Type
+from peep.compiler import DIVISIONS, is_zero, reads
+from peep.intrp import CallStack, main_record, raise_at, scan_input
+from peep.optimize import read, written
+from peep.vm import VM
+
+# divisions are checked inline with assignment expressions, which need Python 3.8
+WALRUS = sys.version_info >= (3, 8)
+
+# before that, by a helper checking the divisor and one dividing by it (see runtime)
+DIVIDE_BY = {
+    ('/', Type.INT): ("_floordiv_by", "_int_divisor"),
+    ('/', Type.FLOAT): ("_div_by", "_float_divisor"),
+    ('%', Type.INT): ("_mod_by", "_int_divisor"),
+    ('%', Type.FLOAT): ("_mod_by", "_float_divisor")
+}
+
+# the helper checking the divisor of "/=" and "%="
+DIVISOR = {
+    Type.INT: "_int_divisor",
+    Type.FLOAT: "_float_divisor"
+}
+
+SCANS = {
+    Type.INT: "_scan_int",
+    Type.FLOAT: "_scan_float",
+    Type.BOOL: "_scan_bool",
+    Type.STRING: "_scan_string"
+}
+
+# divisions taking their operands the other way around, so the divisor can be passed (and checked) first
+def _floordiv_by(divisor, dividend):
+    return dividend // divisor
+
+def _div_by(divisor, dividend):
+    return dividend / divisor
+
+def _mod_by(divisor, dividend):
+    return dividend % divisor
+
+def runtime(stk, output, input):
+    """
+    Returns the globals translated code runs with, printing to output,
+    scanning from input and reporting runtime errors with stk
+    """
+    def _zero(lineno):
+        raise_at(DivisionByZeroError(lineno), lineno, stk, output)
+    
+    def _int_divisor(value, lineno):
+        if not value:
+            _zero(lineno)
+        return value
+    
+    def _float_divisor(value, lineno):
+        if math.fabs(value) < sys.float_info.epsilon:
+            _zero(lineno)
+        return value
+    
+    def scanner(type):
+        def scan(lineno):
+            return scan_input(type, lineno, stk, output, input)
+        
+        return scan
+    
+    return {
+        "_fabs": math.fabs,
+        "_EPS": sys.float_info.epsilon,
+        "_zero": _zero,
+        "_int_divisor": _int_divisor,
+        "_float_divisor": _float_divisor,
+        "_floordiv_by": _floordiv_by,
+        "_div_by": _div_by,
+        "_mod_by": _mod_by,
+        "_print": output.write,
+        "_scan_int": scanner(Type.INT),
+        "_scan_float": scanner(Type.FLOAT),
+        "_scan_bool": scanner(Type.BOOL),
+        "_scan_string": scanner(Type.STRING)
+    }
+
+class PyCode:
+    """
+    A program translated to Python: the generated source and its compiled
+    code object. Pickles the code object with marshal so it can be cached.
+    """
+    
+    def __init__(self, source, code):
+        self.source = source
+        self.code = code
+    
+    def __getstate__(self):
+        return {"source": self.source, "code": marshal.dumps(self.code)}
+    
+    def __setstate__(self, state):
+        self.source = state["source"]
+        self.code = marshal.loads(state["code"])
+
+class Transpiler(TreeWalker):
+    """
+    Translates a checked AST into the source of a Python function. Variables
+    become locals named after their slot, so shadowing needs no special care.
+    """
+    
+    def __init__(self):
+        self.lines = []
+        self.indent = 1
+        self.steps = [] # step statement of each enclosing loop (None for while loops)
+        self.ntemps = 0
+    
+    def transpile(self, tree):
+        self.lines.append("def __peep_main():")
+        tree.accept(self)
+        self._line("return")
+        return "\n".join(self.lines) + "\n"
+    
+    def transpile_loop(self, loop):
+        """
+        Returns the source of a function running loop from its test on (a for
+        loop's init has run), taking the slots of the activation record. The
+        variables the loop uses are loaded into locals and stored back when
+        it exits.
+        """
+        slots = sorted({ident.slot for ident in read(loop) | written(loop)})
+        
+        self.lines.append("def __peep_loop(_slots):")
+        for slot in slots:
+            self._line("v{0} = _slots[{0}]".format(slot))
+        
+        self._line("try:")
+        self.indent += 1
+        if isinstance(loop, For):
+            self._loop(loop)
+        else:
+            loop.accept(self)
+        self.indent -= 1
+        
+        self._line("finally:")
+        self.indent += 1
+        for slot in slots:
+            self._line("_slots[{0}] = v{0}".format(slot))
+        if not slots:
+            self._line("pass")
+        self.indent -= 1
+        
+        return "\n".join(self.lines) + "\n"
+    
+    def _line(self, text):
+        self.lines.append("    " * self.indent + text)
+    
+    def _body(self, stmt):
+        """Writes stmt as an indented block"""
+        self.indent += 1
+        start = len(self.lines)
+        if stmt is not None:
+            stmt.accept(self)
+        if len(self.lines) == start:
+            self._line("pass")
+        self.indent -= 1
+    
+    def _temp(self):
+        self.ntemps += 1
+        return "_t{}".format(self.ntemps)
+    
+    def visit_ident(self, ident):
+        return "v{}".format(ident.slot)
+    
+    def visit_const(self, const):
+        value = const.value
+        
+        if isinstance(value, float) and not math.isfinite(value):
+            return "float('{}')".format(value)
+        return repr(value)
+    
+    def visit_orop(self, orop):
+        return "(" + " or ".join(operand.accept(self) for operand in orop.operands) + ")"
+    
+    def visit_andop(self, andop):
+        return "(" + " and ".join(operand.accept(self) for operand in andop.operands) + ")"
+    
+    def visit_eqop(self, eqop):
+        left = eqop.left.accept(self)
+        right = eqop.right.accept(self)
+        
+        if eqop.left.type == Type.FLOAT: # built-in float comparison
+            return "(_fabs({} - {}) {} _EPS)".format(left, right, "<" if eqop.op == "==" else ">")
+        return "({} {} {})".format(left, eqop.op, right)
+    
+    def visit_relop(self, relop):
+        return "({} {} {})".format(relop.left.accept(self), relop.op, relop.right.accept(self))
+    
+    def visit_addop(self, addop):
+        code = addop.operands[0].accept(self)
+        
+        for op, operand in zip(addop.ops, addop.operands[1:]):
+            code += " {} {}".format(op, operand.accept(self))
+        
+        return "(" + code + ")"
+    
+    def visit_mulop(self, mulop):
+        code = mulop.operands[0].accept(self)
+        
+        for op, operand in zip(mulop.ops, mulop.operands[1:]):
+            right = operand.accept(self)
+            
+            if op not in DIVISIONS:
+                code = "({} {} {})".format(code, op, right)
+            elif not WALRUS: # the helpers take the divisor first, for the same order
+                divide_by, check = DIVIDE_BY[op, mulop.type]
+                code = "{}({}({}, {}), {})".format(divide_by, check, right, operand.lineno, code)
+            elif mulop.type == Type.INT:
+                # the divisor is evaluated and checked before the dividend like in
+                # the tree walker, nesting these gives its right to left order too
+                t = self._temp()
+                code = "({} {} {} if ({} := {}) else _zero({}))".format(code, "//" if op == '/' else op, t, t, right, operand.lineno)
+            else:
+                t = self._temp()
+                code = "(_zero({}) if _fabs({} := {}) < _EPS else {} {} {})".format(operand.lineno, t, right, code, op, t)
+        
+        return code
+    
+    def visit_uop(self, uop):
+        operand = uop.operand.accept(self)
+        
+        if uop.op == "-":
+            return "(-{})".format(operand)
+        elif uop.op == "!":
+            return "(not {})".format(operand)
+        return operand
+    
+    def visit_decl(self, decl):
+        self._line("{} = {!r}".format(decl.ident.accept(self), Default.default_value(decl.ident.type)))
+        return decl.ident
+    
+    def visit_assign(self, assign):
+        ident = assign.ident
+        if isinstance(ident, Declaration):
+            if reads(assign.expr, ident.ident):
+                ident = ident.accept(self) # int x = x + 1; sees the default value
+            else:
+                ident = ident.ident
+        self._line("{} = {}".format(ident.accept(self), assign.expr.accept(self)))
+    
+    def _update(self, node, op, divides=False):
+        expr = node.expr
+        code = expr.accept(self)
+        
+        if divides and not (isinstance(expr, Constant) and not is_zero(expr.value, expr.type)):
+            code = "{}({}, {})".format(DIVISOR[expr.type], code, expr.lineno)
+        
+        self._line("{} {} {}".format(node.ident.accept(self), op, code))
+    
+    def visit_inc(self, inc):
+        self._update(inc, "+=")
+    
+    def visit_dec(self, dec):
+        self._update(dec, "-=")
+    
+    def visit_mul_assign(self, mul_assign):
+        self._update(mul_assign, "*=")
+    
+    def visit_div_assign(self, div_assign):
+        self._update(div_assign, "//=" if div_assign.ident.type == Type.INT else "/=", True)
+    
+    def visit_mod_assign(self, mod_assign):
+        self._update(mod_assign, "%=", True)
+    
+    def visit_if(self, if_):
+        keyword = "if"
+        
+        for br in [if_] + if_.brs:
+            if isinstance(br, If):
+                self._line("{} {}:".format(keyword, br.test.accept(self)))
+                self._body(br.block)
+                keyword = "elif"
+            elif br is not None: # else branch
+                self._line("else:")
+                self._body(br)
+    
+    def visit_while(self, while_):
+        self.steps.append(None)
+        self._line("while {}:".format(while_.test.accept(self)))
+        self._body(while_.block)
+        self.steps.pop()
+    
+    def visit_for(self, for_):
+        for_.init.accept(self)
+        self._loop(for_)
+    
+    def _loop(self, for_):
+        """Writes a for loop without its init"""
+        self.steps.append(for_.stmt)
+        self._line("while {}:".format(for_.test.accept(self)))
+        self.indent += 1
+        for_.block.accept(self)
+        for_.stmt.accept(self)
+        self.indent -= 1
+        self.steps.pop()
+    
+    def visit_break(self, break_):
+        self._line("break")
+    
+    def visit_cont(self, cont):
+        if self.steps[-1] is not None: # a for loop still runs its step statement
+            self.steps[-1].accept(self)
+        self._line("continue")
+    
+    def visit_expr(self, expr):
+        self._line(expr.expr.accept(self))
+    
+    def visit_print(self, print_):
+        arg = print_.arg.accept(self)
+        
+        if print_.arg.type == Type.BOOL:
+            self._line("_print(\"true\" if {} else \"false\")".format(arg))
+        else:
+            self._line("_print(str({}))".format(arg))
+    
+    def visit_scan(self, scan):
+        ident = scan.ident
+        self._line("{} = {}({})".format(ident.accept(self), SCANS[ident.type], ident.lineno))
+    
+    def visit_blk(self, blk):
+        for stmt in blk.stmts:
+            stmt.accept(self)
+    
+    def visit_prgm(self, prgm):
+        if prgm.block is not None:
+            prgm.block.accept(self)
+
+class PyEngine:
+    """
+    Runs a program translated to Python. Programs Python can't compile (ie.
+    expressions nested too deeply) are run by the VM instead.
+    """
+    
+    def __init__(self, tree, code=None, output=None, input=None):
+        self.stk = CallStack()
+        self.tree = tree
+        self.code = code if code is not None or tree is None else PyEngine.compile(tree)
+        self.output = StdoutSink() if output is None else output
+        self.input = StreamInput() if input is None else input
+    
+    @staticmethod
+    def compile(tree):
+        """Returns the PyCode for tree or None if it can't be translated"""
+        try:
+            source = Transpiler().transpile(tree)
+            return PyCode(source, compile(source, "<peep>", "exec"))
+        except (RecursionError, SyntaxError, MemoryError):
+            return None
+    
+    def interpret(self):
+        if self.tree is None:
+            return
+        
+        if self.code is None:
+            VM(self.tree, output=self.output, input=self.input).interpret()
+            return
+        
+        self.stk.push(main_record(self.tree))
+        
+        namespace = runtime(self.stk, self.output, self.input)
+        exec(self.code.code, namespace)
+        
+        try:
+            namespace["__peep_main"]()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.output.flush()
+        
+        self.stk.pop()
@@ -106,4 +106,88 @@ class TreeWalker(ABC):
     
     @abstractmethod
     def visit_prgm(self, prgm):
-        pass
\ No newline at end of file
+        pass
+    
+    # quickened nodes (see peep/quicken.py) are visited like the nodes they
+    # specialize unless a tree walker overrides these
+    
+    def visit_int_add(self, addop):
+        return self.visit_addop(addop)
+    
+    def visit_float_add(self, addop):
+        return self.visit_addop(addop)
+    
+    def visit_string_concat(self, addop):
+        return self.visit_addop(addop)
+    
+    def visit_int_sub(self, addop):
+        return self.visit_addop(addop)
+    
+    def visit_float_sub(self, addop):
+        return self.visit_addop(addop)
+    
+    def visit_int_mul(self, mulop):
+        return self.visit_mulop(mulop)
+    
+    def visit_float_mul(self, mulop):
+        return self.visit_mulop(mulop)
+    
+    def visit_int_floor_div(self, mulop):
+        return self.visit_mulop(mulop)
+    
+    def visit_float_div(self, mulop):
+        return self.visit_mulop(mulop)
+    
+    def visit_int_mod(self, mulop):
+        return self.visit_mulop(mulop)
+    
+    def visit_float_mod(self, mulop):
+        return self.visit_mulop(mulop)
+    
+    def visit_equal(self, eqop):
+        return self.visit_eqop(eqop)
+    
+    def visit_not_equal(self, eqop):
+        return self.visit_eqop(eqop)
+    
+    def visit_float_eq(self, eqop):
+        return self.visit_eqop(eqop)
+    
+    def visit_float_ne(self, eqop):
+        return self.visit_eqop(eqop)
+    
+    def visit_less(self, relop):
+        return self.visit_relop(relop)
+    
+    def visit_greater(self, relop):
+        return self.visit_relop(relop)
+    
+    def visit_less_equal(self, relop):
+        return self.visit_relop(relop)
+    
+    def visit_greater_equal(self, relop):
+        return self.visit_relop(relop)
+    
+    def visit_negate(self, uop):
+        return self.visit_uop(uop)
+    
+    def visit_not(self, uop):
+        return self.visit_uop(uop)
+    
+    def visit_int_div_assign(self, div_assign):
+        return self.visit_div_assign(div_assign)
+    
+    def visit_float_div_assign(self, div_assign):
+        return self.visit_div_assign(div_assign)
+    
+    def visit_counted_for(self, for_):
+        return self.visit_for(for_)
+    
+    def visit_vector_for(self, for_):
+        return self.visit_counted_for(for_)
+    
+    def visit_exit_blk(self, blk):
+        return self.visit_blk(blk)
+    
+    def visit_if_chain(self, if_):
+        return self.visit_if(if_)
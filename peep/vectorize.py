@@ -0,0 +1,260 @@
+import sys
+
+from peep import AddictiveOp, Assign, Block, Constant, Declaration, Decrement, For, Identifier, Increment, MultiplicativeOp, UnaryOp
+from peep import Type
+from peep.optimize import read, walk
+from peep.quicken import CountedFor, counted, specialize
+
+numpy = None # imported by Vectorizer, loading it takes longer than running most programs
+
+EPSILON = sys.float_info.epsilon
+INT64_MAX = 2 ** 63 - 1
+CHUNK = 1 << 16 # iterations evaluated at once, bounds the size of the arrays
+
+class VectorFor(CountedFor):
+    """CountedFor whose block kernel can run for many iterations at once"""
+    
+    def accept(self, tree_walker):
+        return tree_walker.visit_vector_for(self)
+
+class Fallback(Exception):
+    """The iterations of a chunk have to run one by one (ie. one of them divides by zero)"""
+
+def available():
+    """Imports NumPy, tells whether it is installed"""
+    global numpy
+    
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError: # loops run one iteration at a time without it
+            return False
+    return True
+
+def last(value):
+    """The value of the last iteration as a Python int or float"""
+    if numpy.ndim(value):
+        value = value[-1]
+    return value.item() if isinstance(value, numpy.generic) else value
+
+class Kernel:
+    """
+    The block of a counted loop made of int and float arithmetic only:
+    declarations of variables local to the block, and += (a reduction), -=
+    or = of variables the block reads nowhere, each written once. Every
+    expression is evaluated for a chunk of iterations at once as NumPy
+    arrays.
+    """
+    
+    def __init__(self, counter, stmts, invariants):
+        self.counter = counter
+        self.stmts = stmts # (variable written, expression, 1 for +=, -1 for -= or None for =)
+        self.invariants = invariants # variables read but not written by the block
+    
+    def run(self, slots, values):
+        """Runs the block for values of the counter, returns how many of them it did"""
+        if not values:
+            return 0
+        
+        try:
+            self._fits(slots, values)
+        except Fallback:
+            return 0
+        
+        done = 0
+        while done < len(values):
+            chunk = values[done:done + CHUNK]
+            
+            try:
+                self._chunk(slots, chunk)
+            except Fallback:
+                break
+            
+            done += len(chunk)
+        
+        return done
+    
+    def _fits(self, slots, values):
+        """Raises Fallback unless every int the block computes fits in int64"""
+        bounds = {ident: abs(slots[ident.slot]) for ident in self.invariants if ident.type == Type.INT}
+        bounds[self.counter] = max(abs(values[0]), abs(values[-1]))
+        
+        if any(bound > INT64_MAX for bound in bounds.values()):
+            raise Fallback()
+        
+        for ident, expr, sign in self.stmts:
+            if ident.type != Type.INT:
+                continue
+            
+            bound = self._bound(expr, bounds)
+            if sign is None:
+                bounds[ident] = bound
+            elif bound * min(CHUNK, len(values)) > INT64_MAX: # a chunk of the reduction is summed in int64
+                raise Fallback()
+    
+    def _bound(self, expr, bounds):
+        """The largest absolute value expr and the values computed for it can have"""
+        if isinstance(expr, Identifier):
+            return bounds[expr]
+        elif isinstance(expr, UnaryOp):
+            return self._bound(expr.operand, bounds)
+        elif isinstance(expr, Constant):
+            bound = abs(expr.value)
+        else:
+            bound = self._bound(expr.operands[0], bounds)
+            
+            for op, operand in zip(expr.ops, expr.operands[1:]):
+                right = self._bound(operand, bounds)
+                if op in ['+', '-']:
+                    bound += right
+                elif op == '*':
+                    bound *= right
+                elif op == '%':
+                    bound = right # |a % b| < |b|, a // b is no larger than a
+                
+                if bound > INT64_MAX:
+                    raise Fallback()
+        
+        if bound > INT64_MAX:
+            raise Fallback()
+        return bound
+    
+    def _chunk(self, slots, chunk):
+        env = {ident: slots[ident.slot] for ident in self.invariants}
+        env[self.counter] = numpy.arange(chunk.start, chunk.stop, chunk.step, dtype=numpy.int64)
+        terms = {} # reduced variable -> values added to it
+        
+        for ident, expr, sign in self.stmts:
+            value = self._eval(expr, env)
+            
+            if sign is None:
+                env[ident] = value
+            else:
+                value = numpy.broadcast_to(value, (len(chunk),))
+                terms[ident] = value if sign > 0 else -value # a - b is a + -b for floats too
+        
+        # nothing is stored before the whole chunk is computed, so it can still run one by one
+        for ident, expr, sign in self.stmts:
+            if ident in terms:
+                if ident.type == Type.INT:
+                    slots[ident.slot] += int(numpy.sum(terms[ident]))
+                else: # adding one by one in the order of the iterations rounds like the loop does
+                    slots[ident.slot] = numpy.add.accumulate(numpy.concatenate(([slots[ident.slot]], terms[ident])))[-1].item()
+            else:
+                slots[ident.slot] = last(env[ident])
+    
+    def _eval(self, expr, env):
+        if isinstance(expr, Identifier):
+            return env[expr]
+        elif isinstance(expr, Constant):
+            return expr.value
+        elif isinstance(expr, UnaryOp):
+            value = self._eval(expr.operand, env)
+            return numpy.negative(value) if expr.op == '-' else value
+        
+        value = self._eval(expr.operands[0], env)
+        
+        for op, operand in zip(expr.ops, expr.operands[1:]):
+            right = self._eval(operand, env)
+            
+            if op == '+':
+                value = numpy.add(value, right)
+            elif op == '-':
+                value = numpy.subtract(value, right)
+            elif op == '*':
+                value = numpy.multiply(value, right)
+            elif op == '/':
+                if expr.type == Type.INT:
+                    if numpy.any(numpy.equal(right, 0)):
+                        raise Fallback() # reported by the iteration dividing by zero
+                    value = numpy.floor_divide(value, right)
+                else:
+                    if numpy.any(numpy.abs(right) < EPSILON):
+                        raise Fallback()
+                    value = numpy.true_divide(value, right)
+            else: # op == '%'
+                zero = numpy.equal(right, 0) if expr.type == Type.INT else numpy.abs(right) < EPSILON
+                if numpy.any(zero):
+                    raise Fallback()
+                value = numpy.remainder(value, right)
+        
+        return value
+
+def arithmetic(expr, known):
+    """Tells whether expr is int or float arithmetic on the variables in known"""
+    if isinstance(expr, Identifier):
+        return expr in known
+    elif isinstance(expr, Constant):
+        return expr.type in (Type.INT, Type.FLOAT)
+    elif isinstance(expr, UnaryOp):
+        return expr.op in ['-', '+'] and arithmetic(expr.operand, known)
+    elif isinstance(expr, (AddictiveOp, MultiplicativeOp)):
+        return expr.type in (Type.INT, Type.FLOAT) and all(arithmetic(operand, known) for operand in expr.operands)
+    return False
+
+def kernel(for_):
+    """Returns the Kernel running the block of for_ and the fields of the CountedFor, or None if it doesn't fit"""
+    fields = counted(for_)
+    if fields is None or not isinstance(for_.block, Block):
+        return None
+    
+    stmts = []
+    locals_ = set() # declared in the block
+    outputs = set() # written by the block, read nowhere in it
+    reads = set()
+    
+    for stmt in for_.block.stmts:
+        if isinstance(stmt, Assign) and isinstance(stmt.ident, Declaration):
+            ident, local, sign = stmt.ident.ident, True, None
+        elif isinstance(stmt, (Assign, Increment, Decrement)):
+            ident, local = stmt.ident, False
+            sign = None if isinstance(stmt, Assign) else 1 if isinstance(stmt, Increment) else -1
+        else:
+            return None # print, scan, break, branches, loops, *=, ...
+        
+        if ident.type not in (Type.INT, Type.FLOAT) or ident in locals_ or ident in outputs:
+            return None
+        if ident in read(stmt.expr):
+            return None # int x = x + 1; reads the default value, s += s; isn't a reduction
+        
+        stmts.append((ident, stmt.expr, sign))
+        (locals_ if local else outputs).add(ident)
+        reads |= read(stmt.expr)
+    
+    counter = fields["counter"]
+    invariants = reads - locals_ - outputs - {counter}
+    
+    if reads & outputs or any(var.type not in (Type.INT, Type.FLOAT) for var in invariants):
+        return None
+    if not all(arithmetic(expr, reads - outputs) for ident, expr, sign in stmts):
+        return None
+    
+    return Kernel(counter, stmts, invariants), fields
+
+class Vectorizer:
+    """
+    Optional pass (--vectorize) replacing counted for loops whose block is
+    straight-line int and float arithmetic with VectorFor nodes, which the
+    tree walking interpreter and the closure engine run with NumPy. Without
+    NumPy the tree is left alone.
+    """
+    
+    def __init__(self):
+        self.nloops = 0
+    
+    def vectorize(self, tree):
+        if tree is None or tree.block is None or not available():
+            return tree
+        
+        for blk in [node for node in walk(tree) if isinstance(node, Block)]:
+            blk.stmts = [self._loop(stmt) if isinstance(stmt, For) else stmt for stmt in blk.stmts]
+        
+        return tree
+    
+    def _loop(self, for_):
+        found = kernel(for_)
+        if found is None:
+            return for_
+        
+        self.nloops += 1
+        return specialize(VectorFor, for_, kernel=found[0], **found[1])
@@ -0,0 +1,184 @@
+import math
+import sys
+
+from peep import DivisionByZeroError
+from peep import StdoutSink, StreamInput
+from peep.compiler import *
+from peep.intrp import CallStack, main_record, raise_at, scan_input
+
+SCAN_TYPES = {op: type for type, op in SCANS.items()}
+
+class VM:
+    """
+    Runs a program compiled to bytecode by Compiler. Prints the same output
+    and runtime errors as Interpreter.
+    """
+    
+    def __init__(self, tree, code=None, output=None, input=None):
+        self.stk = CallStack()
+        self.tree = tree
+        self.code = code if code is not None or tree is None else VM.compile(tree)
+        self.output = StdoutSink() if output is None else output
+        self.input = StreamInput() if input is None else input
+    
+    @staticmethod
+    def compile(tree):
+        return Compiler().compile(tree)
+    
+    def interpret(self):
+        if self.code is not None:
+            self.stk.push(main_record(self.tree, self.code.nslots))
+            
+            try:
+                self.run(self.code.instrs, self.stk.top().slots)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                self.output.flush()
+            
+            self.stk.pop()
+    
+    def _raise(self, error, lineno):
+        raise_at(error, lineno, self.stk, self.output)
+    
+    def run(self, instrs, slots):
+        handlers = self._handlers(slots)
+        code = [(handlers[op], arg) for op, arg in instrs] # looked up once instead of on every instruction
+        end = len(code)
+        pc = 0
+        
+        while pc < end:
+            handler, arg = code[pc]
+            pc += 1
+            target = handler(arg)
+            if target is not None: # the instruction jumped
+                pc = target
+    
+    def _handlers(self, slots):
+        """Returns the functions executing each opcode, indexed by opcode"""
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        
+        epsilon = sys.float_info.epsilon
+        
+        def const(k):
+            push(k)
+        
+        def load(s):
+            push(slots[s])
+        
+        def store(s):
+            slots[s] = pop()
+        
+        def pop_(arg):
+            pop()
+        
+        def binary(f):
+            right = pop()
+            stack[-1] = f(stack[-1], right)
+        
+        def binary_const(arg):
+            f, k = arg
+            stack[-1] = f(stack[-1], k)
+        
+        def binary_load(arg):
+            f, s = arg
+            stack[-1] = f(stack[-1], slots[s])
+        
+        def unary(f):
+            stack[-1] = f(stack[-1])
+        
+        def update(arg):
+            f, s = arg
+            slots[s] = f(slots[s], pop())
+        
+        def update_const(arg):
+            f, s, k = arg
+            slots[s] = f(slots[s], k)
+        
+        def check_int(lineno):
+            if stack[-1] == 0:
+                self._raise(DivisionByZeroError(lineno), lineno)
+        
+        def check_float(lineno):
+            if math.fabs(stack[-1] - 0.0) < epsilon: # stack[-1] == 0.0
+                self._raise(DivisionByZeroError(lineno), lineno)
+        
+        write = self.output.write
+        
+        def print_(arg):
+            write(str(pop()))
+        
+        def print_bool(arg):
+            write("true" if pop() else "false")
+        
+        def scan(op):
+            return lambda arg: self._scan(op, arg, slots)
+        
+        def jump(target):
+            return target
+        
+        def jump_if_false(target):
+            if not pop():
+                return target
+        
+        def jump_if_true_or_pop(target):
+            if stack[-1]:
+                return target
+            pop()
+        
+        def jump_if_false_or_pop(target):
+            if not stack[-1]:
+                return target
+            pop()
+        
+        def compare_jump(arg):
+            f, target = arg
+            right = pop()
+            if not f(pop(), right):
+                return target
+        
+        def compare_const_jump(arg):
+            f, k, target = arg
+            if not f(pop(), k):
+                return target
+        
+        def compare_load_jump(arg):
+            f, s, target = arg
+            if not f(pop(), slots[s]):
+                return target
+        
+        handlers = {
+            CONST: const,
+            LOAD: load,
+            STORE: store,
+            POP: pop_,
+            BINARY: binary,
+            BINARY_CONST: binary_const,
+            BINARY_LOAD: binary_load,
+            UNARY: unary,
+            UPDATE: update,
+            UPDATE_CONST: update_const,
+            CHECK_INT: check_int,
+            CHECK_FLOAT: check_float,
+            PRINT: print_,
+            PRINT_BOOL: print_bool,
+            SCAN_INT: scan(SCAN_INT),
+            SCAN_FLOAT: scan(SCAN_FLOAT),
+            SCAN_BOOL: scan(SCAN_BOOL),
+            SCAN_STRING: scan(SCAN_STRING),
+            JUMP: jump,
+            JUMP_IF_FALSE: jump_if_false,
+            JUMP_IF_TRUE_OR_POP: jump_if_true_or_pop,
+            JUMP_IF_FALSE_OR_POP: jump_if_false_or_pop,
+            COMPARE_JUMP: compare_jump,
+            COMPARE_CONST_JUMP: compare_const_jump,
+            COMPARE_LOAD_JUMP: compare_load_jump
+        }
+        
+        return [handlers[op] for op in sorted(handlers)]
+    
+    def _scan(self, op, arg, slots):
+        slot, lineno = arg
+        slots[slot] = scan_input(SCAN_TYPES[op], lineno, self.stk, self.output, self.input)
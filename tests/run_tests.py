@@ -1,30 +1,415 @@
+import io
+import json
 import os
 import sys
+import tempfile
+import traceback
 
-from os.path import abspath, dirname, isfile, join, realpath
+from contextlib import redirect_stderr, redirect_stdout
+from functools import partial
+from os.path import abspath, dirname, isfile, join, realpath, splitext
 from unittest.mock import patch
 
+ENGINES = ["tree", "vm", "py", "closure"]
+
+# a program with a .out file must print exactly that with each engine and each of these
+FLAGS = [
+    [],
+    ["-O"],
+    ["--cse"],
+    ["--vectorize"],
+    ["-O", "--cse", "--vectorize"],
+    ["--hot-loop", "1"] # the tree walking interpreter compiles every loop
+]
+
 def run(file):
-    def exit(x):
-        raise
-    
-    with patch("sys.argv", ["", "-i", file]), patch("sys.exit", exit):
+    with patch("sys.argv", ["", "-i", file]):
         try:
             from peep.__main__ import main
             main()
-        except:
+        except EOFError: # a program scanning more input than it was given
             return
 
+def output(argv):
+    """What peep prints when run with argv, or the traceback of the exception it crashed with"""
+    out = io.StringIO()
+    
+    with patch("sys.argv", ["peep"] + argv), redirect_stdout(out):
+        try:
+            from peep.__main__ import main
+            main()
+        except Exception:
+            out.write(traceback.format_exc())
+    
+    return out.getvalue()
+
+def check(file, cache_dir):
+    """
+    Runs file with every engine and set of flags, once parsing it into the
+    cache and once loading it from there, and compares what it printed with
+    the .out file next to it (scan() reads the .in file). Returns the number
+    of runs which printed something else.
+    """
+    base = splitext(file)[0]
+    input = base + ".in" if isfile(base + ".in") else os.devnull
+    
+    with open(base + ".out", encoding="utf-8") as fh:
+        expected = fh.read()
+    
+    failures = 0
+    
+    for engine in ENGINES:
+        for flags in FLAGS:
+            argv = ["-i", file, "--input", input, "--engine", engine, "--cache-dir", cache_dir] + flags
+            
+            for attempt in ["parsed", "cached"]:
+                actual = output(argv)
+                
+                if actual != expected:
+                    failures += 1
+                    print("FAIL ({}): peep {}\n--- expected\n{}--- got\n{}".format(attempt, " ".join(argv), expected, actual))
+    
+    return failures
+
+def tokens(lexer):
+    """Everything a lexer produced for a program"""
+    buf = lexer.tokenize()
+    error = buf.error if buf.error is None else (buf.error.__class__, str(buf.error), buf.error.lineno)
+    return buf.tags, buf.lexemes, list(buf.starts), list(buf.ends), error
+
+def check_lexers(files):
+    """
+    Lexes files with the classic lexer and with the parallel one cutting
+    them before every line (ie. before a line starting with a binary - or
+    +), and compares their tokens with the regex lexer's. The programs with
+    a .out file are then run with --lexer parallel and --lexer classic.
+    Returns the number of mismatches.
+    """
+    from peep import Lexer, ParallelLexer, RegexLexer, Source
+    
+    failures = 0
+    
+    for file in files:
+        source = Source.from_file(file)
+        expected = tokens(RegexLexer(source))
+        
+        # one worker per character makes a chunk of every line
+        for lexer in [Lexer(source), ParallelLexer(source, workers=len(source.text), threshold=0)]:
+            if tokens(lexer) != expected:
+                failures += 1
+                print("FAIL (lexer): {} lexes {} differently than RegexLexer".format(lexer.__class__.__name__, file))
+        
+        base = splitext(file)[0]
+        if not isfile(base + ".out"):
+            continue
+        
+        with open(base + ".out", encoding="utf-8") as fh:
+            expected = fh.read()
+        
+        input = base + ".in" if isfile(base + ".in") else os.devnull
+        
+        for lexer in ["parallel", "classic"]:
+            argv = ["-i", file, "--input", input, "--no-cache", "--lexer", lexer]
+            
+            # the pool only starts for programs of a MiB or more, and with several CPUs
+            with patch.dict("peep.__main__.LEXERS", {"parallel": partial(ParallelLexer, workers=4, threshold=0)}):
+                actual = output(argv)
+            
+            if actual != expected:
+                failures += 1
+                print("FAIL (lexer): peep {}\n--- expected\n{}--- got\n{}".format(" ".join(argv), expected, actual))
+    
+    return failures
+
+def check_loaders(file):
+    """
+    Runs file loaded each way Source can load a program (compressed with
+    gzip and xz, memory-mapped, from stdin and as --code), and compares what
+    it printed with its .out file. Returns the number of mismatches.
+    """
+    import gzip
+    import lzma
+    from peep import Source
+    
+    base = splitext(file)[0]
+    input = base + ".in" if isfile(base + ".in") else os.devnull
+    
+    with open(base + ".out", encoding="utf-8") as fh:
+        expected = fh.read()
+    with open(file, "rb") as fh:
+        data = fh.read()
+    
+    failures = 0
+    
+    for buffer in [data, bytearray(data), memoryview(data)]:
+        if Source.from_bytes(buffer).text != data.decode("utf-8"):
+            failures += 1
+            print("FAIL (loader): Source.from_bytes decodes a {} of {} differently".format(type(buffer).__name__, file))
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        with gzip.open(join(tmp, "program.peep.gz"), "wb") as fh:
+            fh.write(data)
+        with lzma.open(join(tmp, "program.peep.xz"), "wb") as fh:
+            fh.write(data)
+        
+        runs = [
+            [join(tmp, "program.peep.gz")],
+            [join(tmp, "program.peep.xz")],
+            [file, "--mmap"],
+            ["-"],
+            ["-c", data.decode("utf-8")]
+        ]
+        
+        for source in runs:
+            argv = ["-i"] + source + ["--input", input, "--no-cache"]
+            
+            with patch("sys.stdin", io.TextIOWrapper(io.BytesIO(data), encoding="utf-8")):
+                actual = output(argv)
+            
+            if actual != expected:
+                failures += 1
+                print("FAIL (loader): peep {}\n--- expected\n{}--- got\n{}".format(" ".join(argv), expected, actual))
+    
+    return failures
+
+def check_inputs():
+    """
+    Runs a program scanning an int, a float, a bool and a string with every
+    engine, its input served by ListInput: pre-typed values, strings cast
+    like lines of input and values of another type, which have to end with
+    an InputCastingError. Returns the number of runs printing something else.
+    """
+    from peep import ListInput, MemorySink, PeepError, Source, format_error
+    from peep.__main__ import ENGINES, LEXERS, compile_code, i, parse
+    
+    source = Source.from_string("{\n    int n;\n    float f;\n    bool b;\n    string s;\n    scan(n);\n    print(n);\n"
+                                "    scan(f);\n    print(f);\n    scan(b);\n    print(b);\n    scan(s);\n    print(s);\n}\n", "scan_all")
+    
+    # a cast error is reported on the line the variable was declared on
+    cases = [
+        ([3, 1.5, True, "Bob"], "3\n1.5\ntrue\nBob\n"),
+        ([3, 2, False, "Bob"], "3\n2.0\nfalse\nBob\n"), # an int is also a float
+        (["3", "1.5", "true", "Bob"], "3\n1.5\ntrue\nBob\n"),
+        ([1.5], "InputCastingError @line 2: Cannot cast input to int\n\tat scan_all.__MAIN.2\n"),
+        ([True], "InputCastingError @line 2: Cannot cast input to int\n\tat scan_all.__MAIN.2\n"), # bool is not an int
+        ([3, "x"], "3\nInputCastingError @line 3: Cannot cast input to float\n\tat scan_all.__MAIN.3\n"),
+        ([3, 1.5, 1], "3\n1.5\nInputCastingError @line 4: Cannot cast input to bool\n\tat scan_all.__MAIN.4\n"),
+        ([3, 1.5, "yes"], "3\n1.5\nInputCastingError @line 4: Cannot cast input to bool\n\tat scan_all.__MAIN.4\n")
+    ]
+    
+    failures = 0
+    root = parse(source, LEXERS["regex"], None)
+    
+    for name, engine in ENGINES.items():
+        for values, expected in cases:
+            out = MemorySink()
+            
+            try:
+                i(root, engine, compile_code(root, engine, source, None), output=out, input=ListInput(values))
+            except PeepError as error:
+                out.write(format_error(error))
+            
+            if out.getvalue() != expected:
+                failures += 1
+                print("FAIL (input): ListInput({}) with --engine {}\n--- expected\n{}--- got\n{}".format(values, name, expected, out.getvalue()))
+    
+    return failures
+
+def check_sinks(file):
+    """
+    Runs file, which prints and then ends with a runtime error, with every
+    engine and way of buffering its output, printing to stdout and to a file
+    with --output. Whatever the buffer still holds has to be written out
+    before the error is reported. Then checks when a FileSink writes what it
+    was given. Returns the number of mismatches.
+    """
+    from peep import FileSink, PeepError, Source, format_error
+    from peep.__main__ import ENGINES, LEXERS, compile_code, i, parse
+    
+    with open(splitext(file)[0] + ".out", encoding="utf-8") as fh:
+        expected = fh.read()
+    
+    # the CLI reports the error on stdout after what the program printed
+    start = expected.index("Error @line")
+    start = expected.rfind("\n", 0, start) + 1
+    printed, error = expected[:start], expected[start:]
+    
+    failures = 0
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = join(tmp, "out.txt")
+        
+        for engine in ENGINES:
+            for buffering in [[], ["--buffer-size", "1"], ["--buffer-size", "1000000"], ["--unbuffered"]]:
+                for target in [[], ["--output", path]]:
+                    argv = ["-i", file, "--engine", engine, "--no-cache"] + buffering + target
+                    actual = output(argv)
+                    
+                    if target:
+                        with open(path, encoding="utf-8") as fh:
+                            actual = (fh.read(), actual)
+                    
+                    if actual != ((printed, error) if target else expected):
+                        failures += 1
+                        print("FAIL (sink): peep {}\n--- expected\n{}--- got\n{}".format(" ".join(argv), expected, actual))
+        
+        # callers of an engine read what it printed as soon as they catch the error
+        source = Source.from_file(file)
+        root = parse(source, LEXERS["regex"], None)
+        
+        for name, engine in ENGINES.items():
+            sink = FileSink(path, 1000000)
+            actual = None # the program ended without an error
+            
+            try:
+                i(root, engine, compile_code(root, engine, source, None), output=sink)
+            except PeepError as raised:
+                with open(path, encoding="utf-8") as fh:
+                    actual = (fh.read(), format_error(raised) + "\n")
+            
+            sink.close()
+            
+            if actual != (printed, error):
+                failures += 1
+                print("FAIL (sink): {} reported the error of {} before writing out {}".format(engine.__name__, file, actual))
+        
+        def written():
+            with open(path, encoding="utf-8") as fh:
+                return fh.read()
+        
+        sink = FileSink(path, 8)
+        sink.write("abc")
+        actual = [written()]
+        sink.write("defg") # 8 characters with the newlines
+        actual.append(written())
+        sink.write("h")
+        actual.append(written())
+        sink.close()
+        actual.append(written())
+        
+        sink = FileSink(path, 0)
+        sink.write("abc")
+        actual.append(written())
+        sink.close()
+        
+        if actual != ["", "abc\ndefg\n", "abc\ndefg\n", "abc\ndefg\nh\n", "abc\n"]:
+            failures += 1
+            print("FAIL (sink): FileSink wrote {}".format(actual))
+    
+    return failures
+
+def batch(argv, results):
+    """The results of the jobs peep batch runs with argv, written to the file results"""
+    from peep.batch import main
+    
+    with redirect_stderr(io.StringIO()): # the summary
+        main(argv + ["-o", results])
+    
+    with open(results, encoding="utf-8") as fh:
+        return sorted((json.loads(line) for line in fh), key=lambda result: result["job"])
+
+def check_batch(dirs, cache_dir):
+    """
+    Runs the programs in dirs with peep batch, with every engine and set of
+    flags, and compares what each job with a .out file printed (and the
+    error it ended with) with it. Returns the number of jobs which printed
+    something else.
+    """
+    failures = 0
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        for engine in ENGINES:
+            for flags in FLAGS:
+                argv = dirs + ["-j", "2", "--engine", engine, "--cache-dir", cache_dir] + flags
+                
+                for result in batch(argv, join(tmp, "results.jsonl")):
+                    base = splitext(result["program"])[0]
+                    if not isfile(base + ".out"):
+                        continue
+                    
+                    with open(base + ".out", encoding="utf-8") as fh:
+                        expected = fh.read()
+                    
+                    # the CLI prints the error a program ends with after its output
+                    error = result["stderr"] + "\n" if result["stderr"] else ""
+                    actual = result["stdout"] + (error if result["status"] == "error" else "")
+                    
+                    if actual != expected:
+                        failures += 1
+                        print("FAIL (batch, {}): peep batch {}\n--- expected\n{}--- got ({})\n{}".format(
+                            result["program"], " ".join(argv), expected, result["status"], result["stdout"] + error))
+    
+    return failures
+
+def check_timeout(cache_dir):
+    """
+    Runs a program with an input it never finishes with between two it
+    does, on a single worker which has to stop the job and then run the
+    program again. Returns the number of jobs ending differently.
+    """
+    failures = 0
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(join(tmp, "countdown.peep"), "w", encoding="utf-8") as fh:
+            fh.write("{\n    int n;\n    scan(n);\n    while (n != 0) {\n        n -= 1;\n    }\n    print(\"done\");\n}\n")
+        with open(join(tmp, "three.in"), "w", encoding="utf-8") as fh:
+            fh.write("3\n")
+        with open(join(tmp, "forever.in"), "w", encoding="utf-8") as fh:
+            fh.write("-1\n")
+        with open(join(tmp, "jobs.txt"), "w", encoding="utf-8") as fh:
+            fh.write("countdown.peep three.in\ncountdown.peep forever.in\ncountdown.peep three.in\n")
+        
+        for engine in ENGINES:
+            argv = [join(tmp, "jobs.txt"), "-j", "1", "--timeout", "0.2", "--engine", engine, "--cache-dir", cache_dir]
+            actual = [(result["status"], result["stdout"]) for result in batch(argv, join(tmp, "results.jsonl"))]
+            expected = [("ok", "done\n"), ("timeout", ""), ("ok", "done\n")]
+            
+            if actual != expected:
+                failures += 1
+                print("FAIL (timeout): peep batch {}\n--- expected\n{}\n--- got\n{}".format(" ".join(argv), expected, actual))
+    
+    return failures
+
 if __name__ == "__main__":
     sys.path.append(dirname(dirname(abspath(__file__))))
     current_dir = dirname(realpath(__file__))
+    failures = 0
+    dirs = []
+    programs = []
     
-    for v, dir in enumerate(os.listdir(current_dir)):
-        child_dir = join(current_dir, dir)
-        
-        if not isfile(child_dir):
-            print("VERSION {} TEST".format(v + 1))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for v, dir in enumerate(sorted(os.listdir(current_dir))):
+            child_dir = join(current_dir, dir)
             
-            for no, file in enumerate(os.listdir(child_dir)):
-                print("TEST {} (file={})".format(no + 1, file))
-                run(join(child_dir, file))
\ No newline at end of file
+            if not isfile(child_dir):
+                dirs.append(child_dir)
+                print("VERSION {} TEST".format(v + 1))
+                
+                for no, file in enumerate(sorted(f for f in os.listdir(child_dir) if f.endswith(".peep"))):
+                    print("TEST {} (file={})".format(no + 1, file))
+                    programs.append(join(child_dir, file))
+                    
+                    if isfile(join(child_dir, splitext(file)[0] + ".out")):
+                        failures += check(join(child_dir, file), cache_dir)
+                    else:
+                        run(join(child_dir, file))
+        
+        print("LEXER TEST")
+        failures += check_lexers(programs)
+        
+        print("LOADER TEST")
+        failures += check_loaders(join(current_dir, "v1", "final_test_v1.peep"))
+        
+        print("INPUT TEST")
+        failures += check_inputs()
+        
+        print("SINK TEST")
+        failures += check_sinks(join(current_dir, "engines", "mod_zero.peep"))
+        
+        print("BATCH TEST")
+        failures += check_batch(dirs, cache_dir)
+        failures += check_timeout(cache_dir)
+    
+    if failures:
+        print("{} runs printed something else than expected".format(failures))
+        sys.exit(1)